@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import zlib
+import sqlite3
+import contextlib
+import collections
+from CertDecoder import CertDecoder, DERParseException
+
+class CertCompressor():
+	# Stored certificate blobs are either raw DER (which always starts with a
+	# SEQUENCE tag, 0x30) or compressed, in which case they start with a zero
+	# marker byte, followed by the 16 bit big endian ID of the dictionary and
+	# a raw deflate stream that was compressed using that preset dictionary.
+	# Dictionary ID 0 denotes compression without a dictionary.
+	MARKER = 0x00
+	NO_DICTIONARY = 0
+	MAX_DICTIONARY_SIZE = 32768
+	_WBITS = -15
+
+	def __init__(self, dictionaries = None, level = 9):
+		self._dictionaries = dict(dictionaries) if (dictionaries is not None) else { }
+		self._level = level
+
+	@classmethod
+	def from_connection(cls, conn):
+		# Loads the dictionaries of a shard; shards without the table simply
+		# have no dictionaries.
+		dictionaries = { }
+		with contextlib.suppress(sqlite3.OperationalError):
+			dictionaries = dict(conn.execute("SELECT dict_id, dictionary FROM dictionaries;").fetchall())
+		return cls(dictionaries)
+
+	@property
+	def dictionary_ids(self):
+		return sorted(self._dictionaries)
+
+	def add_dictionary(self, dict_id, dictionary):
+		self._dictionaries[dict_id] = dictionary
+
+	def compress(self, der_cert, dict_id = NO_DICTIONARY):
+		# Falls back to the raw DER data if compression does not pay off
+		if dict_id == self.NO_DICTIONARY:
+			compressor = zlib.compressobj(self._level, zlib.DEFLATED, self._WBITS, 9)
+		else:
+			compressor = zlib.compressobj(self._level, zlib.DEFLATED, self._WBITS, 9, zlib.Z_DEFAULT_STRATEGY, self._dictionaries[dict_id])
+		compressed = bytes([ self.MARKER ]) + dict_id.to_bytes(2, byteorder = "big") + compressor.compress(der_cert) + compressor.flush()
+		return compressed if (len(compressed) < len(der_cert)) else der_cert
+
+	def decompress(self, blob):
+		if (len(blob) == 0) or (blob[0] != self.MARKER):
+			return blob
+		dict_id = int.from_bytes(blob[1 : 3], byteorder = "big")
+		if dict_id == self.NO_DICTIONARY:
+			decompressor = zlib.decompressobj(self._WBITS)
+		else:
+			decompressor = zlib.decompressobj(self._WBITS, zdict = self._dictionaries[dict_id])
+		return decompressor.decompress(blob[3:]) + decompressor.flush()
+
+	@classmethod
+	def _collect_elements(cls, der_cert, start, end, depth, elements):
+		# Adds all DER elements (complete TLV encodings) up to a small size,
+		# recursing into constructed ones
+		for (tag, content_start, content_end) in CertDecoder._der_children(der_cert, start, end):
+			encoded = der_cert[start : content_end]
+			if len(encoded) <= 256:
+				elements.add(encoded)
+			if (tag & 0x20) and (depth < 8):
+				cls._collect_elements(der_cert, content_start, content_end, depth + 1, elements)
+			elif (tag == 0x04) and (depth < 8):
+				# Extension values are DER wrapped in an OCTET STRING
+				with contextlib.suppress(DERParseException):
+					cls._collect_elements(der_cert, content_start, content_end, depth + 1, elements)
+			start = content_end
+
+	@classmethod
+	def train(cls, samples, size = MAX_DICTIONARY_SIZE):
+		# Builds a preset dictionary from DER elements (names, OIDs, algorithm
+		# identifiers, URLs, policies, ...) that recur across the sample
+		# certificates. Elements are scored by the bytes they would save and
+		# the best ones are placed last, closest to the data.
+		counts = collections.Counter()
+		for der_cert in samples:
+			elements = set()
+			with contextlib.suppress(DERParseException):
+				cls._collect_elements(der_cert, 0, len(der_cert), 0, elements)
+			counts.update(elements)
+		candidates = [ (count * len(element), element) for (element, count) in counts.items() if (count >= 2) and (len(element) >= 4) ]
+		candidates.sort(reverse = True)
+
+		chosen = [ ]
+		chosen_size = 0
+		for (score, element) in candidates:
+			if chosen_size + len(element) > size:
+				continue
+			# Elements contained in an already chosen one are redundant
+			if any(element in other for other in chosen):
+				continue
+			chosen.append(element)
+			chosen_size += len(element)
+		return b"".join(reversed(chosen))
@@ -9,16 +9,51 @@ import hashlib
 import contextlib
 import collections
 import datetime
-import subprocess
+import multiprocessing
 from CertStorage import CertStorage
+from CertCompressor import CertCompressor
+from CertRenderer import CertRenderer
+from CertIndex import CertIndex
+from CertDecoder import CertDecoder
+from CertScanner import CertScanner, open_readonly
+from CertVerifier import CertVerifier
+from CertMaintenance import CertMaintenance
+from CorpusIterator import CorpusIterator
+from PackedHashSet import PackedHashSet
+from ShardLayout import ShardLayout
+from CertResharder import CertResharder
+from CertStatistics import CertStatistics
+
+class CertDatabaseException(Exception): pass
 
 class CertDatabase():
 	_Connection = collections.namedtuple("Connection", [ "conn_id", "leaf_only", "fetch_timestamp", "servername", "certs" ])
+	_IngestResult = collections.namedtuple("IngestResult", [ "connection_count", "new_cert_count", "known_cert_count" ])
+
+	# Opt-in pragmas for loading large batches: WAL journaling, no fsync on
+	# every commit and a 256 MiB page cache per database
+	BULK_WRITE_PRAGMAS = {
+		"journal_mode":		"WAL",
+		"synchronous":		"NORMAL",
+		"cache_size":		-256 * 1024,
+		"temp_store":		"MEMORY",
+	}
 
-	def __init__(self, cert_storage_dir):
+	def __init__(self, cert_storage_dir, create_index = False, max_open_shards = 256, pragmas = None, shard_count = None):
 		self._conn = None
-		self._conn = sqlite3.connect(cert_storage_dir + "/toc.sqlite3")
+		self._index = None
+		# Shards are opened on first access and kept in a LRU of open handles
+		self._max_open_shards = max_open_shards
+		self._open_data_dbs = collections.OrderedDict()
+		self._cert_storage_dir = cert_storage_dir
+		self._pragmas = pragmas
+		self._known_hashes = None
+		self._toc_filename = cert_storage_dir + "/toc.sqlite3"
+		new_database = not os.path.exists(self._toc_filename)
+		self._conn = sqlite3.connect(self._toc_filename)
 		self._cursor = self._conn.cursor()
+		if self._pragmas is not None:
+			CertStorage.apply_pragmas(self._cursor, self._pragmas)
 		with contextlib.suppress(sqlite3.OperationalError):
 			self._cursor.execute("""
 			CREATE TABLE connections (
@@ -30,8 +65,78 @@ class CertDatabase():
 				UNIQUE(servername, fetch_timestamp)
 			);
 			""")
+		self._migrate_toc(initial_shard_count = shard_count if new_database else None)
+
+		self._layout = ShardLayout(int(self.get_metadata("shard_count")))
+		if (shard_count is not None) and (shard_count != self._layout.shard_count):
+			raise CertDatabaseException("%s uses %d shards, not %d; use reshard_db.py to change the layout." % (cert_storage_dir, self._layout.shard_count, shard_count))
+		self._shard_filenames = self._layout.shard_filenames(cert_storage_dir)
+
+		# The index is only maintained once it has been created
+		index_filename = cert_storage_dir + "/index.sqlite3"
+		if create_index or os.path.exists(index_filename):
+			self._index = CertIndex(index_filename)
+
+	def _migrate_toc(self, initial_shard_count = None):
+		# Schema changes of the TOC, tracked in SQLite's user_version
+		version = self._cursor.execute("PRAGMA user_version;").fetchone()[0]
+		if version < 1:
+			# Reverse index of certificates to the connections that presented
+			# them, backfilled from all existing connections. The unique
+			# constraint of connections already indexes (servername,
+			# fetch_timestamp).
+			self._cursor.execute("""
+			CREATE TABLE IF NOT EXISTS cert_refs (
+				cert_sha256 blob NOT NULL,
+				conn_id integer NOT NULL,
+				position integer NOT NULL,
+				PRIMARY KEY(cert_sha256, conn_id, position)
+			) WITHOUT ROWID;
+			""")
+			self._cursor.execute("DELETE FROM cert_refs;")
+			cursor = self._conn.cursor()
+			try:
+				for (conn_id, cert_hashes) in cursor.execute("SELECT conn_id, cert_hashes FROM connections;"):
+					self._insert_cert_refs(conn_id, cert_hashes)
+			finally:
+				cursor.close()
+			self._cursor.execute("PRAGMA user_version = 1;")
+			self._conn.commit()
+		if version < 2:
+			# Key/value metadata; databases created before have the original
+			# layout of 256 shards
+			self._cursor.execute("""
+			CREATE TABLE IF NOT EXISTS metadata (
+				key varchar PRIMARY KEY,
+				value varchar NOT NULL
+			);
+			""")
+			self._cursor.execute("INSERT OR IGNORE INTO metadata (key, value) VALUES ('shard_count', ?);", (str(initial_shard_count or ShardLayout.DEFAULT_SHARD_COUNT), ))
+			self._cursor.execute("PRAGMA user_version = 2;")
+			self._conn.commit()
+
+	def get_metadata(self, key):
+		row = self._cursor.execute("SELECT value FROM metadata WHERE key = ?;", (key, )).fetchone()
+		if row is not None:
+			return row[0]
+
+	def set_metadata(self, key, value):
+		self._cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?);", (key, str(value)))
 
-		self._data_dbs = [ CertStorage("%s/%02x.sqlite3" % (cert_storage_dir, i)) for i in range(256) ]
+	def _insert_cert_refs(self, conn_id, cert_hashconcat):
+		self._cursor.executemany("INSERT OR IGNORE INTO cert_refs (cert_sha256, conn_id, position) VALUES (?, ?, ?);", ((cert_hashconcat[i : i + 32], conn_id, i // 32) for i in range(0, len(cert_hashconcat), 32)))
+
+	@property
+	def layout(self):
+		return self._layout
+
+	@property
+	def toc_filename(self):
+		return self._toc_filename
+
+	@property
+	def index(self):
+		return self._index
 
 	@property
 	def connection_count(self):
@@ -39,7 +144,35 @@ class CertDatabase():
 
 	@property
 	def certificate_count(self):
-		return sum(data_db.certificate_count for data_db in self._data_dbs)
+		return sum(data_db.certificate_count for (dbid, data_db) in self._all_data_dbs())
+
+	def _data_db(self, dbid):
+		data_db = self._open_data_dbs.get(dbid)
+		if data_db is not None:
+			self._open_data_dbs.move_to_end(dbid)
+			return data_db
+		if len(self._open_data_dbs) >= self._max_open_shards:
+			# Closing the least recently used shard commits pending changes
+			(evicted_dbid, evicted_data_db) = self._open_data_dbs.popitem(last = False)
+			evicted_data_db.close()
+		data_db = CertStorage(self._shard_filenames[dbid], pragmas = self._pragmas)
+		self._open_data_dbs[dbid] = data_db
+		return data_db
+
+	def _existing_data_db(self, dbid):
+		# For reading: returns None instead of creating a shard that was never
+		# written to
+		if (dbid not in self._open_data_dbs) and (not os.path.exists(self._shard_filenames[dbid])):
+			return None
+		return self._data_db(dbid)
+
+	def _all_data_dbs(self):
+		# Yields (dbid, CertStorage) of all shards that were ever written to,
+		# without creating the others
+		for dbid in range(len(self._shard_filenames)):
+			data_db = self._existing_data_db(dbid)
+			if data_db is not None:
+				yield (dbid, data_db)
 
 	def get_connection(self, conn_id):
 		row = self._cursor.execute("SELECT leaf_only, fetch_timestamp, servername, cert_hashes FROM connections WHERE conn_id = ?;", (conn_id, )).fetchone()
@@ -50,10 +183,25 @@ class CertDatabase():
 		certs = [ self._get_cert(cert_hash) for cert_hash in cert_hashes ]
 		return self._Connection(conn_id = conn_id, leaf_only = leaf_only, fetch_timestamp = fetch_timestamp, servername = servername, certs = certs)
 
-	def get_connections_by_servername(self, servername):
-		conn_ids = self._cursor.execute("SELECT conn_id FROM connections WHERE servername = ? ORDER BY fetch_timestamp ASC;", (servername, )).fetchall()
-		for (conn_id, ) in conn_ids:
-			yield self.get_connection(conn_id)
+	def get_connections_by_servername(self, servername, hashes_only = False):
+		cursor = self._conn.cursor()
+		cursor.execute("SELECT conn_id, leaf_only, fetch_timestamp, servername, cert_hashes FROM connections WHERE servername = ? ORDER BY fetch_timestamp ASC;", (servername, ))
+		yield from self._materialize_connections(cursor, hashes_only = hashes_only)
+
+	def get_connections_by_cert(self, cert_hash, hashes_only = False):
+		# All connections that presented the certificate, oldest first. A
+		# hash prefix shorter than 32 bytes matches all certificates that
+		# start with it.
+		if len(cert_hash) == 32:
+			(condition, parameters) = ("cert_sha256 = ?", [ cert_hash ])
+		else:
+			(condition, parameters) = ("cert_sha256 >= ?", [ cert_hash ])
+			if cert_hash.strip(b"\xff") != b"":
+				condition += " AND cert_sha256 < ?"
+				parameters.append((int.from_bytes(cert_hash, byteorder = "big") + 1).to_bytes(len(cert_hash), byteorder = "big"))
+		cursor = self._conn.cursor()
+		cursor.execute("SELECT conn_id, leaf_only, fetch_timestamp, servername, cert_hashes FROM connections WHERE conn_id IN (SELECT conn_id FROM cert_refs WHERE %s) ORDER BY fetch_timestamp ASC;" % (condition), parameters)
+		yield from self._materialize_connections(cursor, hashes_only = hashes_only)
 
 	def get_all_referenced_hashes(self):
 		referenced_hashes = set()
@@ -62,48 +210,407 @@ class CertDatabase():
 			referenced_hashes |= set(cert_hashes[i : i + 32] for i in range(0, len(cert_hashes), 32))
 		return referenced_hashes
 
-	def get_all_stored_hashes(self):
-		stored_hashes = set()
-		for data_db in self._data_dbs:
-			stored_hashes |= data_db.get_all_cert_hashes()
-		return stored_hashes
+	def get_role_hashes(self, min_hash = None, max_hash = None, compact_threshold = 4 * 1024 * 1024):
+		# Returns two PackedHashSets of the referenced hashes within the given
+		# bounds: those that appear as the leaf (first certificate) of a
+		# connection and those that appear further up in a chain. A
+		# certificate can be in both.
+		role_sets = [ PackedHashSet(), PackedHashSet() ]
+		buffers = [ bytearray(), bytearray() ]
+		cursor = self._conn.cursor()
+		try:
+			for (cert_hashes, ) in cursor.execute("SELECT cert_hashes FROM connections;"):
+				for i in range(0, len(cert_hashes), 32):
+					cert_hash = cert_hashes[i : i + 32]
+					if ((min_hash is not None) and (cert_hash < min_hash)) or ((max_hash is not None) and (cert_hash >= max_hash)):
+						continue
+					role = 0 if (i == 0) else 1
+					buffers[role] += cert_hash
+					if len(buffers[role]) >= compact_threshold:
+						role_sets[role] = role_sets[role].union_packed(buffers[role])
+						buffers[role] = bytearray()
+		finally:
+			cursor.close()
+		return tuple(role_set.union_packed(buffer) for (role_set, buffer) in zip(role_sets, buffers))
+
+	@staticmethod
+	def _map_cert_hash(cert_sha256, der_cert):
+		return cert_sha256
+
+	def get_referenced_hash_partitions(self, compact_threshold = 4 * 1024 * 1024):
+		# Referenced hashes partitioned by shard, each
+		# partition a PackedHashSet. References are buffered packed and
+		# deduplicated whenever a partition's buffer exceeds the threshold.
+		partitions = [ PackedHashSet() for dbid in range(len(self._shard_filenames)) ]
+		buffers = [ bytearray() for dbid in range(len(self._shard_filenames)) ]
+		cursor = self._conn.cursor()
+		try:
+			for (cert_hashes, ) in cursor.execute("SELECT cert_hashes FROM connections;"):
+				for i in range(0, len(cert_hashes), 32):
+					dbid = self._layout.shard_of(cert_hashes[i : i + 2])
+					buffers[dbid] += cert_hashes[i : i + 32]
+					if len(buffers[dbid]) >= compact_threshold:
+						partitions[dbid] = partitions[dbid].union_packed(buffers[dbid])
+						buffers[dbid] = bytearray()
+		finally:
+			cursor.close()
+		for (dbid, buffer) in enumerate(buffers):
+			if len(buffer) > 0:
+				partitions[dbid] = partitions[dbid].union_packed(buffer)
+		return partitions
+
+	@staticmethod
+	def _find_unused_in_shard(work_unit):
+		# Merge join of the shard's primary key index against the sorted
+		# referenced hashes of that shard. Returns (dbid, stored count,
+		# unused hashes).
+		(dbid, sqlite_filename, referenced_packed) = work_unit
+		if not os.path.exists(sqlite_filename):
+			# Shards are only created when the first certificate goes there
+			return (dbid, 0, [ ])
+		conn = open_readonly(sqlite_filename)
+		try:
+			(stored_count, unused_hashes) = (0, [ ])
+			(ref_offset, ref_length) = (0, len(referenced_packed))
+			for (cert_hash, ) in conn.execute("SELECT cert_sha256 FROM certificates ORDER BY cert_sha256 ASC;"):
+				stored_count += 1
+				while (ref_offset < ref_length) and (referenced_packed[ref_offset : ref_offset + 32] < cert_hash):
+					ref_offset += 32
+				if (ref_offset >= ref_length) or (referenced_packed[ref_offset : ref_offset + 32] != cert_hash):
+					unused_hashes.append(cert_hash)
+			return (dbid, stored_count, unused_hashes)
+		finally:
+			conn.close()
+
+	def find_unused_hashes(self, referenced_partitions = None, processes = None):
+		# Yields (dbid, stored count, unused hashes) for every shard, shards
+		# are processed in parallel.
+		if referenced_partitions is None:
+			referenced_partitions = self.get_referenced_hash_partitions()
+		self.commit()
+		work_units = ((dbid, sqlite_filename, referenced_partitions[dbid].packed) for (dbid, sqlite_filename) in enumerate(self._shard_filenames))
+		with multiprocessing.Pool(processes = processes) as pool:
+			yield from pool.imap_unordered(self._find_unused_in_shard, work_units)
+
+	def verifier(self, report_filename = None, integrity_check = "quick", processes = None):
+		self.commit()
+		return CertVerifier(self._toc_filename, self._shard_filenames, self._layout, report_filename = report_filename, integrity_check = integrity_check, processes = processes)
+
+	def maintenance(self, state_filename = None, free_threshold = 0.1, change_threshold = 0.25, online = False, force = False, processes = None):
+		self.commit()
+		databases = [ ("toc", self._toc_filename, "connections") ]
+		databases += [ (self._layout.shard_name(dbid), sqlite_filename, "certificates") for (dbid, sqlite_filename) in enumerate(self._shard_filenames) ]
+		if self._index is not None:
+			databases.append(("index", self._cert_storage_dir + "/index.sqlite3", "certificates"))
+		if state_filename is None:
+			state_filename = self._cert_storage_dir + "/maintenance.json"
+		return CertMaintenance(databases, state_filename = state_filename, free_threshold = free_threshold, change_threshold = change_threshold, online = online, force = force, processes = processes)
+
+	def statistics(self, state_filename = None, force = False, processes = None):
+		self.commit()
+		if state_filename is None:
+			state_filename = self._cert_storage_dir + "/statistics.json"
+		return CertStatistics(self._toc_filename, self._shard_filenames, self._layout, state_filename = state_filename, force = force, processes = processes)
+
+	def resharder(self, shard_count, processes = None, batch_size = 5000):
+		# The database must be closed before the resharder is run, it swaps
+		# the shard files underneath
+		self.commit()
+		return CertResharder(self._cert_storage_dir, self._toc_filename, self._layout, ShardLayout(shard_count), processes = processes, batch_size = batch_size)
+
+	def get_all_stored_hashes(self, processes = None):
+		return set(self.scanner(processes = processes).scan(self._map_cert_hash))
+
+	def scanner(self, processes = None, rowids_per_unit = None):
+		# Workers read the shards through their own connections and therefore
+		# only see committed data.
+		self.commit()
+		return CertScanner(self._shard_filenames, processes = processes, rowids_per_unit = rowids_per_unit)
+
+	def corpus_iterator(self, partition = None, sample_rate = None, seed = 0, role = None):
+		return CorpusIterator(self, partition = partition, sample_rate = sample_rate, seed = seed, role = role)
 
 	def remove_cert_from_storage(self, cert_hash):
-		dbid = cert_hash[0]
-		cert_db = self._data_dbs[dbid]
-		cert_db.remove_cert_by_hash(cert_hash)
+		dbid = self._layout.shard_of(cert_hash)
+		cert_db = self._existing_data_db(dbid)
+		if cert_db is not None:
+			cert_db.remove_cert_by_hash(cert_hash)
+		if self._index is not None:
+			self._index.remove_cert_by_hash(cert_hash)
+		# Known hashes are reloaded on next use
+		self._known_hashes = None
 
 	def _get_cert(self, cert_hash):
-		dbid = cert_hash[0]
-		cert_db = self._data_dbs[dbid]
-		return cert_db.get_cert(cert_hash)
+		dbid = self._layout.shard_of(cert_hash)
+		cert_db = self._existing_data_db(dbid)
+		if cert_db is not None:
+			return cert_db.get_cert(cert_hash)
+
+	def get_certificate(self, cert_hash):
+		return self._get_cert(cert_hash)
 
 	def _insert_cert(self, der_cert):
-		cert_hash = hashlib.sha256(der_cert).digest()
-		dbid = cert_hash[0]
-		cert_db = self._data_dbs[dbid]
-		cert_db.add_cert(der_cert)
+		return self._insert_hashed_cert(hashlib.sha256(der_cert).digest(), der_cert)
+
+	def _insert_hashed_cert(self, cert_hash, der_cert):
+		dbid = self._layout.shard_of(cert_hash)
+		cert_db = self._data_db(dbid)
+		if cert_db.add_cert(der_cert, cert_sha256 = cert_hash):
+			if self._index is not None:
+				self._index.add_cert(der_cert)
+			if self._known_hashes is not None:
+				self._known_hashes.add(cert_hash)
 		return cert_hash
 
+	def build_index(self, processes = None, batch_size = 2500, progress_callback = None):
+		# Backfill the index from all shards, decoding certificates in parallel.
+		# Certificates are indexed in the order they are scanned in, so that
+		# searches (ordered by cert_id) match the scan and every rebuild.
+		if self._index is None:
+			self._index = CertIndex(self._cert_storage_dir + "/index.sqlite3")
+		indexed_count = 0
+		with multiprocessing.Pool(processes = processes) as pool:
+			for (dbid, data_db) in self._all_data_dbs():
+				missing = [ cert_hash for cert_hash in data_db.get_all_cert_hashes() if cert_hash not in self._index ]
+				for i in range(0, len(missing), batch_size):
+					der_certs = [ data_db.get_cert(cert_hash) for cert_hash in missing[i : i + batch_size] ]
+					for decoded_cert in pool.imap(CertDecoder.decode, der_certs, chunksize = 16):
+						self._index.add(decoded_cert)
+						indexed_count += 1
+					self._index.commit()
+				if progress_callback is not None:
+					progress_callback(dbid, indexed_count)
+		return indexed_count
+
+	@staticmethod
+	def _recode_shard(work_unit):
+		(dbid, sqlite_filename, compress, sample_size, dictionary_size, vacuum) = work_unit
+		data_db = CertStorage(sqlite_filename)
+		try:
+			if compress:
+				samples = data_db.get_sample_certificates(sample_size) if (dictionary_size > 0) else [ ]
+				data_db.add_dictionary(CertCompressor.train(samples, size = dictionary_size) if (len(samples) > 0) else b"")
+			(size_before, size_after) = data_db.recode(compress = compress)
+			data_db.commit()
+			if vacuum:
+				data_db.optimize()
+		finally:
+			data_db.close()
+		return (dbid, size_before, size_after)
+
+	def recode_storage(self, compress = True, sample_size = 2000, dictionary_size = CertCompressor.MAX_DICTIONARY_SIZE, vacuum = True, processes = None):
+		# Offline migration of all shards to compressed storage (with a
+		# dictionary trained on a sample of each shard's certificates) or back
+		# to raw DER. Yields (dbid, blob bytes before, blob bytes after).
+		self.commit()
+		for data_db in self._open_data_dbs.values():
+			data_db.close()
+		self._open_data_dbs.clear()
+		work_units = [ (dbid, sqlite_filename, compress, sample_size, dictionary_size, vacuum) for (dbid, sqlite_filename) in enumerate(self._shard_filenames) if os.path.exists(sqlite_filename) ]
+		with multiprocessing.Pool(processes = processes) as pool:
+			yield from pool.imap_unordered(self._recode_shard, work_units)
+
 	def get_all_certificates(self):
-		for data_db in self._data_dbs:
+		for (dbid, data_db) in self._all_data_dbs():
 			yield from data_db.get_all_certificates()
 
-	def get_all_connections(self, sort_order_asc = True):
-		for (conn_id, ) in self._cursor.execute("SELECT conn_id FROM connections ORDER BY fetch_timestamp %s;" % ("ASC" if sort_order_asc else "DESC")).fetchall():
-			yield self.get_connection(conn_id)
+	def get_all_sorted_certificates(self, min_hash = None, max_hash = None):
+		# Shards hold contiguous hash ranges, so this yields all
+		# (cert_sha256, der_cert) tuples in global hash order. With bounds,
+		# only the shards that overlap min_hash <= cert_sha256 < max_hash are
+		# read.
+		first_dbid = 0 if (min_hash is None) else self._layout.shard_of(min_hash)
+		last_dbid = len(self._shard_filenames) - 1 if (max_hash is None) else self._layout.shard_of(max_hash)
+		for dbid in range(first_dbid, last_dbid + 1):
+			data_db = self._existing_data_db(dbid)
+			if data_db is not None:
+				yield from data_db.get_sorted_certificates(min_hash = min_hash, max_hash = max_hash)
+
+	def _materialize_connections(self, cursor, batch_size = 1000, hashes_only = False):
+		# Streams TOC rows from the given cursor and fetches the certificates
+		# of a whole batch of connections with one query per shard. With
+		# hashes_only, certs contains the hashes of all certificates that are
+		# present in storage (and None for missing ones) instead of DER data.
+		try:
+			while True:
+				rows = cursor.fetchmany(batch_size)
+				if len(rows) == 0:
+					break
+				hashes_by_dbid = collections.defaultdict(set)
+				batch = [ ]
+				for (conn_id, leaf_only, fetch_timestamp, servername, cert_hashes) in rows:
+					cert_hashes = [ cert_hashes[i : i + 32] for i in range(0, len(cert_hashes), 32) ]
+					for cert_hash in cert_hashes:
+						hashes_by_dbid[self._layout.shard_of(cert_hash)].add(cert_hash)
+					batch.append((conn_id, leaf_only, fetch_timestamp, servername, cert_hashes))
+
+				certs_by_hash = { }
+				for (dbid, cert_hashes) in hashes_by_dbid.items():
+					data_db = self._existing_data_db(dbid)
+					if data_db is None:
+						continue
+					if hashes_only:
+						certs_by_hash.update((cert_hash, cert_hash) for cert_hash in data_db.get_present_hashes(cert_hashes))
+					else:
+						certs_by_hash.update(data_db.get_certs(cert_hashes))
+
+				for (conn_id, leaf_only, fetch_timestamp, servername, cert_hashes) in batch:
+					certs = [ certs_by_hash.get(cert_hash) for cert_hash in cert_hashes ]
+					yield self._Connection(conn_id = conn_id, leaf_only = leaf_only, fetch_timestamp = fetch_timestamp, servername = servername, certs = certs)
+		finally:
+			cursor.close()
+
+	def get_all_connections(self, sort_order_asc = True, batch_size = 1000, hashes_only = False):
+		cursor = self._conn.cursor()
+		cursor.execute("SELECT conn_id, leaf_only, fetch_timestamp, servername, cert_hashes FROM connections ORDER BY fetch_timestamp %s;" % ("ASC" if sort_order_asc else "DESC"))
+		yield from self._materialize_connections(cursor, batch_size = batch_size, hashes_only = hashes_only)
 
 	def get_most_recent_connections(self):
 		return self._cursor.execute("SELECT servername, MAX(fetch_timestamp) FROM connections GROUP BY servername;").fetchall()
 
+	def get_known_hashes(self):
+		# Shards hold contiguous hash ranges, so concatenating their
+		# sorted hashes in shard order gives a globally sorted set.
+		if self._known_hashes is None:
+			packed = b"".join(b"".join(data_db.get_sorted_cert_hashes()) for (dbid, data_db) in self._all_data_dbs())
+			self._known_hashes = PackedHashSet.from_packed(packed)
+		return self._known_hashes
+
+	def _flush_ingest(self, new_certs_by_dbid, toc_rows):
+		for (dbid, new_certs) in new_certs_by_dbid.items():
+			self._data_db(dbid).add_certs(new_certs)
+			if self._index is not None:
+				for (cert_hash, der_cert) in new_certs:
+					self._index.add_cert(der_cert)
+		for toc_row in toc_rows:
+			self._cursor.execute("INSERT OR IGNORE INTO connections (leaf_only, fetch_timestamp, servername, cert_hashes) VALUES (?, ?, ?, ?);", toc_row)
+			if self._cursor.rowcount == 1:
+				self._insert_cert_refs(self._cursor.lastrowid, toc_row[3])
+
+	def bulk_ingest(self, connections, batch_size = 10000):
+		# Connections are objects with servername, fetch_timestamp, certs and
+		# leaf_only attributes (e.g., connections of another CertDatabase).
+		# Certificates that are already stored are skipped using an in-memory
+		# set of known hashes before SQLite is touched at all.
+		known_hashes = self.get_known_hashes()
+		(connection_count, new_cert_count, known_cert_count) = (0, 0, 0)
+		new_certs_by_dbid = collections.defaultdict(list)
+		toc_rows = [ ]
+		for connection in connections:
+			cert_hashes = [ ]
+			for der_cert in connection.certs:
+				cert_hash = hashlib.sha256(der_cert).digest()
+				cert_hashes.append(cert_hash)
+				if cert_hash in known_hashes:
+					known_cert_count += 1
+				else:
+					known_hashes.add(cert_hash)
+					new_certs_by_dbid[self._layout.shard_of(cert_hash)].append((cert_hash, der_cert))
+					new_cert_count += 1
+			toc_rows.append((connection.leaf_only, connection.fetch_timestamp, connection.servername, b"".join(cert_hashes)))
+			connection_count += 1
+			if len(toc_rows) >= batch_size:
+				self._flush_ingest(new_certs_by_dbid, toc_rows)
+				new_certs_by_dbid = collections.defaultdict(list)
+				toc_rows = [ ]
+		self._flush_ingest(new_certs_by_dbid, toc_rows)
+		return self._IngestResult(connection_count = connection_count, new_cert_count = new_cert_count, known_cert_count = known_cert_count)
+
+	@property
+	def max_conn_id(self):
+		return self._cursor.execute("SELECT COALESCE(MAX(conn_id), 0) FROM connections;").fetchone()[0]
+
+	def conn_id_before(self, fetch_timestamp):
+		# Largest conn_id such that all later connections were fetched after
+		# the given timestamp
+		row = self._cursor.execute("SELECT MIN(conn_id) FROM connections WHERE fetch_timestamp > ?;", (fetch_timestamp, )).fetchone()
+		return self.max_conn_id if (row[0] is None) else row[0] - 1
+
+	def get_toc_entries(self, after_conn_id = 0):
+		# Raw TOC rows (conn_id, leaf_only, fetch_timestamp, servername,
+		# cert_hashes) in conn_id order
+		cursor = self._conn.cursor()
+		try:
+			yield from cursor.execute("SELECT conn_id, leaf_only, fetch_timestamp, servername, cert_hashes FROM connections WHERE conn_id > ? ORDER BY conn_id ASC;", (after_conn_id, ))
+		finally:
+			cursor.close()
+
+	def get_conn_ids_by_servername(self):
+		# All conn_ids ordered by server name (byte order of the UTF-8
+		# encoding), fetch timestamp and conn_id
+		cursor = self._conn.cursor()
+		try:
+			for (conn_id, ) in cursor.execute("SELECT conn_id FROM connections ORDER BY servername ASC, fetch_timestamp ASC, conn_id ASC;"):
+				yield conn_id
+		finally:
+			cursor.close()
+
+	def count_connections(self, max_conn_id):
+		return self._cursor.execute("SELECT COUNT(*) FROM connections WHERE conn_id <= ?;", (max_conn_id, )).fetchone()[0]
+
+	def is_cert_referenced(self, cert_hash, max_conn_id = None):
+		# Answered from the reverse index, optionally only considering
+		# connections up to max_conn_id
+		if max_conn_id is None:
+			row = self._cursor.execute("SELECT 1 FROM cert_refs WHERE cert_sha256 = ? LIMIT 1;", (cert_hash, )).fetchone()
+		else:
+			row = self._cursor.execute("SELECT 1 FROM cert_refs WHERE cert_sha256 = ? AND conn_id <= ? LIMIT 1;", (cert_hash, max_conn_id)).fetchone()
+		return row is not None
+
+	def add_toc_entries(self, toc_entries):
+		# Inserts raw TOC rows with their original conn_id, e.g., from a
+		# snapshot of another database. Conflicting rows raise
+		# sqlite3.IntegrityError. Returns the number of inserted rows.
+		inserted_count = 0
+		for (conn_id, leaf_only, fetch_timestamp, servername, cert_hashes) in toc_entries:
+			self._cursor.execute("INSERT INTO connections (conn_id, leaf_only, fetch_timestamp, servername, cert_hashes) VALUES (?, ?, ?, ?, ?);", (conn_id, leaf_only, fetch_timestamp, servername, cert_hashes))
+			self._insert_cert_refs(conn_id, cert_hashes)
+			inserted_count += 1
+		return inserted_count
+
+	def add_hashed_certificates(self, hashed_certs):
+		# Bulk insert of (cert_sha256, der_cert) tuples whose hashes the
+		# caller has verified; already stored certificates are skipped.
+		certs_by_dbid = collections.defaultdict(list)
+		for (cert_hash, der_cert) in hashed_certs:
+			certs_by_dbid[self._layout.shard_of(cert_hash)].append((cert_hash, der_cert))
+		new_certs_by_dbid = { }
+		for (dbid, certs) in certs_by_dbid.items():
+			present = self._data_db(dbid).get_present_hashes(cert_hash for (cert_hash, der_cert) in certs)
+			new_certs_by_dbid[dbid] = [ (cert_hash, der_cert) for (cert_hash, der_cert) in certs if cert_hash not in present ]
+		self._flush_ingest(new_certs_by_dbid, [ ])
+		if self._known_hashes is not None:
+			for new_certs in new_certs_by_dbid.values():
+				for (cert_hash, der_cert) in new_certs:
+					self._known_hashes.add(cert_hash)
+		return sum(len(new_certs) for new_certs in new_certs_by_dbid.values())
+
 	def insert_connection(self, servername, fetch_timestamp, certs, leaf_only = False):
 		cert_hashes = [ self._insert_cert(cert) for cert in certs ]
+		self._insert_toc_entry(servername, fetch_timestamp, cert_hashes, leaf_only)
+
+	def insert_hashed_connection(self, servername, fetch_timestamp, hashed_certs, leaf_only = False):
+		# Certificates are (cert_hash, der_cert) tuples with already computed
+		# hashes; der_cert is None for certificates known to be in storage.
+		cert_hashes = [ ]
+		for (cert_hash, der_cert) in hashed_certs:
+			if der_cert is not None:
+				self._insert_hashed_cert(cert_hash, der_cert)
+			cert_hashes.append(cert_hash)
+		self._insert_toc_entry(servername, fetch_timestamp, cert_hashes, leaf_only)
+
+	def _insert_toc_entry(self, servername, fetch_timestamp, cert_hashes, leaf_only):
 		cert_hashconcat = b"".join(cert_hashes)
 		with contextlib.suppress(sqlite3.IntegrityError):
 			self._cursor.execute("INSERT INTO connections (leaf_only, fetch_timestamp, servername, cert_hashes) VALUES (?, ?, ?, ?);", (leaf_only, fetch_timestamp, servername, cert_hashconcat))
+			self._insert_cert_refs(self._cursor.lastrowid, cert_hashconcat)
 
 	@classmethod
-	def dump_connection(self, connection):
+	def dump_connection(self, connection, renderer = None, text = False):
+		# Pass the same renderer for a series of connections so that
+		# certificates they share are rendered only once.
+		if renderer is None:
+			renderer = CertRenderer()
 		if connection is None:
 			print("No connection found.")
 			return
@@ -116,28 +623,50 @@ class CertDatabase():
 			if cert is None:
 				print("No certificate present, error fetching it from storage.")
 			else:
-				print(subprocess.check_output([ "openssl", "x509", "-inform", "der" ], input = cert).decode().rstrip())
+				cert_hash = hashlib.sha256(cert).digest()
+				if text:
+					print(renderer.text(cert_hash, cert).rstrip())
+				print(renderer.pem(cert_hash, cert))
 		print()
 
 	def optimize(self):
-		for data_db in self._data_dbs:
+		for (dbid, data_db) in self._all_data_dbs():
 			data_db.optimize()
+		self._conn.commit()
 		self._cursor.execute("VACUUM;")
 
 	def remove_connection(self, conn_id):
+		row = self._cursor.execute("SELECT cert_hashes FROM connections WHERE conn_id = ?;", (conn_id, )).fetchone()
+		if row is None:
+			return
+		cert_hashes = row[0]
+		self._cursor.executemany("DELETE FROM cert_refs WHERE cert_sha256 = ? AND conn_id = ?;", ((cert_hashes[i : i + 32], conn_id) for i in range(0, len(cert_hashes), 32)))
 		self._cursor.execute("DELETE FROM connections WHERE conn_id = ?;", (conn_id, ))
 
+	def attach_database(self, sqlite_filename, schema_name):
+		# Attaches another database file to the TOC connection and returns a
+		# cursor for it. Its writes are committed in the same transaction as
+		# the connections, atomically unless the TOC uses WAL journaling.
+		self._conn.commit()
+		self._cursor.execute("ATTACH DATABASE ? AS %s;" % (schema_name), (sqlite_filename, ))
+		return self._conn.cursor()
+
 	def commit(self):
-		for data_db in self._data_dbs:
+		for data_db in self._open_data_dbs.values():
 			data_db.commit()
+		if self._index is not None:
+			self._index.commit()
 		self._conn.commit()
 
 	def close(self):
 		if self._conn is None:
 			return
 		self.commit()
-		for data_db in self._data_dbs:
+		for data_db in self._open_data_dbs.values():
 			data_db.close()
+		self._open_data_dbs.clear()
+		if self._index is not None:
+			self._index.close()
 		self._cursor.close()
 		self._conn.close()
 		self._cursor = None
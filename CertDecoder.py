@@ -0,0 +1,407 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import re
+import base64
+import hashlib
+import calendar
+import datetime
+import subprocess
+import collections
+import ctypes
+import ctypes.util
+
+class DERParseException(Exception): pass
+
+# Module level so that decoded certificates can be passed between processes
+DecodedCert = collections.namedtuple("DecodedCert", [ "cert_sha256", "subject", "issuer", "serial", "not_before", "not_after", "key_algorithm", "key_size", "signature_algorithm", "san", "extension_oids", "text" ])
+CertSummary = collections.namedtuple("CertSummary", [ "issuer", "not_before", "not_after", "key_algorithm", "key_size", "signature_algorithm" ])
+
+class _LibCrypto():
+	# OpenSSL's text output of a certificate through libcrypto itself, so
+	# that rendering does not start an openssl process per certificate
+	BIO_CTRL_PENDING = 10
+	# XN_FLAG_ONELINE, the name format of "openssl x509 -text"
+	XN_FLAG_ONELINE = 0x82031f
+
+	def __init__(self, library_name):
+		lib = ctypes.CDLL(library_name)
+		lib.d2i_X509.restype = ctypes.c_void_p
+		lib.d2i_X509.argtypes = [ ctypes.c_void_p, ctypes.POINTER(ctypes.c_char_p), ctypes.c_long ]
+		lib.X509_free.argtypes = [ ctypes.c_void_p ]
+		lib.X509_print_ex.argtypes = [ ctypes.c_void_p, ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong ]
+		lib.BIO_s_mem.restype = ctypes.c_void_p
+		lib.BIO_new.restype = ctypes.c_void_p
+		lib.BIO_new.argtypes = [ ctypes.c_void_p ]
+		lib.BIO_free.argtypes = [ ctypes.c_void_p ]
+		lib.BIO_ctrl.restype = ctypes.c_long
+		lib.BIO_ctrl.argtypes = [ ctypes.c_void_p, ctypes.c_int, ctypes.c_long, ctypes.c_void_p ]
+		lib.BIO_read.argtypes = [ ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int ]
+		self._lib = lib
+
+	@classmethod
+	def load(cls):
+		library_name = ctypes.util.find_library("crypto")
+		if library_name is None:
+			return None
+		try:
+			return cls(library_name)
+		except (OSError, AttributeError):
+			return None
+
+	def render_text(self, der_cert):
+		data = ctypes.c_char_p(der_cert)
+		x509 = self._lib.d2i_X509(None, ctypes.byref(data), len(der_cert))
+		if not x509:
+			raise DERParseException("OpenSSL cannot parse certificate.")
+		bio = self._lib.BIO_new(self._lib.BIO_s_mem())
+		try:
+			if self._lib.X509_print_ex(bio, x509, self.XN_FLAG_ONELINE, 0) != 1:
+				raise DERParseException("OpenSSL cannot print certificate.")
+			length = self._lib.BIO_ctrl(bio, self.BIO_CTRL_PENDING, 0, None)
+			buf = ctypes.create_string_buffer(length)
+			self._lib.BIO_read(bio, buf, length)
+			return buf.raw.decode("utf-8", errors = "replace")
+		finally:
+			self._lib.BIO_free(bio)
+			self._lib.X509_free(x509)
+
+class CertDecoder():
+	# Structural fields (serial, validity, extension OIDs) are taken directly
+	# from the DER encoding, everything that needs OID or key knowledge comes
+	# from the OpenSSL text representation, which is rendered once per cert.
+	_SUBJECT_RE = re.compile(r"^\s+Subject: (.*)$", flags = re.MULTILINE)
+	_ISSUER_RE = re.compile(r"^\s+Issuer: (.*)$", flags = re.MULTILINE)
+	_KEY_ALGORITHM_RE = re.compile(r"^\s+Public Key Algorithm: (.*)$", flags = re.MULTILINE)
+	_KEY_SIZE_RE = re.compile(r"^\s+(?:RSA |DSA |EC )?Public-Key: \((\d+) bit\)$", flags = re.MULTILINE)
+	_SIGNATURE_ALGORITHM_RE = re.compile(r"^\s+Signature Algorithm: (.*)$", flags = re.MULTILINE)
+	_SAN_RE = re.compile(r"^\s+X509v3 Subject Alternative Name:.*\n\s+(.*)$", flags = re.MULTILINE)
+	# None if only the openssl binary can be used
+	_libcrypto = _LibCrypto.load()
+
+	# Names as OpenSSL prints them, so that summaries match the index
+	_NAME_ATTRIBUTES = {
+		"2.5.4.3":						"CN",
+		"2.5.4.5":						"serialNumber",
+		"2.5.4.6":						"C",
+		"2.5.4.7":						"L",
+		"2.5.4.8":						"ST",
+		"2.5.4.9":						"street",
+		"2.5.4.10":						"O",
+		"2.5.4.11":						"OU",
+		"2.5.4.15":						"businessCategory",
+		"2.5.4.17":						"postalCode",
+		"1.2.840.113549.1.9.1":			"emailAddress",
+		"0.9.2342.19200300.100.1.25":	"DC",
+		"1.3.6.1.4.1.311.60.2.1.3":		"jurisdictionC",
+		"2.5.4.97":						"organizationIdentifier",
+	}
+	_KEY_ALGORITHMS = {
+		"1.2.840.113549.1.1.1":			"rsaEncryption",
+		"1.2.840.113549.1.1.10":		"rsassaPss",
+		"1.2.840.10045.2.1":			"id-ecPublicKey",
+		"1.2.840.10040.4.1":			"dsaEncryption",
+		"1.3.101.112":					"ED25519",
+		"1.3.101.113":					"ED448",
+	}
+	_CURVE_SIZES = {
+		"1.2.840.10045.3.1.1":			192,
+		"1.3.132.0.33":					224,
+		"1.2.840.10045.3.1.7":			256,
+		"1.3.132.0.10":					256,
+		"1.3.132.0.34":					384,
+		"1.3.132.0.35":					521,
+	}
+	_SIGNATURE_ALGORITHMS = {
+		"1.2.840.113549.1.1.2":			"md2WithRSAEncryption",
+		"1.2.840.113549.1.1.4":			"md5WithRSAEncryption",
+		"1.2.840.113549.1.1.5":			"sha1WithRSAEncryption",
+		"1.2.840.113549.1.1.10":		"rsassaPss",
+		"1.2.840.113549.1.1.11":		"sha256WithRSAEncryption",
+		"1.2.840.113549.1.1.12":		"sha384WithRSAEncryption",
+		"1.2.840.113549.1.1.13":		"sha512WithRSAEncryption",
+		"1.2.840.113549.1.1.14":		"sha224WithRSAEncryption",
+		"1.2.840.10045.4.1":			"ecdsa-with-SHA1",
+		"1.2.840.10045.4.3.1":			"ecdsa-with-SHA224",
+		"1.2.840.10045.4.3.2":			"ecdsa-with-SHA256",
+		"1.2.840.10045.4.3.3":			"ecdsa-with-SHA384",
+		"1.2.840.10045.4.3.4":			"ecdsa-with-SHA512",
+		"1.2.840.10040.4.3":			"dsaWithSHA1",
+		"2.16.840.1.101.3.4.3.2":		"dsa_with_SHA256",
+		"1.3.101.112":					"ED25519",
+		"1.3.101.113":					"ED448",
+	}
+	_STRING_ENCODINGS = {
+		0x0c:	"utf-8",
+		0x13:	"ascii",
+		0x14:	"latin-1",
+		0x16:	"ascii",
+		0x1c:	"utf-32-be",
+		0x1e:	"utf-16-be",
+	}
+
+	@staticmethod
+	def _der_tlv(data, offset):
+		if offset + 2 > len(data):
+			raise DERParseException("Truncated DER header at offset %d." % (offset))
+		tag = data[offset]
+		length = data[offset + 1]
+		offset += 2
+		if length & 0x80:
+			length_bytes = length & 0x7f
+			if (length_bytes == 0) or (offset + length_bytes > len(data)):
+				raise DERParseException("Invalid DER length at offset %d." % (offset))
+			length = int.from_bytes(data[offset : offset + length_bytes], byteorder = "big")
+			offset += length_bytes
+		if offset + length > len(data):
+			raise DERParseException("DER content exceeds data at offset %d." % (offset))
+		return (tag, offset, offset + length)
+
+	@classmethod
+	def _der_children(cls, data, start, end):
+		children = [ ]
+		while start < end:
+			(tag, content_start, content_end) = cls._der_tlv(data, start)
+			children.append((tag, content_start, content_end))
+			start = content_end
+		return children
+
+	@staticmethod
+	def _decode_oid(encoded):
+		values = [ ]
+		value = 0
+		for byte in encoded:
+			value = (value << 7) | (byte & 0x7f)
+			if not (byte & 0x80):
+				values.append(value)
+				value = 0
+		if len(values) == 0:
+			return ""
+		first = values[0]
+		if first < 40:
+			prefix = [ 0, first ]
+		elif first < 80:
+			prefix = [ 1, first - 40 ]
+		else:
+			prefix = [ 2, first - 80 ]
+		return ".".join(str(value) for value in prefix + values[1:])
+
+	@staticmethod
+	def _decode_time(tag, encoded):
+		text = encoded.decode("ascii")
+		if text.endswith("Z"):
+			text = text[:-1]
+		if tag == 0x17:
+			# UTCTime, two-digit year
+			year = int(text[0 : 2])
+			year += 1900 if (year >= 50) else 2000
+			text = str(year) + text[2:]
+		if len(text) == 12:
+			text += "00"
+		ts = datetime.datetime.strptime(text[:14], "%Y%m%d%H%M%S")
+		return calendar.timegm(ts.utctimetuple())
+
+	@classmethod
+	def _tbs_elements(cls, der_cert):
+		# TBSCertificate elements without the explicit version
+		(tag, start, end) = cls._der_tlv(der_cert, 0)
+		(tag, tbs_start, tbs_end) = cls._der_tlv(der_cert, start)
+		tbs = cls._der_children(der_cert, tbs_start, tbs_end)
+		if (len(tbs) > 0) and (tbs[0][0] == 0xa0):
+			# Explicit version present
+			tbs = tbs[1:]
+		if len(tbs) < 6:
+			raise DERParseException("TBSCertificate has too few elements.")
+		return tbs
+
+	@classmethod
+	def _decode_validity(cls, der_cert, validity):
+		validity = cls._der_children(der_cert, validity[1], validity[2])
+		(not_before, not_after) = (cls._decode_time(tag, der_cert[start : end]) for (tag, start, end) in validity[:2])
+		return (not_before, not_after)
+
+	@classmethod
+	def _decode_extensions(cls, der_cert, tbs):
+		# Returns an ordered dictionary of extension OID to the (start, end)
+		# offsets of the extension value
+		extensions = collections.OrderedDict()
+		for (tag, start, end) in tbs[6:]:
+			if tag != 0xa3:
+				continue
+			(tag, seq_start, seq_end) = cls._der_tlv(der_cert, start)
+			for (tag, ext_start, ext_end) in cls._der_children(der_cert, seq_start, seq_end):
+				children = cls._der_children(der_cert, ext_start, ext_end)
+				oid = cls._decode_oid(der_cert[children[0][1] : children[0][2]])
+				extensions[oid] = (children[-1][1], children[-1][2])
+		return extensions
+
+	@classmethod
+	def _decode_san(cls, der_cert, start, end):
+		# Formatted like OpenSSL does, None for name types that are not
+		# handled here
+		names = [ ]
+		(tag, names_start, names_end) = cls._der_tlv(der_cert, start)
+		for (tag, name_start, name_end) in cls._der_children(der_cert, names_start, names_end):
+			value = der_cert[name_start : name_end]
+			if tag == 0x82:
+				names.append("DNS:" + value.decode("latin-1"))
+			elif tag == 0x81:
+				names.append("email:" + value.decode("latin-1"))
+			elif tag == 0x86:
+				names.append("URI:" + value.decode("latin-1"))
+			elif (tag == 0x87) and (len(value) == 4):
+				names.append("IP Address:" + ".".join(str(byte) for byte in value))
+			elif (tag == 0x87) and (len(value) == 16):
+				names.append("IP Address:" + ":".join("%X" % (int.from_bytes(value[i : i + 2], byteorder = "big")) for i in range(0, 16, 2)))
+			else:
+				return None
+		return ", ".join(names)
+
+	@classmethod
+	def decode_structure(cls, der_cert):
+		# Returns (serial hex, not_before, not_after, extension OIDs)
+		tbs = cls._tbs_elements(der_cert)
+		(serial, signature, issuer, validity, subject, spki) = tbs[:6]
+		serial = der_cert[serial[1] : serial[2]].hex()
+		(not_before, not_after) = cls._decode_validity(der_cert, validity)
+		extension_oids = list(cls._decode_extensions(der_cert, tbs))
+		return (serial, not_before, not_after, extension_oids)
+
+	@staticmethod
+	def _escape_name_value(value):
+		# Like OpenSSL's default name output: control characters and non-ASCII
+		# bytes of the UTF-8 encoding as \XX, quotes around values with
+		# special characters
+		escaped = [ ]
+		for byte in value.encode("utf-8"):
+			if (byte < 0x20) or (byte >= 0x7f):
+				escaped.append("\\%02X" % (byte))
+			elif chr(byte) in "\"\\":
+				escaped.append("\\" + chr(byte))
+			else:
+				escaped.append(chr(byte))
+		escaped = "".join(escaped)
+		if any(char in escaped for char in ",+<>;"):
+			escaped = "\"" + escaped + "\""
+		return escaped
+
+	@classmethod
+	def _decode_name(cls, der_cert, name):
+		rdns = [ ]
+		for (tag, rdn_start, rdn_end) in cls._der_children(der_cert, name[1], name[2]):
+			components = [ ]
+			for (tag, attr_start, attr_end) in cls._der_children(der_cert, rdn_start, rdn_end):
+				((oid_tag, oid_start, oid_end), (value_tag, value_start, value_end)) = cls._der_children(der_cert, attr_start, attr_end)[:2]
+				oid = cls._decode_oid(der_cert[oid_start : oid_end])
+				value = der_cert[value_start : value_end].decode(cls._STRING_ENCODINGS.get(value_tag, "latin-1"), errors = "replace")
+				components.append("%s = %s" % (cls._NAME_ATTRIBUTES.get(oid, oid), cls._escape_name_value(value)))
+			rdns.append(" + ".join(components))
+		return ", ".join(rdns)
+
+	@classmethod
+	def _decode_key(cls, der_cert, spki):
+		# Returns (key algorithm, key size in bits)
+		((algid_tag, algid_start, algid_end), (key_tag, key_start, key_end)) = cls._der_children(der_cert, spki[1], spki[2])[:2]
+		algid = cls._der_children(der_cert, algid_start, algid_end)
+		oid = cls._decode_oid(der_cert[algid[0][1] : algid[0][2]])
+		parameters = algid[1] if (len(algid) > 1) else None
+		# Skip the unused bits byte of the BIT STRING
+		key_start += 1
+		key_size = None
+		if oid in [ "1.2.840.113549.1.1.1", "1.2.840.113549.1.1.10" ]:
+			(tag, seq_start, seq_end) = cls._der_tlv(der_cert, key_start)
+			(tag, modulus_start, modulus_end) = cls._der_tlv(der_cert, seq_start)
+			key_size = int.from_bytes(der_cert[modulus_start : modulus_end], byteorder = "big").bit_length()
+		elif oid == "1.2.840.10045.2.1":
+			if (parameters is not None) and (parameters[0] == 0x06):
+				key_size = cls._CURVE_SIZES.get(cls._decode_oid(der_cert[parameters[1] : parameters[2]]))
+			if key_size is None:
+				# Uncompressed point, 0x04 || x || y
+				key_size = (key_end - key_start - 1) // 2 * 8
+		elif oid == "1.2.840.10040.4.1":
+			if (parameters is not None) and (parameters[0] == 0x30):
+				(tag, p_start, p_end) = cls._der_tlv(der_cert, parameters[1])
+				key_size = int.from_bytes(der_cert[p_start : p_end], byteorder = "big").bit_length()
+		elif oid == "1.3.101.112":
+			key_size = 256
+		elif oid == "1.3.101.113":
+			key_size = 456
+		return (cls._KEY_ALGORITHMS.get(oid, oid), key_size)
+
+	@classmethod
+	def decode_summary(cls, der_cert):
+		# The fields that corpus statistics need, taken from the DER encoding
+		# alone so that no OpenSSL process has to be started
+		tbs = cls._tbs_elements(der_cert)
+		(serial, signature, issuer, validity, subject, spki) = tbs[:6]
+		(tag, oid_start, oid_end) = cls._der_tlv(der_cert, signature[1])
+		signature_algorithm = cls._decode_oid(der_cert[oid_start : oid_end])
+		(not_before, not_after) = cls._decode_validity(der_cert, validity)
+		(key_algorithm, key_size) = cls._decode_key(der_cert, spki)
+		return CertSummary(issuer = cls._decode_name(der_cert, issuer), not_before = not_before, not_after = not_after, key_algorithm = key_algorithm,
+				key_size = key_size, signature_algorithm = cls._SIGNATURE_ALGORITHMS.get(signature_algorithm, signature_algorithm))
+
+	@staticmethod
+	def render_pem(der_cert):
+		b64 = base64.b64encode(der_cert).decode("ascii")
+		lines = [ "-----BEGIN CERTIFICATE-----" ]
+		lines += [ b64[i : i + 64] for i in range(0, len(b64), 64) ]
+		lines.append("-----END CERTIFICATE-----")
+		return "\n".join(lines)
+
+	@classmethod
+	def render_text(cls, der_cert):
+		# Raises DERParseException or subprocess.CalledProcessError if
+		# OpenSSL refuses the certificate
+		if cls._libcrypto is None:
+			return subprocess.check_output([ "openssl", "x509", "-inform", "der", "-text", "-noout" ], input = der_cert, stderr = subprocess.DEVNULL).decode("utf-8", errors = "replace")
+		return cls._libcrypto.render_text(der_cert)
+
+	@classmethod
+	def _search(cls, regex, text):
+		match = regex.search(text)
+		if match is None:
+			return None
+		return match.group(1).strip()
+
+	@classmethod
+	def _decode_from_text(cls, cert_sha256, text):
+		# For certificates that the DER decoder does not understand
+		key_size = cls._search(cls._KEY_SIZE_RE, text)
+		if key_size is not None:
+			key_size = int(key_size)
+		return DecodedCert(cert_sha256 = cert_sha256, subject = cls._search(cls._SUBJECT_RE, text), issuer = cls._search(cls._ISSUER_RE, text),
+				serial = None, not_before = None, not_after = None, key_algorithm = cls._search(cls._KEY_ALGORITHM_RE, text),
+				key_size = key_size, signature_algorithm = cls._search(cls._SIGNATURE_ALGORITHM_RE, text), san = cls._search(cls._SAN_RE, text),
+				extension_oids = [ ], text = text)
+
+	@classmethod
+	def decode(cls, der_cert):
+		cert_sha256 = hashlib.sha256(der_cert).digest()
+		try:
+			text = cls.render_text(der_cert)
+		except (DERParseException, subprocess.CalledProcessError):
+			# OpenSSL refuses to parse this certificate, index what we can.
+			text = ""
+		try:
+			tbs = cls._tbs_elements(der_cert)
+			(serial, signature, issuer, validity, subject, spki) = tbs[:6]
+			(tag, oid_start, oid_end) = cls._der_tlv(der_cert, signature[1])
+			signature_algorithm = cls._decode_oid(der_cert[oid_start : oid_end])
+			(not_before, not_after) = cls._decode_validity(der_cert, validity)
+			(key_algorithm, key_size) = cls._decode_key(der_cert, spki)
+			extensions = cls._decode_extensions(der_cert, tbs)
+			san = None
+			if "2.5.29.17" in extensions:
+				san = cls._decode_san(der_cert, *extensions["2.5.29.17"])
+				if san is None:
+					# Name types that are not decoded here
+					san = cls._search(cls._SAN_RE, text)
+		except (DERParseException, ValueError, IndexError):
+			return cls._decode_from_text(cert_sha256, text)
+		return DecodedCert(cert_sha256 = cert_sha256, subject = cls._decode_name(der_cert, subject), issuer = cls._decode_name(der_cert, issuer),
+				serial = der_cert[serial[1] : serial[2]].hex(), not_before = not_before, not_after = not_after, key_algorithm = key_algorithm,
+				key_size = key_size, signature_algorithm = cls._SIGNATURE_ALGORITHMS.get(signature_algorithm, signature_algorithm), san = san,
+				extension_oids = list(extensions), text = text)
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import hashlib
+from PackedHashSet import PackedHashSet
+
+class CertDeduplicator():
+	# Used by scrape workers to avoid shipping certificates to the writer that
+	# are already stored. The set of known hashes is loaded once before the
+	# workers are forked and is then shared read-only; certificates that a
+	# worker has shipped itself are remembered locally on top of that.
+	def __init__(self, known_hashes = None):
+		self._known_hashes = known_hashes if (known_hashes is not None) else PackedHashSet()
+		self._shipped = set()
+
+	def _is_known(self, cert_hash):
+		return (cert_hash in self._shipped) or (cert_hash in self._known_hashes)
+
+	def dedupe(self, der_certs):
+		# Returns (cert_hash, der_cert) tuples in which der_cert is None if
+		# the certificate does not need to be shipped.
+		hashed_certs = [ ]
+		for der_cert in der_certs:
+			cert_hash = hashlib.sha256(der_cert).digest()
+			hashed_certs.append((cert_hash, None if self._is_known(cert_hash) else der_cert))
+		return hashed_certs
+
+	def mark_shipped(self, hashed_certs):
+		# Only call this once the result has been handed to the queue, so that
+		# the DER data always reaches the writer before any bare reference.
+		self._shipped.update(cert_hash for (cert_hash, der_cert) in hashed_certs if der_cert is not None)
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import re
+import sqlite3
+import contextlib
+import collections
+from CertDecoder import CertDecoder
+
+class CertIndex():
+	_IndexedCert = collections.namedtuple("IndexedCert", [ "cert_sha256", "subject", "issuer", "serial", "not_before", "not_after", "key_algorithm", "key_size", "signature_algorithm", "san", "extension_oids", "text" ])
+	_SUBSTRING_FIELDS = ( "subject", "issuer", "san", "key_algorithm", "signature_algorithm" )
+	_REGEX_FLAGS = re.MULTILINE | re.IGNORECASE
+
+	def __init__(self, sqlite_filename):
+		self._conn = sqlite3.connect(sqlite_filename)
+		self._conn.create_function("REGEXP", 2, self._regexp, deterministic = True)
+		self._cursor = self._conn.cursor()
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute("""
+			CREATE TABLE certificates (
+				cert_id integer PRIMARY KEY,
+				cert_sha256 blob NOT NULL UNIQUE,
+				subject varchar NULL,
+				issuer varchar NULL,
+				serial varchar NULL,
+				not_before integer NULL,
+				not_after integer NULL,
+				key_algorithm varchar NULL,
+				key_size integer NULL,
+				signature_algorithm varchar NULL,
+				san varchar NULL,
+				text varchar NOT NULL
+			);
+			""")
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute("""
+			CREATE TABLE extensions (
+				cert_id integer NOT NULL,
+				oid varchar NOT NULL,
+				UNIQUE(cert_id, oid)
+			);
+			""")
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute("CREATE INDEX extensions_oid_idx ON extensions(oid);")
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute("CREATE VIRTUAL TABLE certificates_fts USING fts5(subject, issuer, san, text, content = 'certificates', content_rowid = 'cert_id');")
+
+	@staticmethod
+	def _regexp(pattern, value):
+		if value is None:
+			return False
+		return re.search(pattern, value, flags = CertIndex._REGEX_FLAGS) is not None
+
+	@property
+	def certificate_count(self):
+		return self._cursor.execute("SELECT COUNT(*) FROM certificates;").fetchone()[0]
+
+	def __contains__(self, cert_sha256):
+		return self._cursor.execute("SELECT 1 FROM certificates WHERE cert_sha256 = ?;", (cert_sha256, )).fetchone() is not None
+
+	def add(self, decoded_cert):
+		try:
+			self._cursor.execute("INSERT INTO certificates (cert_sha256, subject, issuer, serial, not_before, not_after, key_algorithm, key_size, signature_algorithm, san, text) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+				(decoded_cert.cert_sha256, decoded_cert.subject, decoded_cert.issuer, decoded_cert.serial, decoded_cert.not_before, decoded_cert.not_after, decoded_cert.key_algorithm, decoded_cert.key_size, decoded_cert.signature_algorithm, decoded_cert.san, decoded_cert.text))
+		except sqlite3.IntegrityError:
+			# Already indexed
+			return False
+		cert_id = self._cursor.lastrowid
+		self._cursor.executemany("INSERT OR IGNORE INTO extensions (cert_id, oid) VALUES (?, ?);", [ (cert_id, oid) for oid in decoded_cert.extension_oids ])
+		self._cursor.execute("INSERT INTO certificates_fts (rowid, subject, issuer, san, text) VALUES (?, ?, ?, ?, ?);", (cert_id, decoded_cert.subject, decoded_cert.issuer, decoded_cert.san, decoded_cert.text))
+		return True
+
+	def add_cert(self, der_cert):
+		return self.add(CertDecoder.decode(der_cert))
+
+	def remove_cert_by_hash(self, cert_sha256):
+		row = self._cursor.execute("SELECT cert_id, subject, issuer, san, text FROM certificates WHERE cert_sha256 = ?;", (cert_sha256, )).fetchone()
+		if row is None:
+			return
+		(cert_id, subject, issuer, san, text) = row
+		self._cursor.execute("INSERT INTO certificates_fts (certificates_fts, rowid, subject, issuer, san, text) VALUES ('delete', ?, ?, ?, ?, ?);", (cert_id, subject, issuer, san, text))
+		self._cursor.execute("DELETE FROM extensions WHERE cert_id = ?;", (cert_id, ))
+		self._cursor.execute("DELETE FROM certificates WHERE cert_id = ?;", (cert_id, ))
+
+	def get(self, cert_sha256):
+		row = self._cursor.execute("SELECT cert_id, cert_sha256, subject, issuer, serial, not_before, not_after, key_algorithm, key_size, signature_algorithm, san, text FROM certificates WHERE cert_sha256 = ?;", (cert_sha256, )).fetchone()
+		if row is None:
+			return None
+		(cert_id, *fields, text) = row
+		extension_oids = [ oid for (oid, ) in self._cursor.execute("SELECT oid FROM extensions WHERE cert_id = ? ORDER BY rowid ASC;", (cert_id, )).fetchall() ]
+		return self._IndexedCert(*fields, extension_oids = extension_oids, text = text)
+
+	def get_text(self, cert_sha256):
+		row = self._cursor.execute("SELECT text FROM certificates WHERE cert_sha256 = ?;", (cert_sha256, )).fetchone()
+		if row is not None:
+			return row[0]
+
+	def search(self, regex = None, fulltext = None, serial = None, key_size = None, extension_oid = None, **substring_fields):
+		# All given criteria must match. Substring fields match
+		# case-insensitively, regex is applied to the OpenSSL text
+		# representation and fulltext is an FTS5 query expression.
+		conditions = [ ]
+		parameters = [ ]
+		for (field, value) in substring_fields.items():
+			if field not in self._SUBSTRING_FIELDS:
+				raise TypeError("Unknown search field: %s" % (field))
+			if value is not None:
+				conditions.append("certificates.%s LIKE ?" % (field))
+				parameters.append("%" + value + "%")
+		if serial is not None:
+			conditions.append("LTRIM(certificates.serial, '0') = LTRIM(?, '0')")
+			parameters.append(serial.replace(":", "").lower())
+		if key_size is not None:
+			conditions.append("certificates.key_size = ?")
+			parameters.append(key_size)
+		if extension_oid is not None:
+			conditions.append("certificates.cert_id IN (SELECT cert_id FROM extensions WHERE oid = ?)")
+			parameters.append(extension_oid)
+		if fulltext is not None:
+			conditions.append("certificates.cert_id IN (SELECT rowid FROM certificates_fts WHERE certificates_fts MATCH ?)")
+			parameters.append(fulltext)
+		if regex is not None:
+			# Validate the pattern before handing it to SQLite
+			re.compile(regex, flags = self._REGEX_FLAGS)
+			conditions.append("certificates.text REGEXP ?")
+			parameters.append(regex)
+
+		query = "SELECT certificates.cert_sha256 FROM certificates"
+		if len(conditions) > 0:
+			query += " WHERE " + " AND ".join(conditions)
+		query += " ORDER BY certificates.cert_id ASC;"
+		cursor = self._conn.cursor()
+		try:
+			for (cert_sha256, ) in cursor.execute(query, parameters):
+				yield cert_sha256
+		finally:
+			cursor.close()
+
+	def commit(self):
+		self._conn.commit()
+
+	def close(self):
+		if self._conn is None:
+			return
+		self.commit()
+		self._cursor.close()
+		self._conn.close()
+		self._cursor = None
+		self._conn = None
+
+	def __del__(self):
+		self.close()
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import json
+import time
+import sqlite3
+import collections
+import multiprocessing
+from CertScanner import open_readonly
+
+# Module level so that they can be passed between processes
+MaintenanceUnit = collections.namedtuple("MaintenanceUnit", [ "name", "sqlite_filename", "table", "action", "incremental_steps" ])
+DatabaseStats = collections.namedtuple("DatabaseStats", [ "file_size", "page_size", "page_count", "freelist_count", "change_counter", "auto_vacuum", "row_count" ])
+
+class CertMaintenance():
+	# Maintains all databases of a CertDatabase in parallel, but only those
+	# that need it. After every run the statistics of each file (SQLite's
+	# file change counter, page and free page counts, row count) are stored
+	# in a JSON state file. The next run skips unchanged files, rebuilds
+	# files whose free page ratio or whose row count change since the last
+	# rebuild exceeds a threshold and only re-analyzes the other changed
+	# ones. In online mode nothing is rebuilt; free pages are released by
+	# incremental vacuum in small steps, so readers wait at most for one
+	# short write transaction.
+	AUTO_VACUUM_INCREMENTAL = 2
+
+	def __init__(self, databases, state_filename = None, free_threshold = 0.1, change_threshold = 0.25, online = False, force = False, processes = None):
+		# databases is a list of (name, sqlite_filename, table) tuples; the
+		# table's row count is tracked to detect changes
+		self._databases = databases
+		self._state_filename = state_filename
+		self._free_threshold = free_threshold
+		self._change_threshold = change_threshold
+		self._online = online
+		self._force = force
+		self._processes = processes
+		self._state = { }
+		if (self._state_filename is not None) and os.path.exists(self._state_filename):
+			with open(self._state_filename) as f:
+				self._state = json.load(f)
+
+	@staticmethod
+	def inspect(sqlite_filename, table):
+		with open(sqlite_filename, "rb") as f:
+			header = f.read(28)
+		change_counter = int.from_bytes(header[24 : 28], byteorder = "big")
+		conn = open_readonly(sqlite_filename)
+		try:
+			(page_size, page_count, freelist_count, auto_vacuum) = (conn.execute("PRAGMA %s;" % (pragma)).fetchone()[0] for pragma in [ "page_size", "page_count", "freelist_count", "auto_vacuum" ])
+			row_count = conn.execute("SELECT COUNT(*) FROM %s;" % (table)).fetchone()[0]
+		finally:
+			conn.close()
+		return DatabaseStats(file_size = os.stat(sqlite_filename).st_size, page_size = page_size, page_count = page_count, freelist_count = freelist_count, change_counter = change_counter, auto_vacuum = auto_vacuum, row_count = row_count)
+
+	def _plan_action(self, name, stats):
+		free_ratio = stats.freelist_count / stats.page_count if (stats.page_count > 0) else 0
+		previous = self._state.get(name)
+		if self._force:
+			changed = True
+		elif previous is None:
+			changed = True
+		else:
+			changed = any(previous[field] != getattr(stats, field) for field in [ "file_size", "page_count", "freelist_count", "change_counter", "row_count" ])
+		if previous is None:
+			row_change_ratio = 0
+		else:
+			rebuilt_row_count = previous["rebuilt_row_count"]
+			row_change_ratio = abs(stats.row_count - rebuilt_row_count) / max(1, rebuilt_row_count)
+
+		if self._online:
+			if (free_ratio >= self._free_threshold) and (stats.auto_vacuum == self.AUTO_VACUUM_INCREMENTAL):
+				return "incremental_vacuum"
+			return "analyze" if changed else "skip"
+		if self._force or (free_ratio >= self._free_threshold) or (row_change_ratio >= self._change_threshold):
+			return "vacuum"
+		return "analyze" if changed else "skip"
+
+	def plan(self):
+		# Returns a list of (MaintenanceUnit, DatabaseStats)
+		units = [ ]
+		for (name, sqlite_filename, table) in self._databases:
+			if not os.path.exists(sqlite_filename):
+				continue
+			stats = self.inspect(sqlite_filename, table)
+			units.append((MaintenanceUnit(name = name, sqlite_filename = sqlite_filename, table = table, action = self._plan_action(name, stats), incremental_steps = 64), stats))
+		return units
+
+	@classmethod
+	def _maintain(cls, unit):
+		t0 = time.time()
+		size_before = os.stat(unit.sqlite_filename).st_size
+		conn = sqlite3.connect(unit.sqlite_filename, isolation_level = None)
+		try:
+			if unit.action == "vacuum":
+				# Also switches the file to incremental auto vacuum so that
+				# later online runs can release free pages
+				conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+				conn.execute("VACUUM;")
+				conn.execute("ANALYZE;")
+			elif unit.action == "incremental_vacuum":
+				while conn.execute("PRAGMA freelist_count;").fetchone()[0] > 0:
+					conn.execute("PRAGMA incremental_vacuum(%d);" % (unit.incremental_steps))
+			if unit.action in [ "incremental_vacuum", "analyze" ]:
+				# Approximate statistics are good enough and quick to gather
+				conn.execute("PRAGMA analysis_limit = 1000;")
+				conn.execute("ANALYZE;")
+		finally:
+			conn.close()
+		stats = cls.inspect(unit.sqlite_filename, unit.table)
+		return (unit, stats, size_before, time.time() - t0)
+
+	def _write_state(self):
+		if self._state_filename is None:
+			return
+		tmp_filename = self._state_filename + ".tmp"
+		with open(tmp_filename, "w") as f:
+			json.dump(self._state, f, indent = 4, sort_keys = True)
+		os.rename(tmp_filename, self._state_filename)
+
+	def _record(self, name, stats, rebuilt):
+		previous = self._state.get(name, { })
+		entry = stats._asdict()
+		entry["rebuilt_row_count"] = stats.row_count if (rebuilt or ("rebuilt_row_count" not in previous)) else previous["rebuilt_row_count"]
+		entry["maintained"] = int(time.time())
+		self._state[name] = entry
+
+	def run(self):
+		# Yields (name, action, bytes before, bytes after, seconds) for every
+		# database, including skipped ones
+		pending_units = [ ]
+		for (unit, stats) in self.plan():
+			if unit.action == "skip":
+				yield (unit.name, unit.action, stats.file_size, stats.file_size, 0)
+			else:
+				pending_units.append(unit)
+		with multiprocessing.Pool(processes = self._processes) as pool:
+			for (unit, stats, size_before, duration) in pool.imap_unordered(self._maintain, pending_units):
+				self._record(unit.name, stats, rebuilt = (unit.action == "vacuum"))
+				self._write_state()
+				yield (unit.name, unit.action, size_before, stats.file_size, duration)
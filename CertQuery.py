@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import re
+import json
+import time
+import base64
+import socket
+import signal
+import sqlite3
+import asyncio
+import threading
+import contextlib
+import collections
+import concurrent.futures
+from CertDatabase import CertDatabase
+
+class CertQueryException(Exception): pass
+
+def default_socket_filename(cert_storage_dir):
+	return cert_storage_dir + "/query.sock"
+
+class CertQueryServer():
+	# Answers lookups from one long-running process over a Unix socket.
+	# Requests and responses are JSON objects, one per line. Lookups run on
+	# a pool of worker threads that each hold their own CertDatabase (Sqlite3
+	# connections cannot be shared between threads), so that open shards and
+	# their page caches stay warm between requests. Certificates are also
+	# kept in a LRU that all workers share.
+	_OPERATIONS = ( "status", "connection", "servername", "cert", "search", "certificate", "indexed_text" )
+
+	def __init__(self, cert_storage_dir, socket_filename = None, threads = 4, cache_size = 16384, pragmas = None):
+		self._cert_storage_dir = cert_storage_dir
+		self._socket_filename = socket_filename or default_socket_filename(cert_storage_dir)
+		self._threads = threads
+		self._cache_size = cache_size
+		self._pragmas = pragmas
+		self._local = threading.local()
+		self._cache = collections.OrderedDict()
+		self._lock = threading.Lock()
+		self._request_counts = collections.Counter()
+		self._cache_hits = 0
+		self._cache_misses = 0
+		self._started = time.time()
+
+		# Opening it once in the main thread runs any pending migrations
+		certdb = CertDatabase(self._cert_storage_dir, pragmas = self._pragmas)
+		self._have_index = certdb.index is not None
+		certdb.close()
+
+	@property
+	def socket_filename(self):
+		return self._socket_filename
+
+	def _certdb(self):
+		certdb = getattr(self._local, "certdb", None)
+		if certdb is None:
+			certdb = CertDatabase(self._cert_storage_dir, pragmas = self._pragmas)
+			self._local.certdb = certdb
+		return certdb
+
+	def _get_certificate(self, certdb, cert_hash):
+		with self._lock:
+			der_cert = self._cache.get(cert_hash)
+			if der_cert is not None:
+				self._cache.move_to_end(cert_hash)
+				self._cache_hits += 1
+				return der_cert
+			self._cache_misses += 1
+		der_cert = certdb.get_certificate(cert_hash)
+		if der_cert is not None:
+			with self._lock:
+				self._cache[cert_hash] = der_cert
+				if len(self._cache) > self._cache_size:
+					self._cache.popitem(last = False)
+		return der_cert
+
+	def _encode_connection(self, certdb, connection, resolve_hashes = True):
+		# With resolve_hashes, the certs of the connection are hashes and the
+		# certificates themselves come from the LRU. Otherwise, they are sent
+		# as they are (DER data or hashes).
+		certs = [ ]
+		for cert in connection.certs:
+			if cert is None:
+				certs.append(None)
+			elif resolve_hashes:
+				der_cert = self._get_certificate(certdb, cert)
+				certs.append(None if (der_cert is None) else base64.b64encode(der_cert).decode("ascii"))
+			else:
+				certs.append(base64.b64encode(cert).decode("ascii"))
+		return {
+			"conn_id":			connection.conn_id,
+			"leaf_only":		bool(connection.leaf_only),
+			"fetch_timestamp":	connection.fetch_timestamp,
+			"servername":		connection.servername,
+			"certs":			certs,
+		}
+
+	def _index(self, certdb):
+		if certdb.index is None:
+			raise CertQueryException("The certificate database has no index.")
+		return certdb.index
+
+	def _op_status(self, certdb, request):
+		with self._lock:
+			return {
+				"cert_storage_dir":	self._cert_storage_dir,
+				"index":			self._have_index,
+				"uptime":			time.time() - self._started,
+				"requests":			dict(self._request_counts),
+				"cache_size":		len(self._cache),
+				"cache_hits":		self._cache_hits,
+				"cache_misses":		self._cache_misses,
+			}
+
+	def _op_connection(self, certdb, request):
+		connection = certdb.get_connection(int(request["conn_id"]))
+		return None if (connection is None) else self._encode_connection(certdb, connection, resolve_hashes = False)
+
+	def _op_servername(self, certdb, request):
+		return [ self._encode_connection(certdb, connection) for connection in certdb.get_connections_by_servername(request["servername"], hashes_only = True) ]
+
+	def _op_cert(self, certdb, request):
+		hashes_only = bool(request.get("hashes_only", False))
+		return [ self._encode_connection(certdb, connection, resolve_hashes = not hashes_only) for connection in certdb.get_connections_by_cert(bytes.fromhex(request["cert_hash"]), hashes_only = True) ]
+
+	def _op_search(self, certdb, request):
+		index = self._index(certdb)
+		criteria = request.get("criteria", { })
+		limit = request.get("limit")
+		matches = [ ]
+		for cert_sha256 in index.search(**criteria):
+			if (limit is not None) and (len(matches) >= limit):
+				break
+			matches.append((cert_sha256.hex(), index.get(cert_sha256).subject))
+		return matches
+
+	def _op_certificate(self, certdb, request):
+		der_cert = self._get_certificate(certdb, bytes.fromhex(request["cert_hash"]))
+		return None if (der_cert is None) else base64.b64encode(der_cert).decode("ascii")
+
+	def _op_indexed_text(self, certdb, request):
+		return self._index(certdb).get_text(bytes.fromhex(request["cert_hash"]))
+
+	def _execute(self, request):
+		# Runs in a worker thread
+		operation = request.get("op")
+		if operation not in self._OPERATIONS:
+			return { "ok": False, "error": "Unknown operation: %s" % (operation) }
+		with self._lock:
+			self._request_counts[operation] += 1
+		try:
+			result = getattr(self, "_op_" + operation)(self._certdb(), request)
+		except (CertQueryException, KeyError, TypeError, ValueError, re.error, sqlite3.Error) as e:
+			return { "ok": False, "error": "%s: %s" % (e.__class__.__name__, str(e)) }
+		return { "ok": True, "result": result }
+
+	async def _handle_client(self, reader, writer):
+		loop = asyncio.get_running_loop()
+		try:
+			while True:
+				line = await reader.readline()
+				if len(line) == 0:
+					break
+				try:
+					request = json.loads(line)
+				except ValueError:
+					response = { "ok": False, "error": "Malformed request." }
+				else:
+					response = await loop.run_in_executor(self._executor, self._execute, request)
+				writer.write(json.dumps(response).encode("utf-8") + b"\n")
+				await writer.drain()
+		except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+			pass
+		finally:
+			writer.close()
+
+	def _remove_stale_socket(self):
+		if not os.path.exists(self._socket_filename):
+			return
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+			try:
+				sock.connect(self._socket_filename)
+			except (ConnectionRefusedError, FileNotFoundError):
+				os.unlink(self._socket_filename)
+				return
+		raise CertQueryException("A query daemon is already listening on %s." % (self._socket_filename))
+
+	async def serve(self):
+		self._remove_stale_socket()
+		loop = asyncio.get_running_loop()
+		stop = loop.create_future()
+		for signum in [ signal.SIGINT, signal.SIGTERM ]:
+			loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+		with concurrent.futures.ThreadPoolExecutor(max_workers = self._threads) as self._executor:
+			server = await asyncio.start_unix_server(self._handle_client, path = self._socket_filename, limit = 1024 * 1024)
+			try:
+				await stop
+			finally:
+				server.close()
+				await server.wait_closed()
+				with contextlib.suppress(FileNotFoundError):
+					os.unlink(self._socket_filename)
+
+	def run(self):
+		asyncio.run(self.serve())
+
+class CertQueryClient():
+	# Synchronous client for CertQueryServer. Returned connections look just
+	# like the ones from CertDatabase.
+	def __init__(self, socket_filename, timeout = 60):
+		self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			self._sock.settimeout(timeout)
+			self._sock.connect(socket_filename)
+		except OSError:
+			self._sock.close()
+			raise
+		self._file = self._sock.makefile("rwb")
+
+	@classmethod
+	def connect(cls, socket_filename, timeout = 60):
+		# Returns None if no daemon is running
+		try:
+			return cls(socket_filename, timeout = timeout)
+		except (FileNotFoundError, ConnectionRefusedError):
+			return None
+
+	def _request(self, operation, **parameters):
+		parameters["op"] = operation
+		self._file.write(json.dumps(parameters).encode("utf-8") + b"\n")
+		self._file.flush()
+		line = self._file.readline()
+		if len(line) == 0:
+			raise CertQueryException("Query daemon closed the connection.")
+		response = json.loads(line)
+		if not response["ok"]:
+			raise CertQueryException(response["error"])
+		return response["result"]
+
+	@staticmethod
+	def _decode_connection(encoded):
+		certs = [ None if (cert is None) else base64.b64decode(cert) for cert in encoded["certs"] ]
+		return CertDatabase._Connection(conn_id = encoded["conn_id"], leaf_only = encoded["leaf_only"], fetch_timestamp = encoded["fetch_timestamp"], servername = encoded["servername"], certs = certs)
+
+	def status(self):
+		return self._request("status")
+
+	@property
+	def has_index(self):
+		return self.status()["index"]
+
+	def get_connection(self, conn_id):
+		encoded = self._request("connection", conn_id = conn_id)
+		return None if (encoded is None) else self._decode_connection(encoded)
+
+	def get_connections_by_servername(self, servername):
+		return [ self._decode_connection(encoded) for encoded in self._request("servername", servername = servername) ]
+
+	def get_connections_by_cert(self, cert_hash, hashes_only = False):
+		return [ self._decode_connection(encoded) for encoded in self._request("cert", cert_hash = cert_hash.hex(), hashes_only = hashes_only) ]
+
+	def search(self, limit = None, **criteria):
+		# Returns a list of (cert_sha256, subject) tuples
+		return [ (bytes.fromhex(cert_sha256), subject) for (cert_sha256, subject) in self._request("search", criteria = criteria, limit = limit) ]
+
+	def get_certificate(self, cert_hash):
+		encoded = self._request("certificate", cert_hash = cert_hash.hex())
+		return None if (encoded is None) else base64.b64decode(encoded)
+
+	def get_indexed_text(self, cert_hash):
+		return self._request("indexed_text", cert_hash = cert_hash.hex())
+
+	def close(self):
+		self._file.close()
+		self._sock.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
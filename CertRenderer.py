@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import sqlite3
+import contextlib
+import collections
+from CertDecoder import CertDecoder
+
+class CertRenderer():
+	# Renders certificates as PEM (in-process) or as OpenSSL text. Renderings
+	# are content-addressed by the certificate's SHA256 and kept in a LRU
+	# cache, so that intermediates that appear in many connections are only
+	# rendered once. Optionally, renderings are persisted in a Sqlite3 file
+	# and reused across runs.
+	_RENDER_FUNCTIONS = {
+		"pem":	CertDecoder.render_pem,
+		"text":	CertDecoder.render_text,
+	}
+
+	def __init__(self, cache_size = 4096, cache_filename = None):
+		self._cache_size = cache_size
+		self._cache = collections.OrderedDict()
+		self._hits = 0
+		self._misses = 0
+		self._conn = None
+		if cache_filename is not None:
+			self._conn = sqlite3.connect(cache_filename)
+			with contextlib.suppress(sqlite3.OperationalError):
+				self._conn.execute("""
+				CREATE TABLE renderings (
+					cert_sha256 blob NOT NULL,
+					format varchar NOT NULL,
+					rendering varchar NOT NULL,
+					PRIMARY KEY(cert_sha256, format)
+				) WITHOUT ROWID;
+				""")
+
+	@property
+	def hits(self):
+		return self._hits
+
+	@property
+	def misses(self):
+		return self._misses
+
+	def _lookup(self, key):
+		rendering = self._cache.get(key)
+		if rendering is not None:
+			self._cache.move_to_end(key)
+			return rendering
+		if self._conn is not None:
+			row = self._conn.execute("SELECT rendering FROM renderings WHERE cert_sha256 = ? AND format = ?;", key).fetchone()
+			if row is not None:
+				self._store(key, row[0])
+				return row[0]
+		return None
+
+	def _store(self, key, rendering):
+		self._cache[key] = rendering
+		if len(self._cache) > self._cache_size:
+			self._cache.popitem(last = False)
+
+	def render(self, cert_sha256, der_cert, format = "pem"):
+		key = (cert_sha256, format)
+		rendering = self._lookup(key)
+		if rendering is not None:
+			self._hits += 1
+			return rendering
+		self._misses += 1
+		rendering = self._RENDER_FUNCTIONS[format](der_cert)
+		self._store(key, rendering)
+		if self._conn is not None:
+			self._conn.execute("INSERT OR REPLACE INTO renderings (cert_sha256, format, rendering) VALUES (?, ?, ?);", (cert_sha256, format, rendering))
+		return rendering
+
+	def pem(self, cert_sha256, der_cert):
+		return self.render(cert_sha256, der_cert, format = "pem")
+
+	def text(self, cert_sha256, der_cert):
+		return self.render(cert_sha256, der_cert, format = "text")
+
+	def close(self):
+		if self._conn is not None:
+			self._conn.commit()
+			self._conn.close()
+			self._conn = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import contextlib
+import collections
+import multiprocessing
+from CertStorage import CertStorage
+from CertScanner import open_readonly
+from CertCompressor import CertCompressor
+from ShardLayout import ShardLayout
+
+class CertResharderException(Exception): pass
+
+# Module level so that they can be passed between processes
+ReshardUnit = collections.namedtuple("ReshardUnit", [ "shard", "layout", "target_filename", "source_filenames", "min_hash", "max_hash", "batch_size" ])
+
+class CertResharder():
+	# Migrates the shards of a CertDatabase to a different shard count. Each
+	# worker builds one target shard in a staging directory, streaming the
+	# certificates of its hash range in hash order from the source shards
+	# that overlap it, so memory use is bounded by the batch size. Every
+	# certificate is decompressed and rehashed on the way and every target
+	# shard is read back and counted once it is written. Finished shards are
+	# recorded in a JSON state file, an interrupted run only redoes the
+	# others. When all target shards are complete and the total count
+	# matches, they are moved into place, the shard count in the TOC is
+	# switched (the point of no return) and the old shards are removed,
+	# together with the per-shard entries of the maintenance and statistics
+	# state files, whose shard names no longer refer to the same files. A
+	# target shard keeps the compression of its source shards: plain deflate
+	# if they used it, a dictionary trained on the first certificates of its
+	# range if they had trained dictionaries.
+	DICTIONARY_SAMPLE_SIZE = 2000
+
+	def __init__(self, cert_storage_dir, toc_filename, source_layout, target_layout, processes = None, batch_size = 5000):
+		self._cert_storage_dir = cert_storage_dir
+		self._toc_filename = toc_filename
+		self._staging_dir = cert_storage_dir + "/reshard.tmp"
+		self._state_filename = cert_storage_dir + "/reshard.json"
+		self._processes = processes
+		self._batch_size = batch_size
+		if os.path.exists(self._state_filename):
+			with open(self._state_filename) as f:
+				self._state = json.load(f)
+			if self._state["target_shard_count"] != target_layout.shard_count:
+				raise CertResharderException("An interrupted migration to %d shards is pending; finish it first or remove %s and %s." % (self._state["target_shard_count"], self._state_filename, self._staging_dir))
+		else:
+			self._state = {
+				"source_shard_count":	source_layout.shard_count,
+				"target_shard_count":	target_layout.shard_count,
+				"phase":				"build",
+				"shards":				{ },
+			}
+		self._source_layout = ShardLayout(self._state["source_shard_count"])
+		self._target_layout = ShardLayout(self._state["target_shard_count"])
+
+	@property
+	def phase(self):
+		return self._state["phase"]
+
+	def _write_state(self):
+		tmp_filename = self._state_filename + ".tmp"
+		with open(tmp_filename, "w") as f:
+			json.dump(self._state, f, indent = 4, sort_keys = True)
+		os.rename(tmp_filename, self._state_filename)
+
+	def _source_shards(self, min_hash, max_hash):
+		first = 0 if (min_hash is None) else self._source_layout.shard_of(min_hash)
+		last = self._source_layout.shard_count - 1
+		if max_hash is not None:
+			last = self._source_layout.shard_of(max_hash)
+			if self._source_layout.hash_range(last)[0] == max_hash:
+				last -= 1
+		return range(first, last + 1)
+
+	def _units(self):
+		source_filenames = self._source_layout.shard_filenames(self._cert_storage_dir)
+		target_filenames = self._target_layout.shard_filenames(self._staging_dir)
+		for shard in range(self._target_layout.shard_count):
+			if self._target_layout.shard_name(shard) in self._state["shards"]:
+				continue
+			(min_hash, max_hash) = self._target_layout.hash_range(shard)
+			yield ReshardUnit(shard = shard, layout = self._target_layout, target_filename = target_filenames[shard], source_filenames = [ source_filenames[source_shard] for source_shard in self._source_shards(min_hash, max_hash) ], min_hash = min_hash, max_hash = max_hash, batch_size = self._batch_size)
+
+	@classmethod
+	def _create_target(cls, unit, dictionary_ids, batch):
+		target = CertStorage(unit.target_filename)
+		if any(dict_id != CertCompressor.NO_DICTIONARY for dict_id in dictionary_ids):
+			# Certificates arrive in hash order, which is independent of their
+			# content, so the first batch is a fair sample
+			samples = [ der_cert for (cert_sha256, der_cert) in batch[:cls.DICTIONARY_SAMPLE_SIZE] ]
+			target.add_dictionary(CertCompressor.train(samples))
+		elif len(dictionary_ids) > 0:
+			target.add_dictionary(b"")
+		return target
+
+	@classmethod
+	def _build_shard(cls, unit):
+		t0 = time.time()
+		for suffix in [ "", "-journal" ]:
+			# Leftover of an interrupted run
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(unit.target_filename + suffix)
+		(conditions, parameters) = ([ ], [ ])
+		if unit.min_hash is not None:
+			conditions.append("cert_sha256 >= ?")
+			parameters.append(unit.min_hash)
+		if unit.max_hash is not None:
+			conditions.append("cert_sha256 < ?")
+			parameters.append(unit.max_hash)
+		query = "SELECT cert_sha256, der_cert FROM certificates"
+		if len(conditions) > 0:
+			query += " WHERE " + " AND ".join(conditions)
+		query += " ORDER BY cert_sha256 ASC;"
+
+		(source_count, target_count, mismatches) = (0, 0, [ ])
+		source_filenames = [ source_filename for source_filename in unit.source_filenames if os.path.exists(source_filename) ]
+		dictionary_ids = set()
+		for source_filename in source_filenames:
+			conn = open_readonly(source_filename)
+			try:
+				dictionary_ids |= set(CertCompressor.from_connection(conn).dictionary_ids)
+			finally:
+				conn.close()
+
+		# Like in the database, shards without certificates are not created
+		target = None
+		try:
+			batch = [ ]
+			for source_filename in source_filenames:
+				conn = open_readonly(source_filename)
+				try:
+					compressor = CertCompressor.from_connection(conn)
+					for (cert_sha256, blob) in conn.execute(query, parameters):
+						source_count += 1
+						der_cert = compressor.decompress(blob)
+						if hashlib.sha256(der_cert).digest() != cert_sha256:
+							mismatches.append(cert_sha256.hex())
+							continue
+						batch.append((cert_sha256, der_cert))
+						if len(batch) >= unit.batch_size:
+							target = target or cls._create_target(unit, dictionary_ids, batch)
+							target.add_certs(batch)
+							target.commit()
+							batch = [ ]
+				finally:
+					conn.close()
+			if len(batch) > 0:
+				target = target or cls._create_target(unit, dictionary_ids, batch)
+				target.add_certs(batch)
+				target.commit()
+
+			# Read back what was written
+			if target is not None:
+				for (cert_sha256, der_cert) in target.get_sorted_certificates():
+					target_count += 1
+					if (unit.layout.shard_of(cert_sha256) != unit.shard) or (hashlib.sha256(der_cert).digest() != cert_sha256):
+						mismatches.append(cert_sha256.hex())
+		finally:
+			if target is not None:
+				target.close()
+		return (unit.shard, source_count, target_count, mismatches, time.time() - t0)
+
+	def _build(self, progress_callback = None):
+		os.makedirs(self._staging_dir, exist_ok = True)
+		self._write_state()
+		units = list(self._units())
+		problems = [ ]
+		last_write = time.time()
+		with multiprocessing.Pool(processes = self._processes) as pool:
+			for (shard, source_count, target_count, mismatches, duration) in pool.imap_unordered(self._build_shard, units):
+				name = self._target_layout.shard_name(shard)
+				if len(mismatches) > 0:
+					problems += [ "%s: certificate %s does not match its hash" % (name, cert_hash) for cert_hash in mismatches ]
+				elif source_count != target_count:
+					problems.append("%s: %d certificates read, but %d written" % (name, source_count, target_count))
+				else:
+					self._state["shards"][name] = { "cert_count": target_count, "time": duration }
+					if time.time() - last_write >= 1:
+						# At most a second of work is redone when interrupted
+						self._write_state()
+						last_write = time.time()
+				if progress_callback is not None:
+					progress_callback(name, target_count, duration)
+		self._write_state()
+		if len(problems) > 0:
+			raise CertResharderException("Migration stopped, the source is left untouched:\n" + "\n".join(problems))
+
+		source_count = 0
+		for source_filename in self._source_layout.shard_filenames(self._cert_storage_dir):
+			if os.path.exists(source_filename):
+				conn = open_readonly(source_filename)
+				try:
+					source_count += conn.execute("SELECT COUNT(*) FROM certificates;").fetchone()[0]
+				finally:
+					conn.close()
+		target_count = sum(shard["cert_count"] for shard in self._state["shards"].values())
+		if source_count != target_count:
+			raise CertResharderException("Migration stopped, the source is left untouched: %d certificates stored, but %d migrated." % (source_count, target_count))
+		self._state["phase"] = "switch"
+		self._write_state()
+
+	def _switch(self):
+		# Every step can be repeated if interrupted
+		for (staged_filename, target_filename) in zip(self._target_layout.shard_filenames(self._staging_dir), self._target_layout.shard_filenames(self._cert_storage_dir)):
+			if os.path.exists(staged_filename):
+				os.rename(staged_filename, target_filename)
+		conn = sqlite3.connect(self._toc_filename)
+		try:
+			conn.execute("UPDATE metadata SET value = ? WHERE key = 'shard_count';", (str(self._target_layout.shard_count), ))
+			conn.commit()
+		finally:
+			conn.close()
+		for source_filename in self._source_layout.shard_filenames(self._cert_storage_dir):
+			for suffix in [ "", "-journal", "-wal", "-shm" ]:
+				with contextlib.suppress(FileNotFoundError):
+					os.unlink(source_filename + suffix)
+		self._reset_shard_states()
+		shutil.rmtree(self._staging_dir, ignore_errors = True)
+		os.unlink(self._state_filename)
+
+	def _reset_shard_states(self):
+		# Only the state files at their default location are known here
+		source_names = set(self._source_layout.shard_name(shard) for shard in range(self._source_layout.shard_count))
+		target_names = set(self._target_layout.shard_name(shard) for shard in range(self._target_layout.shard_count))
+		for (filename, reset) in [
+				("maintenance.json", lambda state: { name: entry for (name, entry) in state.items() if name not in (source_names | target_names) }),
+				("statistics.json", lambda state: dict(state, shard_count = self._target_layout.shard_count, shards = { })),
+			]:
+			state_filename = self._cert_storage_dir + "/" + filename
+			if not os.path.exists(state_filename):
+				continue
+			with open(state_filename) as f:
+				state = reset(json.load(f))
+			tmp_filename = state_filename + ".tmp"
+			with open(tmp_filename, "w") as f:
+				json.dump(state, f, indent = 4, sort_keys = True)
+			os.rename(tmp_filename, state_filename)
+
+	def run(self, progress_callback = None):
+		# progress_callback is called with (shard name, certificate count,
+		# seconds) for every target shard that was built
+		if self._source_layout == self._target_layout:
+			return
+		if self._state["phase"] == "build":
+			self._build(progress_callback = progress_callback)
+		self._switch()
@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import re
+import ssl
+import time
+import socket
+import asyncio
+import subprocess
+import contextlib
+
+class CertRetriever():
+	_CERT_RE = re.compile(r"-----BEGIN CERTIFICATE-----[A-Za-z0-9+/=\s]+-----END CERTIFICATE-----", flags = re.MULTILINE)
+
+	def __init__(self, timeout):
+		self._timeout = timeout
+
+	def _parse_certs(self, openssl_output):
+		output_text = openssl_output.decode("utf-8", errors = "replace")
+		certs = [ ]
+		for match in self._CERT_RE.finditer(output_text):
+			cert_text = match.group(0).encode("ascii")
+			der_cert = subprocess.check_output([ "openssl", "x509", "-outform", "der" ], input = cert_text)
+			certs.append(der_cert)
+		return certs
+
+	def retrieve(self, servername, port = 443, timings = None):
+		# If a timings dictionary is given, the duration of the retrieval
+		# stages is stored in it (in seconds).
+		if timings is None:
+			timings = { }
+		cmd = [ "openssl", "s_client", "-showcerts", "-connect", "%s:%d" % (servername, port), "-servername", servername ]
+		t0 = time.perf_counter()
+		proc = subprocess.Popen(cmd, stdin = subprocess.DEVNULL, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
+		try:
+			proc.wait(timeout = self._timeout)
+			timings["handshake"] = time.perf_counter() - t0
+			if proc.returncode == 0:
+				stdout = proc.stdout.read()
+				try:
+					t0 = time.perf_counter()
+					der_certs = self._parse_certs(stdout)
+					timings["parse"] = time.perf_counter() - t0
+					return ("ok", der_certs)
+				except subprocess.CalledProcessError:
+					# Did not contain certificate?
+					return ("nocert", None)
+			else:
+				# Failed with error
+				return ("error", None)
+		except subprocess.TimeoutExpired:
+			# Process unresponsive
+			proc.kill()
+			return ("timeout", None)
+
+class AsyncCertRetriever():
+	# Performs the TLS handshake in-process so that a single event loop can
+	# keep thousands of handshakes in flight. Result codes are the same as
+	# those of the OpenSSL based CertRetriever.
+	def __init__(self, timeout):
+		self._timeout = timeout
+		self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+		self._ssl_context.check_hostname = False
+		self._ssl_context.verify_mode = ssl.CERT_NONE
+		self._ssl_context.minimum_version = ssl.TLSVersion.MINIMUM_SUPPORTED
+		with contextlib.suppress(ssl.SSLError):
+			# Accept whatever legacy servers offer, just like s_client does
+			self._ssl_context.set_ciphers("ALL:@SECLEVEL=0")
+
+	@property
+	def leaf_only(self):
+		# The full presented chain is only accessible from Python 3.10 on,
+		# before that we only see the leaf certificate.
+		return not (hasattr(ssl.SSLObject, "get_unverified_chain") or hasattr(ssl._ssl._SSLSocket, "get_unverified_chain"))
+
+	@staticmethod
+	def _get_der_certs(ssl_object):
+		if hasattr(ssl_object, "get_unverified_chain"):
+			chain = ssl_object.get_unverified_chain()
+		elif hasattr(ssl_object._sslobj, "get_unverified_chain"):
+			chain = ssl_object._sslobj.get_unverified_chain()
+		else:
+			leaf_cert = ssl_object.getpeercert(binary_form = True)
+			return [ leaf_cert ] if (leaf_cert is not None) else [ ]
+		return [ cert if isinstance(cert, bytes) else cert.public_bytes(ssl._ssl.ENCODING_DER) for cert in (chain or [ ]) ]
+
+	async def _connect(self, addrinfos):
+		# Tries all resolved addresses in turn, like asyncio.open_connection
+		loop = asyncio.get_running_loop()
+		last_exception = OSError("No address to connect to")
+		for (family, socktype, proto, canonname, sockaddr) in addrinfos:
+			try:
+				(transport, protocol) = await loop.create_connection(asyncio.Protocol, host = sockaddr[0], port = sockaddr[1], family = family, proto = proto)
+				return (transport, protocol)
+			except OSError as e:
+				last_exception = e
+		raise last_exception
+
+	async def _handshake(self, servername, port, timings):
+		# Resolution, TCP connect and TLS handshake are separate steps so that
+		# each of them can be timed.
+		loop = asyncio.get_running_loop()
+		t0 = time.perf_counter()
+		addrinfos = await loop.getaddrinfo(servername, port, type = socket.SOCK_STREAM)
+		t1 = time.perf_counter()
+		timings["dns"] = t1 - t0
+		(transport, protocol) = await self._connect(addrinfos)
+		t2 = time.perf_counter()
+		timings["connect"] = t2 - t1
+		try:
+			transport = await loop.start_tls(transport, protocol, self._ssl_context, server_hostname = servername, ssl_handshake_timeout = self._timeout)
+			t3 = time.perf_counter()
+			timings["handshake"] = t3 - t2
+			der_certs = self._get_der_certs(transport.get_extra_info("ssl_object"))
+			timings["parse"] = time.perf_counter() - t3
+			return der_certs
+		finally:
+			# Do not wait for the server to acknowledge the shutdown
+			transport.abort()
+
+	async def retrieve(self, servername, port = 443, timings = None):
+		# If a timings dictionary is given, the duration of the retrieval
+		# stages is stored in it (in seconds).
+		if timings is None:
+			timings = { }
+		try:
+			der_certs = await asyncio.wait_for(self._handshake(servername, port, timings), timeout = self._timeout)
+		except asyncio.TimeoutError:
+			return ("timeout", None)
+		except (OSError, ssl.SSLError, UnicodeError, ValueError):
+			# Resolution failure, connection refused or failed handshake
+			return ("error", None)
+		if len(der_certs) == 0:
+			return ("nocert", None)
+		return ("ok", der_certs)
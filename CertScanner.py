@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import time
+import sqlite3
+import functools
+import collections
+import urllib.request
+import multiprocessing
+from CertCompressor import CertCompressor
+
+# Module level so that they can be passed between processes
+WorkUnit = collections.namedtuple("WorkUnit", [ "unit_id", "sqlite_filename", "min_rowid", "max_rowid" ])
+UnitResult = collections.namedtuple("UnitResult", [ "unit_id", "cert_count", "results" ])
+
+def open_readonly(sqlite_filename):
+	uri = "file:%s?mode=ro" % (urllib.request.pathname2url(sqlite_filename))
+	return sqlite3.connect(uri, uri = True)
+
+class CertScanner():
+	# Scans all certificate shards with a pool of worker processes. The work
+	# is split into units (a whole shard or a rowid range inside a shard),
+	# every worker opens its own read-only connection and applies a map
+	# function to each (cert_sha256, der_cert) tuple. Map results that are
+	# not None are shipped back to the parent.
+
+	def __init__(self, shard_filenames, processes = None, rowids_per_unit = None):
+		self._shard_filenames = shard_filenames
+		self._processes = processes
+		self._rowids_per_unit = rowids_per_unit
+		self._scanned_count = 0
+		self._t0 = None
+		self._t1 = None
+
+	@property
+	def scanned_count(self):
+		return self._scanned_count
+
+	@property
+	def elapsed(self):
+		if self._t0 is None:
+			return 0
+		return (self._t1 or time.time()) - self._t0
+
+	@property
+	def throughput(self):
+		elapsed = self.elapsed
+		if elapsed == 0:
+			return 0
+		return self._scanned_count / elapsed
+
+	def _work_units(self):
+		unit_id = 0
+		for sqlite_filename in self._shard_filenames:
+			if not os.path.exists(sqlite_filename):
+				# Shard was never written to
+				continue
+			if self._rowids_per_unit is None:
+				yield WorkUnit(unit_id = unit_id, sqlite_filename = sqlite_filename, min_rowid = None, max_rowid = None)
+				unit_id += 1
+				continue
+
+			conn = open_readonly(sqlite_filename)
+			try:
+				(min_rowid, max_rowid) = conn.execute("SELECT MIN(rowid), MAX(rowid) FROM certificates;").fetchone()
+			finally:
+				conn.close()
+			if min_rowid is None:
+				continue
+			for first_rowid in range(min_rowid, max_rowid + 1, self._rowids_per_unit):
+				yield WorkUnit(unit_id = unit_id, sqlite_filename = sqlite_filename, min_rowid = first_rowid, max_rowid = first_rowid + self._rowids_per_unit - 1)
+				unit_id += 1
+
+	@classmethod
+	def _scan_unit(cls, map_function, work_unit):
+		conn = open_readonly(work_unit.sqlite_filename)
+		try:
+			compressor = CertCompressor.from_connection(conn)
+			if work_unit.min_rowid is None:
+				cursor = conn.execute("SELECT cert_sha256, der_cert FROM certificates ORDER BY rowid ASC;")
+			else:
+				cursor = conn.execute("SELECT cert_sha256, der_cert FROM certificates WHERE rowid BETWEEN ? AND ? ORDER BY rowid ASC;", (work_unit.min_rowid, work_unit.max_rowid))
+			cert_count = 0
+			results = [ ]
+			for (cert_sha256, der_cert) in cursor:
+				cert_count += 1
+				result = map_function(cert_sha256, compressor.decompress(der_cert))
+				if result is not None:
+					results.append(result)
+			return UnitResult(unit_id = work_unit.unit_id, cert_count = cert_count, results = results)
+		finally:
+			conn.close()
+
+	def scan(self, map_function, ordered = False, limit = None, progress_callback = None):
+		# Yields all non-None map results. In ordered mode, results appear in
+		# the same order a serial scan would produce them. When a limit is
+		# given, scanning stops as soon as that many results were produced.
+		self._scanned_count = 0
+		self._t0 = time.time()
+		self._t1 = None
+		result_count = 0
+		scan_function = functools.partial(self._scan_unit, map_function)
+		with multiprocessing.Pool(processes = self._processes) as pool:
+			if ordered:
+				unit_results = pool.imap(scan_function, self._work_units())
+			else:
+				unit_results = pool.imap_unordered(scan_function, self._work_units())
+			for unit_result in unit_results:
+				self._scanned_count += unit_result.cert_count
+				if progress_callback is not None:
+					progress_callback(self)
+				for result in unit_result.results:
+					yield result
+					result_count += 1
+					if (limit is not None) and (result_count >= limit):
+						# Leaving the context terminates all outstanding workers
+						self._t1 = time.time()
+						return
+		self._t1 = time.time()
+
+	def reduce(self, map_function, reduce_function, initial_value, progress_callback = None):
+		value = initial_value
+		for result in self.scan(map_function, progress_callback = progress_callback):
+			value = reduce_function(value, result)
+		return value
@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import json
+import time
+import hashlib
+import datetime
+import collections
+import multiprocessing
+from CertScanner import open_readonly
+from CertCompressor import CertCompressor
+from CertDecoder import CertDecoder, DERParseException
+
+# Module level so that they can be passed between processes
+ShardStatisticsUnit = collections.namedtuple("ShardStatisticsUnit", [ "name", "sqlite_filename", "file_state", "digest" ])
+ConnectionStatisticsUnit = collections.namedtuple("ConnectionStatisticsUnit", [ "chunk", "toc_filename", "min_conn_id", "max_conn_id", "watermark" ])
+
+class CertStatistics():
+	# Corpus statistics as a map-reduce over the shards and the TOC. The map
+	# step computes partial aggregates (counters) per shard and per range of
+	# connection IDs in parallel, the reduce step adds them up. Partials are
+	# kept in a JSON state file together with a watermark of their source,
+	# so that a rerun only maps what changed since. A shard is only looked
+	# at when its file (or WAL) changed, and only mapped again when the
+	# digest of its certificate hashes changed, so recompressing or
+	# vacuuming does not count as a change. Connections are only ever
+	# appended, a range of them is watermarked by its count and highest ID.
+	VERSION = 1
+	CONNECTIONS_PER_CHUNK = 65536
+	DISTRIBUTIONS = (
+		# (name, aggregate, order)
+		("key",							"key",							"count"),
+		("signature_algorithm",			"signature_algorithm",			"count"),
+		("issuer",						"issuer",						"count"),
+		("validity_days",				"validity_days",				"numeric"),
+		("chain_length",				"chain_length",					"numeric"),
+		("fetch_batch_connections",		"fetch_batch_connections",		"key"),
+		("fetch_batch_cert_references",	"fetch_batch_cert_references",	"key"),
+	)
+
+	def __init__(self, toc_filename, shard_filenames, layout, state_filename = None, force = False, processes = None):
+		self._toc_filename = toc_filename
+		self._shard_filenames = shard_filenames
+		self._layout = layout
+		self._state_filename = state_filename
+		self._processes = processes
+		self._state = None
+		if (not force) and (self._state_filename is not None) and os.path.exists(self._state_filename):
+			with open(self._state_filename) as f:
+				self._state = json.load(f)
+			if self._state.get("version") != self.VERSION:
+				self._state = None
+		if self._state is None:
+			self._state = {
+				"version":		self.VERSION,
+				"shard_count":	layout.shard_count,
+				"shards":		{ },
+				"toc":			{ "file_state": None, "chunks": { } },
+			}
+		elif self._state["shard_count"] != layout.shard_count:
+			# Resharded since, the partials do not correspond to any file
+			self._state["shard_count"] = layout.shard_count
+			self._state["shards"] = { }
+
+	@staticmethod
+	def file_state(sqlite_filename):
+		# Changes whenever the database or its WAL is written to
+		file_state = [ ]
+		for suffix in [ "", "-wal" ]:
+			try:
+				stat_result = os.stat(sqlite_filename + suffix)
+				file_state += [ stat_result.st_size, stat_result.st_mtime_ns ]
+			except FileNotFoundError:
+				file_state += [ None, None ]
+		return file_state
+
+	@classmethod
+	def _map_shard(cls, unit):
+		t0 = time.time()
+		conn = open_readonly(unit.sqlite_filename)
+		try:
+			# Digest and certificates from the same snapshot
+			conn.execute("BEGIN;")
+			hashval = hashlib.sha256()
+			for (cert_sha256, ) in conn.execute("SELECT cert_sha256 FROM certificates ORDER BY cert_sha256 ASC;"):
+				hashval.update(cert_sha256)
+			digest = hashval.hexdigest()
+			if digest == unit.digest:
+				return (unit, digest, None, time.time() - t0)
+
+			compressor = CertCompressor.from_connection(conn)
+			aggregates = { name: collections.Counter() for name in [ "counts", "key", "signature_algorithm", "issuer", "validity_days" ] }
+			for (der_cert, ) in conn.execute("SELECT der_cert FROM certificates;"):
+				der_cert = compressor.decompress(der_cert)
+				aggregates["counts"]["certificates"] += 1
+				try:
+					summary = CertDecoder.decode_summary(der_cert)
+				except (DERParseException, ValueError, IndexError):
+					aggregates["counts"]["undecodable_certificates"] += 1
+					continue
+				key = summary.key_algorithm if (summary.key_size is None) else "%s %d" % (summary.key_algorithm, summary.key_size)
+				aggregates["key"][key] += 1
+				aggregates["signature_algorithm"][summary.signature_algorithm] += 1
+				aggregates["issuer"][summary.issuer] += 1
+				aggregates["validity_days"][str((summary.not_after - summary.not_before) // 86400)] += 1
+			return (unit, digest, aggregates, time.time() - t0)
+		finally:
+			conn.close()
+
+	@classmethod
+	def _map_connections(cls, unit):
+		t0 = time.time()
+		aggregates = { name: collections.Counter() for name in [ "counts", "chain_length", "fetch_batch_connections", "fetch_batch_cert_references" ] }
+		conn = open_readonly(unit.toc_filename)
+		try:
+			for (leaf_only, fetch_timestamp, cert_hashes) in conn.execute("SELECT leaf_only, fetch_timestamp, cert_hashes FROM connections WHERE conn_id BETWEEN ? AND ?;", (unit.min_conn_id, unit.max_conn_id)):
+				chain_length = len(cert_hashes) // 32
+				# Scrapes run in batches, connections are grouped by the UTC
+				# day they were fetched on
+				fetch_batch = datetime.datetime.utcfromtimestamp(fetch_timestamp).strftime("%Y-%m-%d")
+				aggregates["counts"]["connections"] += 1
+				aggregates["counts"]["cert_references"] += chain_length
+				if leaf_only:
+					aggregates["counts"]["leaf_only_connections"] += 1
+				aggregates["chain_length"][str(chain_length)] += 1
+				aggregates["fetch_batch_connections"][fetch_batch] += 1
+				aggregates["fetch_batch_cert_references"][fetch_batch] += chain_length
+		finally:
+			conn.close()
+		return (unit, aggregates, time.time() - t0)
+
+	def _connection_watermarks(self):
+		conn = open_readonly(self._toc_filename)
+		try:
+			return { str(chunk): [ count, max_conn_id ] for (chunk, count, max_conn_id) in conn.execute("SELECT conn_id / ?, COUNT(*), MAX(conn_id) FROM connections GROUP BY 1;", (self.CONNECTIONS_PER_CHUNK, )) }
+		finally:
+			conn.close()
+
+	def _write_state(self):
+		if self._state_filename is None:
+			return
+		tmp_filename = self._state_filename + ".tmp"
+		with open(tmp_filename, "w") as f:
+			json.dump(self._state, f, sort_keys = True)
+		os.rename(tmp_filename, self._state_filename)
+
+	def _pending_shard_units(self):
+		existing_names = set()
+		for (dbid, sqlite_filename) in enumerate(self._shard_filenames):
+			if not os.path.exists(sqlite_filename):
+				# Shard was never written to
+				continue
+			name = self._layout.shard_name(dbid)
+			existing_names.add(name)
+			partial = self._state["shards"].get(name)
+			# Taken before reading, a concurrent write makes it differ on the
+			# next run
+			file_state = self.file_state(sqlite_filename)
+			if (partial is not None) and (partial["file_state"] == file_state):
+				continue
+			yield ShardStatisticsUnit(name = name, sqlite_filename = sqlite_filename, file_state = file_state, digest = None if (partial is None) else partial["digest"])
+		for name in set(self._state["shards"]) - existing_names:
+			del self._state["shards"][name]
+
+	def _pending_connection_units(self, watermarks):
+		chunks = self._state["toc"]["chunks"]
+		for chunk in set(chunks) - set(watermarks):
+			del chunks[chunk]
+		for (chunk, watermark) in sorted(watermarks.items()):
+			partial = chunks.get(chunk)
+			if (partial is not None) and (partial["watermark"] == watermark):
+				continue
+			yield ConnectionStatisticsUnit(chunk = chunk, toc_filename = self._toc_filename, min_conn_id = int(chunk) * self.CONNECTIONS_PER_CHUNK, max_conn_id = ((int(chunk) + 1) * self.CONNECTIONS_PER_CHUNK) - 1, watermark = watermark)
+
+	def update(self, progress_callback = None):
+		# Maps everything that changed since the last update. progress_callback
+		# is called with (name, mapped, seconds) for every shard or range of
+		# connections that was looked at; mapped is False if the partial
+		# could be kept. Returns the number of partials that were mapped.
+		shard_units = list(self._pending_shard_units())
+		toc_file_state = self.file_state(self._toc_filename)
+		if self._state["toc"]["file_state"] == toc_file_state:
+			connection_units = [ ]
+		else:
+			connection_units = list(self._pending_connection_units(self._connection_watermarks()))
+
+		mapped_count = 0
+		last_write = time.time()
+		with multiprocessing.Pool(processes = self._processes) as pool:
+			connection_results = pool.imap_unordered(self._map_connections, connection_units)
+			shard_results = pool.imap_unordered(self._map_shard, shard_units)
+			for (unit, aggregates, duration) in connection_results:
+				self._state["toc"]["chunks"][unit.chunk] = { "watermark": unit.watermark, "aggregates": aggregates }
+				mapped_count += 1
+				if progress_callback is not None:
+					progress_callback("connections %d-%d" % (unit.min_conn_id, unit.max_conn_id), True, duration)
+			self._state["toc"]["file_state"] = toc_file_state
+			for (unit, digest, aggregates, duration) in shard_results:
+				if aggregates is None:
+					aggregates = self._state["shards"][unit.name]["aggregates"]
+				else:
+					mapped_count += 1
+				self._state["shards"][unit.name] = { "file_state": unit.file_state, "digest": digest, "aggregates": aggregates }
+				if progress_callback is not None:
+					progress_callback(unit.name, unit.digest != digest, duration)
+				if time.time() - last_write >= 10:
+					# Partials are large, at most ten seconds of work is redone
+					# when interrupted
+					self._write_state()
+					last_write = time.time()
+		self._write_state()
+		return mapped_count
+
+	def _reduce(self):
+		totals = collections.defaultdict(collections.Counter)
+		partials = [ partial["aggregates"] for partial in self._state["shards"].values() ]
+		partials += [ partial["aggregates"] for partial in self._state["toc"]["chunks"].values() ]
+		for aggregates in partials:
+			for (name, counter) in aggregates.items():
+				totals[name].update(counter)
+		return totals
+
+	def report(self, top = None):
+		# Reduces the partials into a report; top limits the distributions
+		# that are ordered by count
+		totals = self._reduce()
+		counts = totals["counts"]
+		summary = collections.OrderedDict()
+		for name in [ "certificates", "undecodable_certificates", "connections", "leaf_only_connections", "cert_references" ]:
+			summary[name] = counts[name]
+		summary["leaf_only_ratio"] = counts["leaf_only_connections"] / counts["connections"] if (counts["connections"] > 0) else 0
+		distributions = collections.OrderedDict()
+		for (name, aggregate, order) in self.DISTRIBUTIONS:
+			counter = totals[aggregate]
+			if order == "count":
+				values = counter.most_common(top)
+			elif order == "numeric":
+				values = sorted(counter.items(), key = lambda item: int(item[0]))
+			else:
+				values = sorted(counter.items())
+			distributions[name] = values
+		return collections.OrderedDict([ ("summary", summary), ("distributions", distributions) ])
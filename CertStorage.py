@@ -6,11 +6,21 @@
 import sqlite3
 import hashlib
 import contextlib
+from CertCompressor import CertCompressor
 
 class CertStorage():
-	def __init__(self, sqlite_filename):
+	def __init__(self, sqlite_filename, pragmas = None):
 		self._conn = sqlite3.connect(sqlite_filename)
 		self._cursor = self._conn.cursor()
+		self._dirty = False
+		if pragmas is not None:
+			# Before table creation so that page_size applies to new files
+			self.apply_pragmas(self._cursor, pragmas)
+		if self._cursor.execute("PRAGMA page_count;").fetchone()[0] == 0:
+			# New file; lets maintain_db.py --online release free pages without
+			# rebuilding the shard. Setting it on existing files would take a
+			# write lock on every open, those are converted by a full VACUUM.
+			self._cursor.execute("PRAGMA auto_vacuum = INCREMENTAL;")
 		with contextlib.suppress(sqlite3.OperationalError):
 			self._cursor.execute("""
 			CREATE TABLE certificates (
@@ -18,36 +28,184 @@ class CertStorage():
 				der_cert blob NOT NULL
 			);
 			""")
+		with contextlib.suppress(sqlite3.OperationalError):
+			# Compression dictionaries, the one with the highest ID is used for
+			# newly inserted certificates
+			self._cursor.execute("""
+			CREATE TABLE dictionaries (
+				dict_id integer PRIMARY KEY,
+				dictionary blob NOT NULL
+			);
+			""")
+		self._compressor = CertCompressor.from_connection(self._conn)
+		self._compress_dict_id = self._compressor.dictionary_ids[-1] if (len(self._compressor.dictionary_ids) > 0) else None
+
+	@staticmethod
+	def apply_pragmas(cursor, pragmas):
+		for (name, value) in pragmas.items():
+			if not name.isidentifier():
+				raise ValueError("Invalid pragma name: %s" % (name))
+			if isinstance(value, str) and (not value.isidentifier()):
+				raise ValueError("Invalid value for pragma %s: %s" % (name, value))
+			cursor.execute("PRAGMA %s = %s;" % (name, value if isinstance(value, str) else int(value)))
+
+	@property
+	def compressed(self):
+		return self._compress_dict_id is not None
+
+	def _encode(self, der_cert):
+		if self._compress_dict_id is None:
+			return der_cert
+		return self._compressor.compress(der_cert, self._compress_dict_id)
+
+	def _decode(self, blob):
+		return self._compressor.decompress(blob)
 
 	@property
 	def certificate_count(self):
 		return self._cursor.execute("SELECT COUNT(*) FROM certificates;").fetchone()[0]
 
 	def get_all_certificates(self):
-		for row in self._cursor.execute("SELECT der_cert FROM certificates;").fetchall():
-			yield row[0]
+		# Streams from a separate cursor instead of loading the whole shard
+		cursor = self._conn.cursor()
+		try:
+			for row in cursor.execute("SELECT der_cert FROM certificates;"):
+				yield self._decode(row[0])
+		finally:
+			cursor.close()
+
+	def get_sorted_certificates(self, min_hash = None, max_hash = None):
+		# Streams (cert_sha256, der_cert) tuples in hash order, optionally
+		# only those with min_hash <= cert_sha256 < max_hash
+		conditions = [ ]
+		parameters = [ ]
+		if min_hash is not None:
+			conditions.append("cert_sha256 >= ?")
+			parameters.append(min_hash)
+		if max_hash is not None:
+			conditions.append("cert_sha256 < ?")
+			parameters.append(max_hash)
+		query = "SELECT cert_sha256, der_cert FROM certificates"
+		if len(conditions) > 0:
+			query += " WHERE " + " AND ".join(conditions)
+		query += " ORDER BY cert_sha256 ASC;"
+		cursor = self._conn.cursor()
+		try:
+			for (cert_sha256, der_cert) in cursor.execute(query, parameters):
+				yield (cert_sha256, self._decode(der_cert))
+		finally:
+			cursor.close()
 
 	def get_cert(self, cert_sha256):
 		row = self._cursor.execute("SELECT der_cert FROM certificates WHERE cert_sha256 = ?;", (cert_sha256, )).fetchone()
 		if row is not None:
-			return row[0]
+			return self._decode(row[0])
 
-	def add_cert(self, der_cert):
-		cert_sha256 = hashlib.sha256(der_cert).digest()
-		with contextlib.suppress(sqlite3.IntegrityError):
-			self._cursor.execute("INSERT INTO certificates (cert_sha256, der_cert) VALUES (?, ?);", (cert_sha256, der_cert))
+	def get_certs(self, cert_hashes, chunk_size = 500):
+		# Set-based lookup, returns a dictionary of hash to DER certificate
+		cert_hashes = list(cert_hashes)
+		certs = { }
+		for i in range(0, len(cert_hashes), chunk_size):
+			chunk = cert_hashes[i : i + chunk_size]
+			query = "SELECT cert_sha256, der_cert FROM certificates WHERE cert_sha256 IN (%s);" % (", ".join("?" * len(chunk)))
+			certs.update((cert_sha256, self._decode(der_cert)) for (cert_sha256, der_cert) in self._cursor.execute(query, chunk).fetchall())
+		return certs
+
+	def get_present_hashes(self, cert_hashes, chunk_size = 500):
+		# Like get_certs, but only checks presence without reading any DER data
+		cert_hashes = list(cert_hashes)
+		present = set()
+		for i in range(0, len(cert_hashes), chunk_size):
+			chunk = cert_hashes[i : i + chunk_size]
+			query = "SELECT cert_sha256 FROM certificates WHERE cert_sha256 IN (%s);" % (", ".join("?" * len(chunk)))
+			present |= set(row[0] for row in self._cursor.execute(query, chunk).fetchall())
+		return present
+
+	def add_cert(self, der_cert, cert_sha256 = None):
+		if cert_sha256 is None:
+			cert_sha256 = hashlib.sha256(der_cert).digest()
+		try:
+			self._cursor.execute("INSERT INTO certificates (cert_sha256, der_cert) VALUES (?, ?);", (cert_sha256, self._encode(der_cert)))
+			self._dirty = True
+			return True
+		except sqlite3.IntegrityError:
+			return False
+
+	def add_certs(self, certs):
+		# Bulk insert of (cert_sha256, der_cert) tuples, known ones are ignored
+		self._cursor.executemany("INSERT OR IGNORE INTO certificates (cert_sha256, der_cert) VALUES (?, ?);", ((cert_sha256, self._encode(der_cert)) for (cert_sha256, der_cert) in certs))
+		self._dirty = True
+
+	def get_sample_certificates(self, count):
+		return [ self._decode(row[0]) for row in self._cursor.execute("SELECT der_cert FROM certificates ORDER BY RANDOM() LIMIT ?;", (count, )).fetchall() ]
+
+	def add_dictionary(self, dictionary):
+		# Registers a new dictionary that all subsequently stored certificates
+		# are compressed with. An empty dictionary means plain deflate.
+		if len(dictionary) == 0:
+			self._cursor.execute("INSERT OR REPLACE INTO dictionaries (dict_id, dictionary) VALUES (?, ?);", (CertCompressor.NO_DICTIONARY, dictionary))
+			self._compress_dict_id = CertCompressor.NO_DICTIONARY
+		else:
+			self._cursor.execute("INSERT INTO dictionaries (dictionary) VALUES (?);", (dictionary, ))
+			self._compress_dict_id = self._cursor.lastrowid
+		self._compressor.add_dictionary(self._compress_dict_id, dictionary)
+		self._dirty = True
+		return self._compress_dict_id
+
+	def recode(self, compress = True, batch_size = 1000):
+		# Rewrites all stored certificates, compressed with the newest
+		# dictionary or as raw DER. Returns the blob sizes before and after.
+		if not compress:
+			self._compress_dict_id = None
+		(size_before, size_after) = (0, 0)
+		last_rowid = 0
+		while True:
+			rows = self._cursor.execute("SELECT rowid, der_cert FROM certificates WHERE rowid > ? ORDER BY rowid ASC LIMIT ?;", (last_rowid, batch_size)).fetchall()
+			if len(rows) == 0:
+				break
+			updates = [ ]
+			for (rowid, blob) in rows:
+				encoded = self._encode(self._decode(blob))
+				size_before += len(blob)
+				size_after += len(encoded)
+				if encoded != blob:
+					updates.append((encoded, rowid))
+			self._cursor.executemany("UPDATE certificates SET der_cert = ? WHERE rowid = ?;", updates)
+			last_rowid = rows[-1][0]
+		# No certificate references an older dictionary anymore
+		if compress:
+			self._cursor.execute("DELETE FROM dictionaries WHERE dict_id != ?;", (self._compress_dict_id, ))
+		else:
+			self._cursor.execute("DELETE FROM dictionaries;")
+		self._compressor = CertCompressor.from_connection(self._conn)
+		self._dirty = True
+		return (size_before, size_after)
+
+	def get_sorted_cert_hashes(self):
+		# Walks the primary key index, i.e., no sorting is necessary
+		return [ row[0] for row in self._cursor.execute("SELECT cert_sha256 FROM certificates ORDER BY cert_sha256 ASC;").fetchall() ]
 
 	def get_all_cert_hashes(self):
-		return set(row[0] for row in self._cursor.execute("SELECT cert_sha256 FROM certificates;").fetchall())
+		# In storage order, the order in which the certificates are scanned
+		return [ row[0] for row in self._cursor.execute("SELECT cert_sha256 FROM certificates ORDER BY rowid ASC;").fetchall() ]
 
 	def remove_cert_by_hash(self, hash_value):
 		self._cursor.execute("DELETE FROM certificates WHERE cert_sha256 = ?;", (hash_value, ))
+		self._dirty = True
 
 	def optimize(self):
+		# VACUUM cannot run inside of a transaction
+		self.commit()
 		self._cursor.execute("VACUUM;")
 
+	@property
+	def dirty(self):
+		return self._dirty
+
 	def commit(self):
-		self._conn.commit()
+		if self._dirty:
+			self._conn.commit()
+			self._dirty = False
 
 	def close(self):
 		if self._conn is None:
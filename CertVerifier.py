@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import collections
+import multiprocessing
+from CertScanner import open_readonly
+from CertCompressor import CertCompressor
+
+# Module level so that they can be passed between processes
+VerifyUnit = collections.namedtuple("VerifyUnit", [ "name", "sqlite_filename", "dbid", "layout", "integrity_check" ])
+
+class CertVerifier():
+	# Verifies all databases of a CertDatabase in parallel: every stored
+	# certificate is rehashed and compared against its key, every row must
+	# live in the shard that its hash prefix designates and SQLite's
+	# own consistency check is run on each file. Results are written to a
+	# JSON report after every database so an interrupted run can resume.
+	def __init__(self, toc_filename, shard_filenames, layout, report_filename = None, integrity_check = "quick", processes = None):
+		assert(integrity_check in [ "quick", "full", "none" ])
+		self._toc_filename = toc_filename
+		self._shard_filenames = shard_filenames
+		self._layout = layout
+		self._report_filename = report_filename
+		self._integrity_check = integrity_check
+		self._processes = processes
+		self._report = { "databases": { } }
+		if (self._report_filename is not None) and os.path.exists(self._report_filename):
+			with open(self._report_filename) as f:
+				self._report = json.load(f)
+
+	@property
+	def report(self):
+		return self._report
+
+	@staticmethod
+	def _verify(verify_unit):
+		t0 = time.time()
+		result = {
+			"integrity":		[ ],
+			"unreadable":		None,
+			"cert_count":		0,
+			"hash_mismatches":	[ ],
+			"misplaced":		[ ],
+		}
+		# A corrupt file is recorded as a problem of this database instead of
+		# aborting the whole run, so resumed runs do not trip over it again
+		conn = open_readonly(verify_unit.sqlite_filename)
+		try:
+			if verify_unit.integrity_check != "none":
+				pragma = "quick_check" if (verify_unit.integrity_check == "quick") else "integrity_check"
+				try:
+					result["integrity"] = [ row[0] for row in conn.execute("PRAGMA %s;" % (pragma)).fetchall() ]
+				except sqlite3.DatabaseError as e:
+					result["integrity"] = [ "%s failed: %s" % (pragma, str(e)) ]
+			if verify_unit.dbid is not None:
+				try:
+					compressor = CertCompressor.from_connection(conn)
+					for (cert_sha256, der_cert) in conn.execute("SELECT cert_sha256, der_cert FROM certificates;"):
+						result["cert_count"] += 1
+						try:
+							der_cert = compressor.decompress(der_cert)
+						except (zlib.error, KeyError):
+							# Corrupt stream or unknown dictionary
+							der_cert = None
+						if (der_cert is None) or (hashlib.sha256(der_cert).digest() != cert_sha256):
+							result["hash_mismatches"].append(cert_sha256.hex())
+						if verify_unit.layout.shard_of(cert_sha256) != verify_unit.dbid:
+							result["misplaced"].append(cert_sha256.hex())
+				except sqlite3.DatabaseError as e:
+					result["unreadable"] = "reading failed after %d certificates: %s" % (result["cert_count"], str(e))
+		finally:
+			conn.close()
+		result["time"] = time.time() - t0
+		result["certs_per_sec"] = result["cert_count"] / result["time"] if (result["time"] > 0) else 0
+		return (verify_unit.name, result)
+
+	def _write_report(self):
+		if self._report_filename is None:
+			return
+		tmp_filename = self._report_filename + ".tmp"
+		with open(tmp_filename, "w") as f:
+			json.dump(self._report, f, indent = 4, sort_keys = True)
+		os.rename(tmp_filename, self._report_filename)
+
+	def _pending_units(self):
+		units = [ VerifyUnit(name = "toc", sqlite_filename = self._toc_filename, dbid = None, layout = None, integrity_check = self._integrity_check) ]
+		units += [ VerifyUnit(name = self._layout.shard_name(dbid), sqlite_filename = sqlite_filename, dbid = dbid, layout = self._layout, integrity_check = self._integrity_check) for (dbid, sqlite_filename) in enumerate(self._shard_filenames) if os.path.exists(sqlite_filename) ]
+		return [ unit for unit in units if unit.name not in self._report["databases"] ]
+
+	def run(self, progress_callback = None):
+		pending_units = self._pending_units()
+		with multiprocessing.Pool(processes = self._processes) as pool:
+			for (name, result) in pool.imap_unordered(self._verify, pending_units):
+				self._report["databases"][name] = result
+				self._write_report()
+				if progress_callback is not None:
+					progress_callback(name, result)
+		return self._report
+
+	@property
+	def problems(self):
+		for (name, result) in sorted(self._report["databases"].items()):
+			if (len(result["integrity"]) > 0) and (result["integrity"] != [ "ok" ]):
+				yield (name, "integrity", result["integrity"])
+			if result.get("unreadable") is not None:
+				yield (name, "unreadable", result["unreadable"])
+			for cert_hash in result["hash_mismatches"]:
+				yield (name, "hash mismatch", cert_hash)
+			for cert_hash in result["misplaced"]:
+				yield (name, "misplaced", cert_hash)
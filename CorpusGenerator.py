@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import random
+import datetime
+import collections
+from CertDecoder import CertDecoder
+
+# Module level so that connections can be passed between processes
+GeneratedConnection = collections.namedtuple("GeneratedConnection", [ "servername", "fetch_timestamp", "certs", "leaf_only" ])
+
+class CorpusGenerator():
+	# Builds a synthetic, but structurally valid corpus offline: root CAs,
+	# intermediates issued by them and leaf certificates issued by the
+	# intermediates, all DER encoded by hand with random RSA moduli and
+	# random signatures (nothing verifies, but OpenSSL parses and renders
+	# everything). Intermediates are picked with Zipf-like popularity, most
+	# servers are scraped several times and often present the same leaf
+	# again. The same seed always yields exactly the same corpus.
+	_OID_RSA_ENCRYPTION = "1.2.840.113549.1.1.1"
+	_OID_SHA256_WITH_RSA = "1.2.840.113549.1.1.11"
+	_OID_COUNTRY = "2.5.4.6"
+	_OID_ORGANIZATION = "2.5.4.10"
+	_OID_COMMON_NAME = "2.5.4.3"
+	_OID_BASIC_CONSTRAINTS = "2.5.29.19"
+	_OID_KEY_USAGE = "2.5.29.15"
+	_OID_EXT_KEY_USAGE = "2.5.29.37"
+	_OID_SUBJECT_ALT_NAME = "2.5.29.17"
+	_OID_SUBJECT_KEY_IDENTIFIER = "2.5.29.14"
+	_OID_SERVER_AUTH = "1.3.6.1.5.5.7.3.1"
+	_COUNTRIES = ( "US", "DE", "GB", "FR", "JP", "NL", "CH", "CA", "BE", "SE" )
+	_TLDS = ( "com", "net", "org", "de", "co.uk", "fr", "io", "jp" )
+
+	def __init__(self, seed = 0, root_count = 10, intermediate_count = 100, servername_count = 5000, max_scrapes_per_servername = 3, leaf_reuse_ratio = 0.8, root_in_chain_ratio = 0.1, start_timet = 1500000000):
+		self._rng = random.Random(seed)
+		self._servername_count = servername_count
+		self._max_scrapes_per_servername = max_scrapes_per_servername
+		self._leaf_reuse_ratio = leaf_reuse_ratio
+		self._root_in_chain_ratio = root_in_chain_ratio
+		self._start_timet = start_timet
+		self._serial = 0
+		self._roots = [ self._create_ca("Synthetic Root CA %d" % (i), issuer = None) for i in range(root_count) ]
+		self._intermediates = [ self._create_ca("Synthetic Issuing CA %d" % (i), issuer = self._rng.choice(self._roots)) for i in range(intermediate_count) ]
+		self._intermediate_weights = [ 1 / (rank + 1) for rank in range(intermediate_count) ]
+
+	# Minimal DER encoder
+	@staticmethod
+	def _der(tag, content):
+		length = len(content)
+		if length < 0x80:
+			header = bytes([ tag, length ])
+		else:
+			length_bytes = length.to_bytes((length.bit_length() + 7) // 8, byteorder = "big")
+			header = bytes([ tag, 0x80 | len(length_bytes) ]) + length_bytes
+		return header + content
+
+	@classmethod
+	def _sequence(cls, *elements):
+		return cls._der(0x30, b"".join(elements))
+
+	@classmethod
+	def _integer(cls, value):
+		encoded = value.to_bytes((value.bit_length() + 8) // 8, byteorder = "big")
+		return cls._der(0x02, encoded)
+
+	@classmethod
+	def _oid(cls, dotted):
+		values = [ int(value) for value in dotted.split(".") ]
+		values = [ (40 * values[0]) + values[1] ] + values[2:]
+		encoded = bytearray()
+		for value in values:
+			chunk = [ value & 0x7f ]
+			value >>= 7
+			while value > 0:
+				chunk.insert(0, 0x80 | (value & 0x7f))
+				value >>= 7
+			encoded += bytes(chunk)
+		return cls._der(0x06, bytes(encoded))
+
+	@classmethod
+	def _bit_string(cls, content, unused_bits = 0):
+		return cls._der(0x03, bytes([ unused_bits ]) + content)
+
+	@classmethod
+	def _name(cls, common_name, organization, country):
+		rdns = [ (cls._OID_COUNTRY, 0x13, country), (cls._OID_ORGANIZATION, 0x0c, organization), (cls._OID_COMMON_NAME, 0x0c, common_name) ]
+		return cls._sequence(*(cls._der(0x31, cls._sequence(cls._oid(oid), cls._der(tag, value.encode("utf-8")))) for (oid, tag, value) in rdns))
+
+	@classmethod
+	def _time(cls, timet):
+		ts = datetime.datetime.utcfromtimestamp(timet)
+		if ts.year < 2050:
+			return cls._der(0x17, ts.strftime("%y%m%d%H%M%SZ").encode("ascii"))
+		return cls._der(0x18, ts.strftime("%Y%m%d%H%M%SZ").encode("ascii"))
+
+	@classmethod
+	def _extension(cls, oid, value, critical = False):
+		elements = [ cls._oid(oid) ]
+		if critical:
+			elements.append(cls._der(0x01, b"\xff"))
+		elements.append(cls._der(0x04, value))
+		return cls._sequence(*elements)
+
+	def _rsa_modulus(self, bits):
+		# Random odd number of the right length; it is never factored
+		return int.from_bytes(self._rng.randbytes(bits // 8), byteorder = "big") | (1 << (bits - 1)) | 1
+
+	def _spki(self, modulus):
+		public_key = self._sequence(self._integer(modulus), self._integer(65537))
+		return self._sequence(self._sequence(self._oid(self._OID_RSA_ENCRYPTION), b"\x05\x00"), self._bit_string(public_key))
+
+	def _certificate(self, subject, issuer_name, issuer_bits, modulus, not_before, not_after, extensions):
+		self._serial += 1
+		serial = (self._rng.getrandbits(64) << 32) | self._serial
+		signature_algorithm = self._sequence(self._oid(self._OID_SHA256_WITH_RSA), b"\x05\x00")
+		tbs = self._sequence(
+			self._der(0xa0, self._integer(2)),
+			self._integer(serial),
+			signature_algorithm,
+			issuer_name,
+			self._sequence(self._time(not_before), self._time(not_after)),
+			subject,
+			self._spki(modulus),
+			self._der(0xa3, self._sequence(*extensions)),
+		)
+		return self._sequence(tbs, signature_algorithm, self._bit_string(self._rng.randbytes(issuer_bits // 8)))
+
+	def _create_ca(self, common_name, issuer):
+		organization = "%s Trust Services" % (common_name.split(" CA ")[0])
+		name = self._name(common_name, organization, self._rng.choice(self._COUNTRIES))
+		bits = self._rng.choice([ 2048, 4096 ]) if (issuer is None) else 2048
+		not_before = self._start_timet - self._rng.randint(1, 10) * 365 * 86400
+		extensions = [
+			self._extension(self._OID_BASIC_CONSTRAINTS, self._sequence(self._der(0x01, b"\xff")), critical = True),
+			self._extension(self._OID_KEY_USAGE, self._bit_string(b"\x06", unused_bits = 1), critical = True),
+			self._extension(self._OID_SUBJECT_KEY_IDENTIFIER, self._der(0x04, self._rng.randbytes(20))),
+		]
+		if issuer is None:
+			(issuer_name, issuer_bits) = (name, bits)
+		else:
+			(issuer_name, issuer_bits) = (issuer["name"], issuer["bits"])
+		der_cert = self._certificate(name, issuer_name, issuer_bits, self._rsa_modulus(bits), not_before, not_before + 20 * 365 * 86400, extensions)
+		return { "name": name, "bits": bits, "der": der_cert, "issuer": issuer }
+
+	def _create_leaf(self, servername, issuer, not_before):
+		name = self._name(servername, "Example Holdings %d" % (self._rng.randint(1, 1000)), self._rng.choice(self._COUNTRIES))
+		san = b"".join(self._der(0x82, name.encode("ascii")) for name in (servername, "www." + servername))
+		extensions = [
+			self._extension(self._OID_BASIC_CONSTRAINTS, self._sequence(), critical = True),
+			self._extension(self._OID_KEY_USAGE, self._bit_string(b"\xa0", unused_bits = 5), critical = True),
+			self._extension(self._OID_EXT_KEY_USAGE, self._sequence(self._oid(self._OID_SERVER_AUTH))),
+			self._extension(self._OID_SUBJECT_KEY_IDENTIFIER, self._der(0x04, self._rng.randbytes(20))),
+			self._extension(self._OID_SUBJECT_ALT_NAME, self._sequence(san)),
+		]
+		return self._certificate(name, issuer["name"], issuer["bits"], self._rsa_modulus(2048), not_before, not_before + 90 * 86400, extensions)
+
+	@property
+	def root_certificates(self):
+		return [ root["der"] for root in self._roots ]
+
+	@property
+	def intermediate_certificates(self):
+		return [ intermediate["der"] for intermediate in self._intermediates ]
+
+	def _servername(self, number):
+		return "host%d.example%d.%s" % (number, number % 97, self._TLDS[number % len(self._TLDS)])
+
+	def connections(self):
+		# Yields GeneratedConnection tuples in fetch time order per server
+		for number in range(self._servername_count):
+			servername = self._servername(number)
+			fetch_timestamp = self._start_timet + self._rng.randint(0, 86400)
+			leaf = None
+			for scrape in range(self._rng.randint(1, self._max_scrapes_per_servername)):
+				if (leaf is None) or (self._rng.random() >= self._leaf_reuse_ratio):
+					issuer = self._rng.choices(self._intermediates, weights = self._intermediate_weights)[0]
+					leaf = self._create_leaf(servername, issuer, fetch_timestamp - self._rng.randint(0, 60 * 86400))
+				chain = [ leaf, issuer["der"] ]
+				if self._rng.random() < self._root_in_chain_ratio:
+					chain.append(issuer["issuer"]["der"])
+				yield GeneratedConnection(servername = servername, fetch_timestamp = fetch_timestamp, certs = chain, leaf_only = False)
+				fetch_timestamp += self._rng.randint(30, 400) * 86400
+
+	@staticmethod
+	def s_client_output(connection):
+		# Text resembling "openssl s_client -showcerts" output for the chain
+		lines = [ "CONNECTED(00000003)", "---", "Certificate chain" ]
+		for (depth, der_cert) in enumerate(connection.certs):
+			lines.append(" %d s:CN = %s" % (depth, connection.servername))
+			lines.append(CertDecoder.render_pem(der_cert))
+		lines += [ "---", "Server certificate", "subject=CN = %s" % (connection.servername), "---" ]
+		return ("\n".join(lines) + "\n").encode("ascii")
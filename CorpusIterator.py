@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import hashlib
+
+class CorpusIterator():
+	# Iterates over (cert_sha256, der_cert) tuples of a CertDatabase for
+	# consumers like parser fuzzers. Partition i of n covers a contiguous
+	# range of the hash space, so n workers together see every certificate
+	# exactly once and each one only reads the shards its range overlaps.
+	# Sampling is decided by a keyed hash of the certificate hash, i.e., it
+	# is stable across runs and independent of the partitioning. The role
+	# filter uses the position within the chains of the TOC: "leaf" are
+	# certificates presented first, "ca" are those presented after it.
+	_PREFIX_BITS = 64
+
+	def __init__(self, certdb, partition = None, sample_rate = None, seed = 0, role = None):
+		if partition is None:
+			partition = (0, 1)
+		elif isinstance(partition, str):
+			partition = self.parse_partition(partition)
+		(self._partition_index, self._partition_count) = partition
+		if not (0 <= self._partition_index < self._partition_count):
+			raise ValueError("Invalid partition %d/%d." % (self._partition_index, self._partition_count))
+		if (sample_rate is not None) and not (0 <= sample_rate <= 1):
+			raise ValueError("Sample rate must be between 0 and 1.")
+		if role not in [ None, "leaf", "ca" ]:
+			raise ValueError("Invalid role: %s" % (role))
+		self._certdb = certdb
+		self._sample_rate = sample_rate
+		self._sample_key = str(seed).encode("utf-8")
+		self._role = role
+
+	@staticmethod
+	def parse_partition(text):
+		# "i/n" with 0 <= i < n
+		try:
+			(index, count) = (int(value) for value in text.split("/"))
+		except ValueError:
+			raise ValueError("Partition must be given as i/n: %s" % (text))
+		if not (0 <= index < count):
+			raise ValueError("Invalid partition %s." % (text))
+		return (index, count)
+
+	@property
+	def hash_range(self):
+		# (min_hash, max_hash) with min_hash <= cert_sha256 < max_hash, None
+		# meaning unbounded
+		space = 1 << self._PREFIX_BITS
+		lower = (self._partition_index * space) // self._partition_count
+		upper = ((self._partition_index + 1) * space) // self._partition_count
+		min_hash = None if (lower == 0) else lower.to_bytes(self._PREFIX_BITS // 8, byteorder = "big")
+		max_hash = None if (upper == space) else upper.to_bytes(self._PREFIX_BITS // 8, byteorder = "big")
+		return (min_hash, max_hash)
+
+	def _sampled(self, cert_hash):
+		if self._sample_rate is None:
+			return True
+		digest = hashlib.blake2b(cert_hash, digest_size = 8, key = self._sample_key).digest()
+		return int.from_bytes(digest, byteorder = "big") < self._sample_rate * (1 << 64)
+
+	def __iter__(self):
+		(min_hash, max_hash) = self.hash_range
+		if self._role is not None:
+			(leaf_hashes, ca_hashes) = self._certdb.get_role_hashes(min_hash = min_hash, max_hash = max_hash)
+			role_hashes = leaf_hashes if (self._role == "leaf") else ca_hashes
+		for (cert_hash, der_cert) in self._certdb.get_all_sorted_certificates(min_hash = min_hash, max_hash = max_hash):
+			if not self._sampled(cert_hash):
+				continue
+			if (self._role is not None) and (cert_hash not in role_hashes):
+				continue
+			yield (cert_hash, der_cert)
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import time
+import json
+import sqlite3
+import hashlib
+from CertScanner import open_readonly
+
+class DeltaSnapshotException(Exception): pass
+
+class DeltaSnapshot():
+	# A delta holds everything that was added to a database after a
+	# watermark conn_id: all connections with base_conn_id < conn_id <=
+	# conn_id and those certificates they reference that no connection up to
+	# base_conn_id references, i.e., that a mirror of the previous snapshot
+	# does not have yet. It is a Sqlite3 file; the manifest is also written
+	# as JSON next to it so that mirrors can check it before downloading.
+	#
+	# Connections are only ever added to a delta, never removed. Removing a
+	# connection at or below the watermark (or the connection with the
+	# highest conn_id, whose ID is then reused) cannot be expressed. Such a
+	# change is detected by comparing the number of connections up to the
+	# watermark and the connection at the watermark against the previous
+	# manifest, and the mirror's database against the base of the delta;
+	# a new full snapshot is needed then.
+	VERSION = 1
+
+	@staticmethod
+	def connection_signature(certdb, conn_id):
+		# Identifies the connection with this conn_id, None if there is none
+		connection = certdb.get_connection(conn_id) if (conn_id > 0) else None
+		return None if (connection is None) else [ connection.fetch_timestamp, connection.servername ]
+
+	@staticmethod
+	def file_sha256(filename):
+		hashval = hashlib.sha256()
+		with open(filename, "rb") as f:
+			while True:
+				chunk = f.read(1024 * 1024)
+				if len(chunk) == 0:
+					break
+				hashval.update(chunk)
+		return hashval.hexdigest()
+
+	@staticmethod
+	def read_manifest(filename):
+		with open(filename) as f:
+			return json.load(f)
+
+class DeltaSnapshotWriter(DeltaSnapshot):
+	def __init__(self, certdb):
+		self._certdb = certdb
+
+	def write(self, filename, base_conn_id = 0, base_manifest = None, progress_callback = None):
+		# Returns the manifest, which includes the SHA256 of the written file.
+		# With the manifest of the previous snapshot, the delta starts after
+		# it and connections removed since are detected.
+		if base_manifest is not None:
+			base_conn_id = base_manifest["conn_id"]
+			if "last_connection" in base_manifest:
+				if (self._certdb.count_connections(base_conn_id) != base_manifest["total_connection_count"]) or (self.connection_signature(self._certdb, base_conn_id) != base_manifest["last_connection"]):
+					raise DeltaSnapshotException("Connections of the previous snapshot were removed or replaced since, a delta cannot express that. Create a full snapshot instead.")
+		base_connection_count = self._certdb.count_connections(base_conn_id)
+		tmp_filename = filename + ".tmp"
+		if os.path.exists(tmp_filename):
+			os.unlink(tmp_filename)
+		conn = sqlite3.connect(tmp_filename)
+		try:
+			conn.execute("CREATE TABLE manifest (key varchar PRIMARY KEY, value varchar NOT NULL);")
+			conn.execute("""
+			CREATE TABLE connections (
+				conn_id integer PRIMARY KEY,
+				leaf_only boolean NOT NULL,
+				fetch_timestamp integer NOT NULL,
+				servername varchar NOT NULL,
+				cert_hashes blob NOT NULL
+			);
+			""")
+			conn.execute("CREATE TABLE certificates (cert_sha256 blob PRIMARY KEY, der_cert blob NOT NULL);")
+
+			(conn_id, connection_count, max_fetch_timestamp) = (base_conn_id, 0, None)
+			new_hashes = set()
+			for toc_entry in self._certdb.get_toc_entries(after_conn_id = base_conn_id):
+				conn.execute("INSERT INTO connections (conn_id, leaf_only, fetch_timestamp, servername, cert_hashes) VALUES (?, ?, ?, ?, ?);", toc_entry)
+				(conn_id, leaf_only, fetch_timestamp, servername, cert_hashes) = toc_entry
+				max_fetch_timestamp = fetch_timestamp if (max_fetch_timestamp is None) else max(max_fetch_timestamp, fetch_timestamp)
+				for i in range(0, len(cert_hashes), 32):
+					cert_hash = cert_hashes[i : i + 32]
+					if (cert_hash not in new_hashes) and (not self._certdb.is_cert_referenced(cert_hash, max_conn_id = base_conn_id)):
+						new_hashes.add(cert_hash)
+				connection_count += 1
+				if (progress_callback is not None) and ((connection_count % 10000) == 0):
+					progress_callback("connections", connection_count)
+
+			cert_hashes = [ ]
+			for cert_hash in sorted(new_hashes):
+				# Certificates missing from storage are missing on the mirror
+				# as well, check_db.py reports them on both sides
+				der_cert = self._certdb.get_certificate(cert_hash)
+				if der_cert is None:
+					continue
+				conn.execute("INSERT INTO certificates (cert_sha256, der_cert) VALUES (?, ?);", (cert_hash, der_cert))
+				cert_hashes.append(cert_hash.hex())
+				if (progress_callback is not None) and ((len(cert_hashes) % 10000) == 0):
+					progress_callback("certificates", len(cert_hashes))
+
+			manifest = {
+				"version":					self.VERSION,
+				"base_conn_id":				base_conn_id,
+				"base_connection_count":	base_connection_count,
+				"conn_id":					conn_id,
+				"connection_count":			connection_count,
+				"certificate_count":		len(cert_hashes),
+				"total_connection_count":	self._certdb.connection_count,
+				"last_connection":			self.connection_signature(self._certdb, conn_id),
+				"max_fetch_timestamp":		max_fetch_timestamp,
+				"created":					int(time.time()),
+			}
+			conn.executemany("INSERT INTO manifest (key, value) VALUES (?, ?);", ((key, json.dumps(value)) for (key, value) in manifest.items()))
+			conn.commit()
+		finally:
+			conn.close()
+		os.rename(tmp_filename, filename)
+		manifest["sha256"] = self.file_sha256(filename)
+		manifest["cert_hashes"] = cert_hashes
+		return manifest
+
+class DeltaSnapshotReader(DeltaSnapshot):
+	def __init__(self, filename):
+		self._filename = filename
+		try:
+			self._conn = open_readonly(filename)
+			self._manifest = { key: json.loads(value) for (key, value) in self._conn.execute("SELECT key, value FROM manifest;").fetchall() }
+		except sqlite3.DatabaseError:
+			raise DeltaSnapshotException("%s is not a delta snapshot." % (filename))
+		if self._manifest.get("version") != self.VERSION:
+			self._conn.close()
+			raise DeltaSnapshotException("%s has unsupported version %s." % (filename, self._manifest.get("version")))
+
+	@property
+	def manifest(self):
+		return self._manifest
+
+	def get_toc_entries(self):
+		yield from self._conn.execute("SELECT conn_id, leaf_only, fetch_timestamp, servername, cert_hashes FROM connections ORDER BY conn_id ASC;")
+
+	def get_certificates(self):
+		yield from self._conn.execute("SELECT cert_sha256, der_cert FROM certificates ORDER BY cert_sha256 ASC;")
+
+	def check_manifest(self, published_manifest):
+		# Compares the delta against the published JSON manifest, returns a
+		# list of problems
+		problems = [ ]
+		if published_manifest.get("sha256") != self.file_sha256(self._filename):
+			problems.append("SHA256 of the file does not match the manifest")
+		for (key, value) in self._manifest.items():
+			if published_manifest.get(key) != value:
+				problems.append("Manifest entry %s differs: %s in file, %s published" % (key, value, published_manifest.get(key)))
+		if sorted(published_manifest.get("cert_hashes", [ ])) != [ cert_hash.hex() for (cert_hash, ) in self._conn.execute("SELECT cert_sha256 FROM certificates ORDER BY cert_sha256 ASC;") ]:
+			problems.append("Certificate hashes differ from the manifest")
+		return problems
+
+	def apply(self, certdb, batch_size = 5000):
+		# Certificates go in first, the connections referencing them in one
+		# TOC transaction at the end. An interrupted import can therefore be
+		# repeated, already stored certificates are skipped.
+		if certdb.max_conn_id != self._manifest["base_conn_id"]:
+			raise DeltaSnapshotException("Delta applies on top of conn_id %d, but the database is at conn_id %d." % (self._manifest["base_conn_id"], certdb.max_conn_id))
+		if ("base_connection_count" in self._manifest) and (certdb.connection_count != self._manifest["base_connection_count"]):
+			raise DeltaSnapshotException("Delta applies on top of %d connections, but the database has %d." % (self._manifest["base_connection_count"], certdb.connection_count))
+		new_cert_count = 0
+		batch = [ ]
+		for (cert_hash, der_cert) in self.get_certificates():
+			if hashlib.sha256(der_cert).digest() != cert_hash:
+				raise DeltaSnapshotException("Certificate %s in delta does not match its hash." % (cert_hash.hex()))
+			batch.append((cert_hash, der_cert))
+			if len(batch) >= batch_size:
+				new_cert_count += certdb.add_hashed_certificates(batch)
+				batch = [ ]
+		new_cert_count += certdb.add_hashed_certificates(batch)
+		certdb.commit()
+
+		connection_count = certdb.add_toc_entries(self.get_toc_entries())
+		certdb.commit()
+		return (connection_count, new_cert_count)
+
+	def verify(self, certdb):
+		# Checks a database that the delta was applied to, returns a list of
+		# problems
+		problems = [ ]
+		if certdb.max_conn_id != self._manifest["conn_id"]:
+			problems.append("Database is at conn_id %d, expected %d" % (certdb.max_conn_id, self._manifest["conn_id"]))
+		if certdb.connection_count != self._manifest["total_connection_count"]:
+			problems.append("Database has %d connections, expected %d" % (certdb.connection_count, self._manifest["total_connection_count"]))
+		for (cert_hash, der_cert) in self.get_certificates():
+			if certdb.get_certificate(cert_hash) != der_cert:
+				problems.append("Certificate %s is missing or differs" % (cert_hash.hex()))
+		for (conn_id, leaf_only, fetch_timestamp, servername, cert_hashes) in self.get_toc_entries():
+			connection = certdb.get_connection(conn_id)
+			if (connection is None) or ((connection.leaf_only, connection.fetch_timestamp, connection.servername) != (leaf_only, fetch_timestamp, servername)):
+				problems.append("Connection %d is missing or differs" % (conn_id))
+			elif None in connection.certs:
+				problems.append("Connection %d references certificates that are not stored" % (conn_id))
+		return problems
+
+	def close(self):
+		self._conn.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import time
+import collections
+
+class GroupCommitter():
+	# Groups many small writes into one transaction. The commit function is
+	# called as soon as max_batch_size writes are pending or the oldest
+	# pending write is max_delay seconds old, whichever comes first. Batch
+	# sizes and commit latencies are recorded for reporting.
+	_Statistics = collections.namedtuple("Statistics", [ "batch_count", "write_count", "mean_batch_size", "max_batch_size", "mean_latency", "p95_latency", "max_latency" ])
+
+	def __init__(self, commit_function, max_batch_size = 1000, max_delay = 5, clock = time.monotonic):
+		self._commit_function = commit_function
+		self._max_batch_size = max_batch_size
+		self._max_delay = max_delay
+		self._clock = clock
+		self._pending = 0
+		self._first_pending_time = None
+		self._batch_sizes = [ ]
+		self._latencies = [ ]
+
+	@property
+	def pending(self):
+		return self._pending
+
+	def time_until_flush(self):
+		# Seconds until the pending writes are due, None if nothing is pending
+		if self._pending == 0:
+			return None
+		return max(0, self._first_pending_time + self._max_delay - self._clock())
+
+	def add(self, count = 1):
+		if self._pending == 0:
+			self._first_pending_time = self._clock()
+		self._pending += count
+		if (self._pending >= self._max_batch_size) or (self.time_until_flush() == 0):
+			self.flush()
+
+	def flush(self):
+		if self._pending == 0:
+			return
+		t0 = self._clock()
+		self._commit_function()
+		self._latencies.append(self._clock() - t0)
+		self._batch_sizes.append(self._pending)
+		self._pending = 0
+		self._first_pending_time = None
+
+	@property
+	def statistics(self):
+		if len(self._batch_sizes) == 0:
+			return self._Statistics(batch_count = 0, write_count = 0, mean_batch_size = 0, max_batch_size = 0, mean_latency = 0, p95_latency = 0, max_latency = 0)
+		latencies = sorted(self._latencies)
+		return self._Statistics(
+			batch_count = len(self._batch_sizes),
+			write_count = sum(self._batch_sizes),
+			mean_batch_size = sum(self._batch_sizes) / len(self._batch_sizes),
+			max_batch_size = max(self._batch_sizes),
+			mean_latency = sum(latencies) / len(latencies),
+			p95_latency = latencies[min(len(latencies) - 1, round(len(latencies) * 0.95))],
+			max_latency = latencies[-1],
+		)
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import mmap
+import struct
+import collections
+
+class PackedCorpusException(Exception): pass
+
+class PackedCorpus():
+	# Single-file, read-only representation of a whole CertDatabase. All
+	# integers are little endian, offsets are absolute file offsets:
+	#
+	#   header            see _HEADER
+	#   blob region       all DER certificates back to back, in hash order
+	#   cert index        cert_count * (sha256, blob offset, length), sorted
+	#   connection table  connection_count * _CONNECTION, sorted by conn_id
+	#   cert refs         uint32 cert index per certificate of a connection,
+	#                     MISSING_CERT if the certificate was not stored
+	#   strings           UTF-8 server names
+	#   servername order  uint32 connection indices sorted by server name and
+	#                     fetch timestamp
+	MAGIC = b"X509PCK\x00"
+	VERSION = 1
+	MISSING_CERT = 0xffffffff
+	_HEADER = struct.Struct("<8sII 12Q")
+	_HEADER_SIZE = 128
+	_CERT_ENTRY = struct.Struct("<32sQI4x")
+	_CONNECTION = struct.Struct("<QqQQIHBx")
+	_UINT32 = struct.Struct("<I")
+	_Header = collections.namedtuple("Header", [ "magic", "version", "header_size", "cert_count", "connection_count", "blob_offset", "blob_size", "cert_index_offset", "connection_table_offset", "cert_refs_offset", "cert_refs_count", "strings_offset", "strings_size", "servername_order_offset", "reserved" ])
+
+	@classmethod
+	def find_cert_index(cls, buffer, cert_index_offset, cert_count, cert_hash):
+		# Binary search in a cert index, returns the entry number or None
+		(lo, hi) = (0, cert_count)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			offset = cert_index_offset + (mid * cls._CERT_ENTRY.size)
+			key = bytes(buffer[offset : offset + 32])
+			if key < cert_hash:
+				lo = mid + 1
+			elif key > cert_hash:
+				hi = mid
+			else:
+				return mid
+		return None
+
+	@classmethod
+	def find_connection_index(cls, buffer, connection_table_offset, connection_count, conn_id):
+		# Binary search in a connection table, returns the entry number or None
+		(lo, hi) = (0, connection_count)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			mid_conn_id = struct.unpack_from("<Q", buffer, connection_table_offset + (mid * cls._CONNECTION.size))[0]
+			if mid_conn_id < conn_id:
+				lo = mid + 1
+			elif mid_conn_id > conn_id:
+				hi = mid
+			else:
+				return mid
+		return None
+
+class PackedCorpusWriter(PackedCorpus):
+	# Exports a CertDatabase. Certificates and connections are streamed from
+	# the database; the cert index, the connection table, cert references
+	# and server names are kept in memory in their packed form until the end.
+	def __init__(self, certdb):
+		self._certdb = certdb
+
+	def write(self, filename, progress_callback = None):
+		tmp_filename = filename + ".tmp"
+		with open(tmp_filename, "wb") as f:
+			f.write(bytes(self._HEADER_SIZE))
+
+			# Blob region and cert index
+			blob_offset = f.tell()
+			cert_index = bytearray()
+			cert_count = 0
+			for (cert_hash, der_cert) in self._certdb.get_all_sorted_certificates():
+				cert_index += self._CERT_ENTRY.pack(cert_hash, f.tell(), len(der_cert))
+				f.write(der_cert)
+				cert_count += 1
+				if (progress_callback is not None) and ((cert_count % 10000) == 0):
+					progress_callback("certificates", cert_count)
+			blob_size = f.tell() - blob_offset
+			cert_index_offset = f.tell()
+			f.write(cert_index)
+
+			# Connections with their cert references and server names
+			cert_refs = bytearray()
+			strings = bytearray()
+			connection_table = bytearray()
+			connection_count = 0
+			for (conn_id, leaf_only, fetch_timestamp, servername, cert_hashes) in self._certdb.get_toc_entries():
+				encoded_servername = servername.encode("utf-8")
+				connection_table += self._CONNECTION.pack(conn_id, fetch_timestamp, len(cert_refs) // self._UINT32.size, len(strings), len(encoded_servername), len(cert_hashes) // 32, int(leaf_only))
+				strings += encoded_servername
+				for i in range(0, len(cert_hashes), 32):
+					cert_number = self.find_cert_index(cert_index, 0, cert_count, cert_hashes[i : i + 32])
+					cert_refs += self._UINT32.pack(self.MISSING_CERT if (cert_number is None) else cert_number)
+				connection_count += 1
+				if (progress_callback is not None) and ((connection_count % 10000) == 0):
+					progress_callback("connections", connection_count)
+			connection_table_offset = f.tell()
+			f.write(connection_table)
+			cert_refs_offset = f.tell()
+			f.write(cert_refs)
+			strings_offset = f.tell()
+			f.write(strings)
+			servername_order_offset = f.tell()
+			for conn_id in self._certdb.get_conn_ids_by_servername():
+				f.write(self._UINT32.pack(self.find_connection_index(connection_table, 0, connection_count, conn_id)))
+
+			header = self._HEADER.pack(self.MAGIC, self.VERSION, self._HEADER_SIZE, cert_count, connection_count, blob_offset, blob_size,
+					cert_index_offset, connection_table_offset, cert_refs_offset, len(cert_refs) // self._UINT32.size, strings_offset, len(strings), servername_order_offset, 0)
+			f.seek(0)
+			f.write(header)
+		os.rename(tmp_filename, filename)
+		return (cert_count, connection_count)
+
+class PackedCorpusReader(PackedCorpus):
+	# Memory-maps a packed corpus. Certificates are handed out as memoryview
+	# objects into the mapping (no copy); they become invalid once the reader
+	# is closed.
+	_Connection = collections.namedtuple("Connection", [ "conn_id", "leaf_only", "fetch_timestamp", "servername", "certs" ])
+
+	def __init__(self, filename):
+		self._file = open(filename, "rb")
+		try:
+			self._mmap = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+		except ValueError:
+			self._file.close()
+			raise PackedCorpusException("%s is empty." % (filename))
+		self._view = memoryview(self._mmap)
+		if len(self._mmap) < self._HEADER.size:
+			self.close()
+			raise PackedCorpusException("%s is too short for a packed corpus." % (filename))
+		self._header = self._Header(*self._HEADER.unpack_from(self._mmap, 0))
+		if self._header.magic != self.MAGIC:
+			self.close()
+			raise PackedCorpusException("%s is not a packed corpus." % (filename))
+		if self._header.version != self.VERSION:
+			self.close()
+			raise PackedCorpusException("%s has unsupported version %d." % (filename, self._header.version))
+
+	@property
+	def certificate_count(self):
+		return self._header.cert_count
+
+	@property
+	def connection_count(self):
+		return self._header.connection_count
+
+	def _cert_entry(self, cert_number):
+		return self._CERT_ENTRY.unpack_from(self._mmap, self._header.cert_index_offset + (cert_number * self._CERT_ENTRY.size))
+
+	def _cert_by_number(self, cert_number):
+		if cert_number == self.MISSING_CERT:
+			return None
+		(cert_hash, offset, length) = self._cert_entry(cert_number)
+		return self._view[offset : offset + length]
+
+	def __contains__(self, cert_hash):
+		return self.find_cert_index(self._mmap, self._header.cert_index_offset, self._header.cert_count, cert_hash) is not None
+
+	def get_certificate(self, cert_hash):
+		cert_number = self.find_cert_index(self._mmap, self._header.cert_index_offset, self._header.cert_count, cert_hash)
+		if cert_number is not None:
+			return self._cert_by_number(cert_number)
+
+	def get_all_certificates(self):
+		# Yields (cert_sha256, der_cert) in hash order
+		for cert_number in range(self._header.cert_count):
+			(cert_hash, offset, length) = self._cert_entry(cert_number)
+			yield (cert_hash, self._view[offset : offset + length])
+
+	def _connection(self, connection_number):
+		(conn_id, fetch_timestamp, refs_start, string_offset, string_length, cert_count, leaf_only) = self._CONNECTION.unpack_from(self._mmap, self._header.connection_table_offset + (connection_number * self._CONNECTION.size))
+		string_offset += self._header.strings_offset
+		servername = self._mmap[string_offset : string_offset + string_length].decode("utf-8")
+		refs_offset = self._header.cert_refs_offset + (refs_start * self._UINT32.size)
+		certs = [ self._cert_by_number(cert_number) for (cert_number, ) in self._UINT32.iter_unpack(self._mmap[refs_offset : refs_offset + (cert_count * self._UINT32.size)]) ]
+		return self._Connection(conn_id = conn_id, leaf_only = bool(leaf_only), fetch_timestamp = fetch_timestamp, servername = servername, certs = certs)
+
+	def get_connection(self, conn_id):
+		connection_number = self.find_connection_index(self._mmap, self._header.connection_table_offset, self._header.connection_count, conn_id)
+		if connection_number is not None:
+			return self._connection(connection_number)
+
+	def _servername_at(self, order_number):
+		connection_number = self._UINT32.unpack_from(self._mmap, self._header.servername_order_offset + (order_number * self._UINT32.size))[0]
+		(conn_id, fetch_timestamp, refs_start, string_offset, string_length, cert_count, leaf_only) = self._CONNECTION.unpack_from(self._mmap, self._header.connection_table_offset + (connection_number * self._CONNECTION.size))
+		string_offset += self._header.strings_offset
+		return (connection_number, self._mmap[string_offset : string_offset + string_length])
+
+	def get_connections_by_servername(self, servername):
+		# Yields connections in fetch timestamp order, like CertDatabase
+		servername = servername.encode("utf-8")
+		(lo, hi) = (0, self._header.connection_count)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self._servername_at(mid)[1] < servername:
+				lo = mid + 1
+			else:
+				hi = mid
+		for order_number in range(lo, self._header.connection_count):
+			(connection_number, order_servername) = self._servername_at(order_number)
+			if order_servername != servername:
+				break
+			yield self._connection(connection_number)
+
+	def get_all_connections(self):
+		# Yields all connections in conn_id order
+		for connection_number in range(self._header.connection_count):
+			yield self._connection(connection_number)
+
+	def close(self):
+		if self._mmap is None:
+			return
+		self._view.release()
+		try:
+			self._mmap.close()
+		except BufferError:
+			# Certificates are still referenced, the mapping goes away with
+			# the last of them
+			pass
+		self._file.close()
+		self._mmap = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
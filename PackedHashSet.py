@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import heapq
+
+class PackedHashSet():
+	# Set of fixed-width hashes stored as one sorted, packed bytes object
+	# (32 bytes per SHA256 instead of a Python object each). Lookups are a
+	# binary search; hashes added later go into a small overflow set until
+	# compact() merges them into the packed representation. That happens on
+	# its own once the overflow reaches an eighth of the packed hashes (but
+	# at least MIN_COMPACT_OVERFLOW), so that memory stays close to 32 bytes
+	# per hash however many are added.
+	MIN_COMPACT_OVERFLOW = 65536
+
+	def __init__(self, hashes = None, width = 32, presorted = False):
+		self._width = width
+		if hashes is None:
+			hashes = [ ]
+		if not presorted:
+			hashes = sorted(set(hashes))
+		self._packed = b"".join(hashes)
+		self._count = len(self._packed) // width
+		self._overflow = set()
+
+	@classmethod
+	def from_packed(cls, packed, width = 32):
+		# Packed data must already be sorted and free of duplicates
+		hash_set = cls(width = width)
+		hash_set._packed = bytes(packed)
+		hash_set._count = len(packed) // width
+		return hash_set
+
+	def union_packed(self, packed):
+		# Returns a new set that additionally contains the given unsorted,
+		# possibly duplicate, packed hashes. Both sides are merged in sorted
+		# order straight into the new packed buffer, only the given hashes
+		# are held as separate objects while sorting them.
+		packed = bytes(packed)
+		added = sorted(packed[i : i + self._width] for i in range(0, len(packed), self._width))
+		merged = bytearray()
+		previous = None
+		for key in heapq.merge(iter(self), added):
+			if key != previous:
+				merged += key
+				previous = key
+		return PackedHashSet.from_packed(merged, width = self._width)
+
+	@property
+	def width(self):
+		return self._width
+
+	@property
+	def packed(self):
+		self.compact()
+		return self._packed
+
+	def _key(self, index):
+		offset = index * self._width
+		return self._packed[offset : offset + self._width]
+
+	def _bisect(self, value, lo = 0, hi = None):
+		# Index of the first packed hash in [lo, hi) that is not less than
+		# value
+		if hi is None:
+			hi = self._count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self._key(mid) < value:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+
+	def _packed_contains(self, value):
+		index = self._bisect(value)
+		return (index < self._count) and (self._key(index) == value)
+
+	def _gallop(self, value, lo):
+		# Like _bisect, but cheaper when the result is close to lo
+		step = 1
+		while (lo + step < self._count) and (self._key(lo + step) < value):
+			step *= 2
+		return self._bisect(value, lo = lo + (step // 2), hi = min(lo + step + 1, self._count))
+
+	def __contains__(self, value):
+		return (value in self._overflow) or self._packed_contains(value)
+
+	def add(self, value):
+		if not self._packed_contains(value):
+			self._overflow.add(value)
+			if len(self._overflow) >= max(self.MIN_COMPACT_OVERFLOW, self._count // 8):
+				self.compact()
+
+	def compact(self):
+		if len(self._overflow) == 0:
+			return
+		# Runs of packed hashes between two overflow hashes are copied as a
+		# whole; overflow hashes are never in the packed part
+		packed = memoryview(self._packed)
+		merged = bytearray()
+		start = 0
+		for key in sorted(self._overflow):
+			index = self._gallop(key, start)
+			merged += packed[start * self._width : index * self._width]
+			merged += key
+			start = index
+		merged += packed[start * self._width : ]
+		packed.release()
+		self._packed = bytes(merged)
+		self._count = len(self._packed) // self._width
+		self._overflow = set()
+
+	def _iter_packed(self):
+		for index in range(self._count):
+			yield self._key(index)
+
+	def __iter__(self):
+		# Iterates in sorted order
+		return heapq.merge(self._iter_packed(), sorted(self._overflow))
+
+	def __len__(self):
+		return self._count + len(self._overflow)
@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import json
+import time
+import bisect
+import collections
+
+class Histogram():
+	# Fixed-bucket histogram as used by Prometheus: observing a value is a
+	# binary search and an increment, quantiles are interpolated within the
+	# bucket that contains them.
+	LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+	SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+	def __init__(self, buckets = LATENCY_BUCKETS):
+		self._buckets = tuple(buckets)
+		self._counts = [ 0 ] * (len(self._buckets) + 1)
+		self._sum = 0
+		self._count = 0
+
+	@property
+	def count(self):
+		return self._count
+
+	@property
+	def sum(self):
+		return self._sum
+
+	@property
+	def mean(self):
+		return (self._sum / self._count) if (self._count > 0) else 0
+
+	def observe(self, value):
+		self._counts[bisect.bisect_left(self._buckets, value)] += 1
+		self._sum += value
+		self._count += 1
+
+	def cumulative_counts(self):
+		# Yields (upper bound, cumulative count), the last bound is infinity
+		total = 0
+		for (upper_bound, count) in zip(self._buckets + (float("inf"), ), self._counts):
+			total += count
+			yield (upper_bound, total)
+
+	def quantile(self, q):
+		if self._count == 0:
+			return 0
+		rank = q * self._count
+		lower_bound = 0
+		previous_total = 0
+		for (upper_bound, total) in self.cumulative_counts():
+			if total >= rank:
+				if upper_bound == float("inf"):
+					return lower_bound
+				return lower_bound + (upper_bound - lower_bound) * (rank - previous_total) / (total - previous_total)
+			(lower_bound, previous_total) = (upper_bound, total)
+		return lower_bound
+
+	def to_dict(self):
+		return {
+			"count":	self._count,
+			"sum":		self._sum,
+			"mean":		self.mean,
+			"p50":		self.quantile(0.5),
+			"p95":		self.quantile(0.95),
+			"p99":		self.quantile(0.99),
+			"buckets":	[ [ "+Inf" if (upper_bound == float("inf")) else upper_bound, total ] for (upper_bound, total) in self.cumulative_counts() ],
+		}
+
+class ScrapeMetrics():
+	# Counters, gauges and histograms of the scraping pipeline. Everything is
+	# aggregated in a single process (the database writer) from timings that
+	# travel along with the results, so recording is cheap and lock-free.
+	# Metrics can be exported to a Prometheus text format file (suitable for
+	# the node exporter's textfile collector) and to a JSON file, both of
+	# which are replaced atomically.
+	_STAGE_DESCRIPTIONS = collections.OrderedDict((
+		("work_queue",		"Time a domain name waited in the work queue"),
+		("dns",				"Name resolution"),
+		("connect",			"TCP connection establishment"),
+		("handshake",		"TLS handshake (for the openssl retriever: the whole s_client run)"),
+		("parse",			"Extraction of the DER certificates"),
+		("retrieve",		"Whole certificate retrieval including all of the above network stages"),
+		("dedupe",			"Hashing and deduplication of certificates in the worker"),
+		("result_queue",	"Time a result spent in the result queue including blocked puts"),
+		("db_write",		"Writing one result to the databases, uncommitted"),
+		("commit",			"Committing one batch of results to all databases"),
+	))
+
+	def __init__(self):
+		self._t0 = time.time()
+		self._counters = collections.Counter()
+		self._gauges = { }
+		self._histograms = { }
+		self._batch_sizes = Histogram(Histogram.SIZE_BUCKETS)
+
+	def observe(self, stage, seconds):
+		histogram = self._histograms.get(stage)
+		if histogram is None:
+			histogram = Histogram()
+			self._histograms[stage] = histogram
+		histogram.observe(seconds)
+
+	def observe_timings(self, timings):
+		for (stage, seconds) in timings.items():
+			self.observe(stage, seconds)
+
+	def observe_batch_size(self, size):
+		self._batch_sizes.observe(size)
+
+	def count_result(self, resultcode):
+		self._counters[resultcode] += 1
+
+	def set_gauge(self, name, value):
+		self._gauges[name] = value
+
+	@property
+	def elapsed(self):
+		return time.time() - self._t0
+
+	def _sorted_stages(self):
+		known = [ stage for stage in self._STAGE_DESCRIPTIONS if stage in self._histograms ]
+		return known + sorted(stage for stage in self._histograms if stage not in self._STAGE_DESCRIPTIONS)
+
+	def to_dict(self):
+		elapsed = self.elapsed
+		result_count = sum(self._counters.values())
+		return {
+			"elapsed_secs":			elapsed,
+			"results":				dict(self._counters),
+			"results_per_sec":		(result_count / elapsed) if (elapsed > 0) else 0,
+			"queue_depths":			self._gauges,
+			"stages":				{ stage: self._histograms[stage].to_dict() for stage in self._sorted_stages() },
+			"commit_batch_sizes":	self._batch_sizes.to_dict(),
+		}
+
+	@staticmethod
+	def _format_bound(upper_bound):
+		return "+Inf" if (upper_bound == float("inf")) else repr(upper_bound)
+
+	def _prometheus_histogram(self, lines, name, label, histogram):
+		for (upper_bound, total) in histogram.cumulative_counts():
+			lines.append("%s_bucket{%sle=\"%s\"} %d" % (name, label, self._format_bound(upper_bound), total))
+		label = "{%s}" % (label.rstrip(",")) if (label != "") else ""
+		lines.append("%s_sum%s %f" % (name, label, histogram.sum))
+		lines.append("%s_count%s %d" % (name, label, histogram.count))
+
+	def to_prometheus(self):
+		lines = [ ]
+		lines.append("# HELP x509_scrape_results_total Scrape results by result code.")
+		lines.append("# TYPE x509_scrape_results_total counter")
+		for (resultcode, count) in sorted(self._counters.items()):
+			lines.append("x509_scrape_results_total{result=\"%s\"} %d" % (resultcode, count))
+		lines.append("# HELP x509_scrape_queue_depth Number of items waiting in the multiprocessing queues.")
+		lines.append("# TYPE x509_scrape_queue_depth gauge")
+		for (name, value) in sorted(self._gauges.items()):
+			lines.append("x509_scrape_queue_depth{queue=\"%s\"} %d" % (name, value))
+		lines.append("# HELP x509_scrape_stage_seconds Latency of the individual scrape pipeline stages.")
+		lines.append("# TYPE x509_scrape_stage_seconds histogram")
+		for stage in self._sorted_stages():
+			self._prometheus_histogram(lines, "x509_scrape_stage_seconds", "stage=\"%s\"," % (stage), self._histograms[stage])
+		lines.append("# HELP x509_scrape_commit_batch_size Number of results per database commit.")
+		lines.append("# TYPE x509_scrape_commit_batch_size histogram")
+		self._prometheus_histogram(lines, "x509_scrape_commit_batch_size", "", self._batch_sizes)
+		return "\n".join(lines) + "\n"
+
+	@staticmethod
+	def _write_atomically(filename, content):
+		tmp_filename = filename + ".tmp"
+		with open(tmp_filename, "w") as f:
+			f.write(content)
+		os.rename(tmp_filename, filename)
+
+	def write(self, prometheus_filename = None, json_filename = None):
+		if prometheus_filename is not None:
+			self._write_atomically(prometheus_filename, self.to_prometheus())
+		if json_filename is not None:
+			self._write_atomically(json_filename, json.dumps(self.to_dict(), indent = 4, sort_keys = True) + "\n")
+
+	def summary(self):
+		result_count = sum(self._counters.values())
+		yield "%d results in %.0f secs (%.1f results/sec): %s" % (result_count, self.elapsed, result_count / max(self.elapsed, 1e-9), ", ".join("%s %d" % (resultcode, count) for (resultcode, count) in sorted(self._counters.items())))
+		yield "%-14s %8s %10s %10s %10s %10s" % ("Stage", "Count", "Mean ms", "p50 ms", "p95 ms", "p99 ms")
+		for stage in self._sorted_stages():
+			histogram = self._histograms[stage]
+			yield "%-14s %8d %10.1f %10.1f %10.1f %10.1f" % (stage, histogram.count, histogram.mean * 1000, histogram.quantile(0.5) * 1000, histogram.quantile(0.95) * 1000, histogram.quantile(0.99) * 1000)
+		if self._batch_sizes.count > 0:
+			yield "Commit batches: %d, mean size %.1f, p95 size %.0f" % (self._batch_sizes.count, self._batch_sizes.mean, self._batch_sizes.quantile(0.95))
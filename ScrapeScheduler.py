@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+import time
+import heapq
+import contextlib
+import socket
+import ipaddress
+import collections
+import concurrent.futures
+
+class ScrapeScheduler():
+	# Decides which domain name is scraped next. Domain names are grouped by
+	# a key (registrable domain or resolved address) and two connections to
+	# the same key are at least min_spacing seconds apart. The number of
+	# connections in flight is adapted to the observed results: when too many
+	# connections fail or time out or handshakes become slow, concurrency is
+	# decreased multiplicatively, otherwise it is increased additively. Since
+	# part of any domain list is permanently unreachable, the failure ratio
+	# is compared against its own moving average as well. A domain name for
+	# which no result was reported within lost_timeout seconds is given up on
+	# so that a lost result cannot block the scheduler forever.
+	_QueueDepths = collections.namedtuple("QueueDepths", [ "pending", "keys", "ready_keys", "in_flight", "concurrency" ])
+	_SECOND_LEVEL_LABELS = set([ "ac", "co", "com", "edu", "gov", "net", "or", "org", "ne", "go" ])
+
+	def __init__(self, domainnames, min_spacing = 1, initial_concurrency = 20, max_concurrency = 20, min_concurrency = 1, key_function = None, max_failure_ratio = 0.25, max_latency = None, adjust_interval = 50, lost_timeout = None, clock = time.monotonic):
+		self._min_spacing = min_spacing
+		self._max_concurrency = max_concurrency
+		self._min_concurrency = min_concurrency
+		self._concurrency = max(min_concurrency, min(initial_concurrency, max_concurrency))
+		self._key_function = key_function or self.registrable_domain
+		self._max_failure_ratio = max_failure_ratio
+		self._max_latency = max_latency
+		self._adjust_interval = adjust_interval
+		self._lost_timeout = lost_timeout
+		self._clock = clock
+
+		self._pending_by_key = collections.defaultdict(collections.deque)
+		self._pending_count = 0
+		self._key_heap = [ ]
+		self._in_flight = 0
+		self._in_flight_since = collections.defaultdict(collections.deque)
+		self._dispatched = collections.deque()
+		self._recent_results = [ ]
+		self._baseline_failure_ratio = None
+		self._result_counts = collections.Counter()
+		for domainname in domainnames:
+			self._pending_by_key[self._key_function(domainname)].append(domainname)
+			self._pending_count += 1
+		now = self._clock()
+		for (seq, key) in enumerate(self._pending_by_key):
+			heapq.heappush(self._key_heap, (now, seq, key))
+		self._seq = len(self._key_heap)
+
+	@classmethod
+	def registrable_domain(cls, domainname):
+		# Approximation without the public suffix list: the last two labels,
+		# or three if the second to last one is a typical second level label
+		# below a country code TLD (e.g., example.co.uk).
+		with contextlib.suppress(ValueError):
+			return str(ipaddress.ip_address(domainname))
+		labels = domainname.rstrip(".").lower().split(".")
+		if (len(labels) >= 3) and (len(labels[-1]) == 2) and (labels[-2] in cls._SECOND_LEVEL_LABELS):
+			return ".".join(labels[-3:])
+		return ".".join(labels[-2:])
+
+	@classmethod
+	def resolve_keys(cls, domainnames, threads = 64):
+		# Returns a key function that maps domain names to their resolved
+		# address and falls back to the registrable domain.
+		def resolve(domainname):
+			try:
+				return socket.gethostbyname(domainname)
+			except (OSError, UnicodeError):
+				return None
+		with concurrent.futures.ThreadPoolExecutor(max_workers = threads) as executor:
+			addresses = dict(zip(domainnames, executor.map(resolve, domainnames)))
+		return lambda domainname: addresses.get(domainname) or cls.registrable_domain(domainname)
+
+	@property
+	def concurrency(self):
+		return self._concurrency
+
+	@property
+	def in_flight(self):
+		return self._in_flight
+
+	@property
+	def result_counts(self):
+		return self._result_counts
+
+	@property
+	def done(self):
+		return (self._pending_count == 0) and (self._in_flight == 0)
+
+	@property
+	def queue_depths(self):
+		now = self._clock()
+		ready_keys = sum(1 for (ready_time, seq, key) in self._key_heap if ready_time <= now)
+		return self._QueueDepths(pending = self._pending_count, keys = len(self._key_heap), ready_keys = ready_keys, in_flight = self._in_flight, concurrency = self._concurrency)
+
+	def time_until_ready(self):
+		# Seconds until next_ready() can return a domain name, None if that
+		# depends on results coming in first.
+		if (len(self._key_heap) == 0) or (self._in_flight >= self._concurrency):
+			return None
+		return max(0, self._key_heap[0][0] - self._clock())
+
+	def next_ready(self):
+		if (len(self._key_heap) == 0) or (self._in_flight >= self._concurrency):
+			return None
+		now = self._clock()
+		(ready_time, seq, key) = self._key_heap[0]
+		if ready_time > now:
+			return None
+		heapq.heappop(self._key_heap)
+		pending = self._pending_by_key[key]
+		domainname = pending.popleft()
+		self._pending_count -= 1
+		if len(pending) > 0:
+			heapq.heappush(self._key_heap, (now + self._min_spacing, self._seq, key))
+			self._seq += 1
+		else:
+			del self._pending_by_key[key]
+		self._in_flight += 1
+		self._in_flight_since[domainname].append(now)
+		if self._lost_timeout is not None:
+			self._dispatched.append((now, domainname))
+		return domainname
+
+	def _release(self, domainname):
+		dispatch_times = self._in_flight_since[domainname]
+		dispatch_times.popleft()
+		if len(dispatch_times) == 0:
+			del self._in_flight_since[domainname]
+		self._in_flight -= 1
+
+	def report(self, domainname, resultcode, latency):
+		if domainname not in self._in_flight_since:
+			# Late result of a domain name that was given up on already
+			return
+		self._release(domainname)
+		self._result_counts[resultcode] += 1
+		self._recent_results.append((resultcode, latency))
+		if len(self._recent_results) >= self._adjust_interval:
+			self._adjust()
+
+	def expire_lost(self):
+		# Gives up on domain names that have been in flight for longer than
+		# lost_timeout, they count as failures. Returns their names.
+		lost = [ ]
+		if self._lost_timeout is None:
+			return lost
+		deadline = self._clock() - self._lost_timeout
+		while (len(self._dispatched) > 0) and (self._dispatched[0][0] <= deadline):
+			(dispatch_time, domainname) = self._dispatched.popleft()
+			dispatch_times = self._in_flight_since.get(domainname)
+			if (dispatch_times is None) or (dispatch_times[0] != dispatch_time):
+				# Reported in time
+				continue
+			self._release(domainname)
+			self._result_counts["lost"] += 1
+			self._recent_results.append(("lost", None))
+			lost.append(domainname)
+		if len(self._recent_results) >= self._adjust_interval:
+			self._adjust()
+		return lost
+
+	def _adjust(self):
+		failures = sum(1 for (resultcode, latency) in self._recent_results if resultcode in [ "timeout", "error", "lost" ])
+		failure_ratio = failures / len(self._recent_results)
+		latencies = sorted(latency for (resultcode, latency) in self._recent_results if resultcode == "ok")
+		median_latency = latencies[len(latencies) // 2] if (len(latencies) > 0) else None
+		self._recent_results = [ ]
+
+		if self._baseline_failure_ratio is None:
+			max_failure_ratio = self._max_failure_ratio
+			self._baseline_failure_ratio = failure_ratio
+		else:
+			max_failure_ratio = max(self._max_failure_ratio, 1.5 * self._baseline_failure_ratio)
+			self._baseline_failure_ratio = (0.9 * self._baseline_failure_ratio) + (0.1 * failure_ratio)
+		overloaded = failure_ratio > max_failure_ratio
+		if (self._max_latency is not None) and (median_latency is not None) and (median_latency > self._max_latency):
+			overloaded = True
+		if overloaded:
+			self._concurrency = max(self._min_concurrency, int(self._concurrency * 0.75))
+		else:
+			self._concurrency = min(self._max_concurrency, self._concurrency + max(1, self._max_concurrency // 50))
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2018-2020 Johannes Bauer
+#   License: CC-0
+
+class ShardLayout():
+	# Certificates are distributed over the shards by the leading hex
+	# digits of their SHA256 hash: 16 shards use one digit, 256 shards (the
+	# original layout) two, 4096 shards three and so on. The shard file is
+	# named after that prefix, so every shard holds a contiguous range of the
+	# hash space and layouts of different sizes never share a filename.
+	SHARD_COUNTS = (16, 256, 4096, 65536)
+	DEFAULT_SHARD_COUNT = 256
+
+	def __init__(self, shard_count = DEFAULT_SHARD_COUNT):
+		if shard_count not in self.SHARD_COUNTS:
+			raise ValueError("Unsupported shard count %d, must be one of %s." % (shard_count, ", ".join(str(count) for count in self.SHARD_COUNTS)))
+		self._shard_count = shard_count
+		self._digits = self.SHARD_COUNTS.index(shard_count) + 1
+		self._shift = 16 - (4 * self._digits)
+
+	@property
+	def shard_count(self):
+		return self._shard_count
+
+	def shard_of(self, cert_hash):
+		return int.from_bytes(cert_hash[: 2], byteorder = "big") >> self._shift
+
+	def shard_name(self, shard):
+		return "%0*x" % (self._digits, shard)
+
+	def shard_filenames(self, cert_storage_dir):
+		return [ "%s/%s.sqlite3" % (cert_storage_dir, self.shard_name(shard)) for shard in range(self._shard_count) ]
+
+	def hash_range(self, shard):
+		# (min_hash, max_hash) of the shard with min_hash <= cert_sha256 <
+		# max_hash, None meaning unbounded
+		min_hash = None if (shard == 0) else (shard << self._shift).to_bytes(2, byteorder = "big")
+		max_hash = None if (shard == self._shard_count - 1) else ((shard + 1) << self._shift).to_bytes(2, byteorder = "big")
+		return (min_hash, max_hash)
+
+	def __eq__(self, other):
+		return isinstance(other, ShardLayout) and (self.shard_count == other.shard_count)
+
+	def __repr__(self):
+		return "ShardLayout(%d)" % (self._shard_count)
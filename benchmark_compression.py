@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+from CertDatabase import CertDatabase
+from CorpusGenerator import CorpusGenerator
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Benchmark the size reduction and scan throughput of compressed certificate storage. Either builds a synthetic corpus or works on a copy of an existing certificate database.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, help = "Copy this certificate database and benchmark on the copy instead of on a synthetic corpus. Note that synthetic certificates contain random keys and signatures and therefore compress worse than real ones.")
+parser.add_argument("-n", "--servernames", metavar = "count", type = int, default = 20000, help = "Number of synthetic servers when no certificate database is given. Defaults to %(default)d.")
+parser.add_argument("-s", "--seed", metavar = "seed", type = int, default = 0, help = "Random seed for the synthetic corpus. Defaults to %(default)d.")
+parser.add_argument("-p", "--parallel", metavar = "processes", type = int, help = "Number of processes for conversion and parallel scans. Defaults to the number of CPUs.")
+args = parser.parse_args(sys.argv[1:])
+
+def directory_size(path):
+	return sum(os.stat(path + "/" + filename).st_size for filename in os.listdir(path) if filename.endswith(".sqlite3") and filename not in [ "toc.sqlite3", "index.sqlite3" ])
+
+def cert_length(cert_sha256, der_cert):
+	return len(der_cert)
+
+def measure_scans(name, certdb_dir, blob_size):
+	certdb = CertDatabase(certdb_dir)
+	t0 = time.time()
+	cert_count = sum(1 for der_cert in certdb.get_all_certificates())
+	t_serial = time.time() - t0
+	scanner = certdb.scanner(processes = args.parallel)
+	scanner.reduce(cert_length, lambda a, b: a + b, 0)
+	certdb.close()
+	print("%-22s %12d bytes blobs %12d bytes files   serial scan %8.0f certs/sec   parallel scan %8.0f certs/sec" % (name, blob_size, directory_size(certdb_dir), cert_count / t_serial, scanner.throughput))
+
+def recode(certdb_dir, **kwargs):
+	certdb = CertDatabase(certdb_dir)
+	t0 = time.time()
+	(size_before, size_after) = (0, 0)
+	for (dbid, shard_size_before, shard_size_after) in certdb.recode_storage(processes = args.parallel, **kwargs):
+		size_before += shard_size_before
+		size_after += shard_size_after
+	certdb.close()
+	return (size_before, size_after, time.time() - t0)
+
+tmpdir = tempfile.mkdtemp(prefix = "benchmark_compression_")
+try:
+	certdb_dir = tmpdir + "/certs"
+	if args.certdb is not None:
+		shutil.copytree(args.certdb, certdb_dir)
+	else:
+		os.makedirs(certdb_dir)
+		certdb = CertDatabase(certdb_dir)
+		certdb.bulk_ingest(CorpusGenerator(seed = args.seed, servername_count = args.servernames).connections())
+		certdb.close()
+
+	(raw_size, raw_size, t) = recode(certdb_dir, compress = False)
+	measure_scans("raw DER", certdb_dir, raw_size)
+	(size_before, size_after, t) = recode(certdb_dir, compress = True, dictionary_size = 0)
+	print("Conversion to deflate took %.1f secs." % (t))
+	measure_scans("deflate", certdb_dir, size_after)
+	(size_before, size_after, t) = recode(certdb_dir, compress = True)
+	print("Conversion to deflate with dictionary took %.1f secs." % (t))
+	measure_scans("deflate + dictionary", certdb_dir, size_after)
+finally:
+	shutil.rmtree(tmpdir)
@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import time
+import random
+import shutil
+import tempfile
+import collections
+from CertDatabase import CertDatabase
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Benchmark ingesting connections into a certificate database via insert_connection() and bulk_ingest().")
+parser.add_argument("-n", "--connections", metavar = "count", type = int, default = 20000, help = "Number of synthetic connections to ingest. Defaults to %(default)d.")
+parser.add_argument("-i", "--intermediates", metavar = "count", type = int, default = 500, help = "Number of distinct intermediate certificates that are shared between connections. Defaults to %(default)d.")
+parser.add_argument("-s", "--seed", metavar = "seed", type = int, default = 0, help = "Random seed for the synthetic data. Defaults to %(default)d.")
+parser.add_argument("-r", "--repeat", metavar = "count", type = int, default = 2, help = "Ingest the same data this many times to measure the cost of known certificates. Defaults to %(default)d.")
+args = parser.parse_args(sys.argv[1:])
+
+Connection = collections.namedtuple("Connection", [ "servername", "fetch_timestamp", "certs", "leaf_only" ])
+
+def generate_connections(seed):
+	# Random blobs of realistic size; ingestion never parses certificates
+	rng = random.Random(seed)
+	intermediates = [ rng.randbytes(rng.randint(1000, 1800)) for i in range(args.intermediates) ]
+	for i in range(args.connections):
+		leaf = rng.randbytes(rng.randint(1200, 2200))
+		chain = [ leaf ] + rng.sample(intermediates, rng.randint(1, 2))
+		yield Connection(servername = "host%d.example.com" % (i), fetch_timestamp = 1500000000 + i, certs = chain, leaf_only = False)
+
+def run_insert_connection(certdb, connections):
+	for connection in connections:
+		certdb.insert_connection(connection.servername, connection.fetch_timestamp, connection.certs, leaf_only = connection.leaf_only)
+
+def run_bulk_ingest(certdb, connections):
+	certdb.bulk_ingest(connections)
+
+def benchmark(name, function, pragmas, connections):
+	tmpdir = tempfile.mkdtemp(prefix = "benchmark_ingest_")
+	try:
+		certdb = CertDatabase(tmpdir, pragmas = pragmas)
+		for iteration in range(args.repeat):
+			t0 = time.time()
+			function(certdb, connections)
+			certdb.commit()
+			t = time.time() - t0
+			print("%-40s pass %d: %6.2f secs, %8.0f connections/sec" % (name, iteration + 1, t, args.connections / t))
+		certdb.close()
+	finally:
+		shutil.rmtree(tmpdir)
+
+connections = list(generate_connections(args.seed))
+benchmark("insert_connection()", run_insert_connection, None, connections)
+benchmark("bulk_ingest()", run_bulk_ingest, None, connections)
+benchmark("bulk_ingest() with BULK_WRITE_PRAGMAS", run_bulk_ingest, CertDatabase.BULK_WRITE_PRAGMAS, connections)
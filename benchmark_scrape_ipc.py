@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import time
+import pickle
+import random
+import shutil
+import tempfile
+from CertDatabase import CertDatabase
+from CertDeduplicator import CertDeduplicator
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Benchmark the scrape result path: bytes per result sent from the workers to the database writer and writer throughput, with and without deduplication in the workers.")
+parser.add_argument("-n", "--results", metavar = "count", type = int, default = 20000, help = "Number of synthetic scrape results. Defaults to %(default)d.")
+parser.add_argument("-i", "--intermediates", metavar = "count", type = int, default = 500, help = "Number of distinct intermediate certificates, all of which are already stored. Defaults to %(default)d.")
+parser.add_argument("-k", "--known-leaf-ratio", metavar = "ratio", type = float, default = 0.8, help = "Ratio of results whose leaf certificate is already stored (rescrapes). Defaults to %(default).2f.")
+parser.add_argument("-s", "--seed", metavar = "seed", type = int, default = 0, help = "Random seed for the synthetic data. Defaults to %(default)d.")
+args = parser.parse_args(sys.argv[1:])
+
+rng = random.Random(args.seed)
+intermediates = [ rng.randbytes(rng.randint(1000, 1800)) for i in range(args.intermediates) ]
+known_leaves = [ rng.randbytes(rng.randint(1200, 2200)) for i in range(args.results // 4) ]
+results = [ ]
+for i in range(args.results):
+	if rng.random() < args.known_leaf_ratio:
+		leaf = rng.choice(known_leaves)
+	else:
+		leaf = rng.randbytes(rng.randint(1200, 2200))
+	results.append(("host%d.example.com" % (i), ("ok", [ leaf ] + rng.sample(intermediates, rng.randint(1, 2)))))
+
+def prepare_certdb(tmpdir):
+	certdb = CertDatabase(tmpdir)
+	for (cert_no, der_cert) in enumerate(intermediates + known_leaves):
+		certdb.insert_connection("known%d.example.com" % (cert_no), 1, [ der_cert ])
+	certdb.commit()
+	return certdb
+
+def benchmark(name, dedupe):
+	tmpdir = tempfile.mkdtemp(prefix = "benchmark_scrape_ipc_")
+	try:
+		certdb = prepare_certdb(tmpdir)
+		deduplicator = CertDeduplicator(certdb.get_known_hashes())
+
+		# Worker side: what is pickled into the result queue
+		t0 = time.time()
+		ipc_bytes = 0
+		messages = [ ]
+		for (domainname, (resultcode, der_certs)) in results:
+			payload = (resultcode, deduplicator.dedupe(der_certs)) if dedupe else (resultcode, der_certs)
+			message = pickle.dumps((domainname, payload, 0.0))
+			ipc_bytes += len(message)
+			messages.append(message)
+			if dedupe:
+				deduplicator.mark_shipped(payload[1])
+		t_worker = time.time() - t0
+
+		# Writer side: unpickle and insert
+		t0 = time.time()
+		for (fetch_timestamp, message) in enumerate(messages, 1000):
+			(domainname, (resultcode, certs), latency) = pickle.loads(message)
+			if dedupe:
+				certdb.insert_hashed_connection(domainname, fetch_timestamp, certs)
+			else:
+				certdb.insert_connection(domainname, fetch_timestamp, certs)
+		certdb.commit()
+		t_writer = time.time() - t0
+		certdb.close()
+		print("%-22s %8.0f bytes/result   worker %6.2f secs   writer %6.2f secs (%8.0f results/sec)" % (name, ipc_bytes / len(results), t_worker, t_writer, len(results) / t_writer))
+	finally:
+		shutil.rmtree(tmpdir)
+
+benchmark("full DER chains", dedupe = False)
+benchmark("deduplicated chains", dedupe = True)
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import os
+import re
+import json
+import time
+import random
+import shutil
+import sqlite3
+import platform
+import tempfile
+import functools
+from CertDatabase import CertDatabase
+from CertDecoder import CertDecoder
+from CertRetriever import CertRetriever
+from CertDeduplicator import CertDeduplicator
+from CorpusGenerator import CorpusGenerator
+from PackedCorpus import PackedCorpusWriter, PackedCorpusReader
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Run a reproducible benchmark suite of the hot paths of the certificate database on a synthetic corpus and optionally compare the results against a stored baseline.")
+parser.add_argument("-n", "--servernames", metavar = "count", type = int, default = 2000, help = "Number of synthetic servers in the corpus. Defaults to %(default)d.")
+parser.add_argument("--intermediates", metavar = "count", type = int, default = 100, help = "Number of intermediate CA certificates in the corpus. Defaults to %(default)d.")
+parser.add_argument("--roots", metavar = "count", type = int, default = 10, help = "Number of root CA certificates in the corpus. Defaults to %(default)d.")
+parser.add_argument("--seed", metavar = "seed", type = int, default = 0, help = "Random seed for corpus generation and sampling. Defaults to %(default)d.")
+parser.add_argument("--samples", metavar = "count", type = int, default = 1000, help = "Number of lookups for the point query benchmarks. Defaults to %(default)d.")
+parser.add_argument("-b", "--benchmark", metavar = "name", action = "append", help = "Only run this benchmark (can be given multiple times). Benchmarks that the selected ones depend on are always run.")
+parser.add_argument("-p", "--parallel", metavar = "processes", type = int, help = "Number of processes for the parallel benchmarks. Defaults to the number of CPUs.")
+parser.add_argument("-o", "--output", metavar = "filename", type = str, help = "Write the results to this JSON file. It can later be used as a baseline.")
+parser.add_argument("--baseline", metavar = "filename", type = str, help = "Compare the results against this JSON file of a previous run.")
+parser.add_argument("--tolerance", metavar = "ratio", type = float, default = 0.2, help = "Throughput drop relative to the baseline that is reported as a regression. Defaults to %(default).2f.")
+parser.add_argument("--keep-corpus", metavar = "path", type = str, help = "Build the certificate database in this directory and keep it afterwards instead of using a temporary directory.")
+parser.add_argument("-l", "--list", action = "store_true", help = "List all benchmarks and exit.")
+args = parser.parse_args(sys.argv[1:])
+
+class BenchmarkSuite():
+	def __init__(self, args):
+		self._args = args
+		self._rng = random.Random(args.seed)
+		self._results = { }
+		self._connections = None
+		self._certdb = None
+		self._packed_filename = None
+
+	@property
+	def results(self):
+		return self._results
+
+	def _measure(self, name, function):
+		# The function returns the number of operations it performed
+		t0 = time.perf_counter()
+		operations = function()
+		seconds = time.perf_counter() - t0
+		self._results[name] = {
+			"seconds":		seconds,
+			"operations":	operations,
+			"ops_per_sec":	(operations / seconds) if (seconds > 0) else 0,
+		}
+		print("%-32s %8d ops %8.2f secs %12.1f ops/sec" % (name, operations, seconds, self._results[name]["ops_per_sec"]))
+
+	@staticmethod
+	def _match_text(regex, cert_sha256, der_cert):
+		if regex.search(CertDecoder.render_text(der_cert)):
+			return cert_sha256
+
+	def bench_generate(self):
+		generator = CorpusGenerator(seed = self._args.seed, root_count = self._args.roots, intermediate_count = self._args.intermediates, servername_count = self._args.servernames)
+		self._connections = list(generator.connections())
+		return len(self._connections)
+
+	def bench_insert_connection(self):
+		for connection in self._connections:
+			self._certdb.insert_connection(connection.servername, connection.fetch_timestamp, connection.certs, leaf_only = connection.leaf_only)
+		self._certdb.commit()
+		return len(self._connections)
+
+	def bench_bulk_ingest(self):
+		tmpdir = tempfile.mkdtemp(prefix = "benchmark_suite_")
+		try:
+			certdb = CertDatabase(tmpdir)
+			certdb.bulk_ingest(self._connections)
+			certdb.close()
+		finally:
+			shutil.rmtree(tmpdir)
+		return len(self._connections)
+
+	def bench_get_connection(self):
+		conn_ids = [ self._rng.randint(1, self._certdb.connection_count) for i in range(self._args.samples) ]
+		for conn_id in conn_ids:
+			assert(self._certdb.get_connection(conn_id) is not None)
+		return len(conn_ids)
+
+	def bench_get_connections_by_servername(self):
+		servernames = [ self._rng.choice(self._connections).servername for i in range(self._args.samples) ]
+		for servername in servernames:
+			assert(len(list(self._certdb.get_connections_by_servername(servername))) > 0)
+		return len(servernames)
+
+	def bench_get_all_certificates(self):
+		return sum(1 for cert in self._certdb.get_all_certificates())
+
+	def bench_check_connections(self):
+		# Pass of check_db.py that looks for missing certificates
+		count = 0
+		for connection in self._certdb.get_all_connections(hashes_only = True):
+			assert(all(cert is not None for cert in connection.certs))
+			count += 1
+		return count
+
+	def bench_check_unused_certificates(self):
+		# Pass of check_db.py that looks for dangling certificates
+		referenced_partitions = self._certdb.get_referenced_hash_partitions()
+		stored_count = 0
+		for (dbid, shard_stored_count, unused_hashes) in self._certdb.find_unused_hashes(referenced_partitions = referenced_partitions, processes = self._args.parallel):
+			assert(len(unused_hashes) == 0)
+			stored_count += shard_stored_count
+		return stored_count
+
+	def bench_check_verify(self):
+		verifier = self._certdb.verifier(integrity_check = "quick", processes = self._args.parallel)
+		report = verifier.run()
+		assert(len(list(verifier.problems)) == 0)
+		return sum(result["cert_count"] for result in report["databases"].values())
+
+	def bench_build_index(self):
+		return self._certdb.build_index(processes = self._args.parallel)
+
+	def bench_find_cert_index(self):
+		# Typical find_cert.py queries answered from the index
+		queries = [
+			{ "subject": "Example Holdings 42" },
+			{ "issuer": "Synthetic Issuing CA 7" },
+			{ "san": "www.host1" },
+			{ "key_size": 4096 },
+			{ "extension_oid": "2.5.29.37" },
+			{ "fulltext": "host12*" },
+			{ "regex": r"Issuing CA 1\d\b" },
+		]
+		match_count = 0
+		for query in queries:
+			match_count += sum(1 for cert_sha256 in self._certdb.index.search(**query))
+		assert(match_count > 0)
+		return len(queries)
+
+	def bench_find_cert_scan(self):
+		# find_cert.py without the index renders every certificate
+		scanner = self._certdb.scanner(processes = self._args.parallel, rowids_per_unit = 1000)
+		regex = re.compile(r"Issuing CA 1\d\b", flags = re.MULTILINE | re.IGNORECASE)
+		matches = list(scanner.scan(functools.partial(self._match_text, regex)))
+		assert(len(matches) > 0)
+		return scanner.scanned_count
+
+	def bench_scrape_parse(self):
+		# What the openssl retriever does with the s_client output
+		retriever = CertRetriever(timeout = 1)
+		outputs = [ CorpusGenerator.s_client_output(self._rng.choice(self._connections)) for i in range(min(self._args.samples, 200)) ]
+		cert_count = 0
+		for output in outputs:
+			cert_count += len(retriever._parse_certs(output))
+		return cert_count
+
+	def bench_scrape_dedupe(self):
+		deduplicator = CertDeduplicator(self._certdb.get_known_hashes())
+		cert_count = 0
+		for connection in self._connections:
+			deduplicator.dedupe(connection.certs)
+			cert_count += len(connection.certs)
+		return cert_count
+
+	def bench_export_packed(self):
+		(cert_count, connection_count) = PackedCorpusWriter(self._certdb).write(self._packed_filename)
+		return cert_count
+
+	def bench_packed_get_certificate(self):
+		cert_hashes = [ cert_hash for (cert_hash, der_cert) in self._certdb.get_all_sorted_certificates() ]
+		cert_hashes = [ self._rng.choice(cert_hashes) for i in range(self._args.samples) ]
+		with PackedCorpusReader(self._packed_filename) as reader:
+			for cert_hash in cert_hashes:
+				der_cert = reader.get_certificate(cert_hash)
+				assert(der_cert is not None)
+				der_cert.release()
+		return len(cert_hashes)
+
+	def bench_packed_get_connection(self):
+		conn_ids = [ self._rng.randint(1, self._certdb.connection_count) for i in range(self._args.samples) ]
+		with PackedCorpusReader(self._packed_filename) as reader:
+			for conn_id in conn_ids:
+				assert(reader.get_connection(conn_id) is not None)
+		return len(conn_ids)
+
+	# Name, function and the benchmarks that need to run before
+	BENCHMARKS = (
+		("generate", bench_generate, ( )),
+		("insert_connection", bench_insert_connection, ( "generate", )),
+		("bulk_ingest", bench_bulk_ingest, ( "generate", )),
+		("get_connection", bench_get_connection, ( "insert_connection", )),
+		("get_connections_by_servername", bench_get_connections_by_servername, ( "insert_connection", )),
+		("get_all_certificates", bench_get_all_certificates, ( "insert_connection", )),
+		("check_connections", bench_check_connections, ( "insert_connection", )),
+		("check_unused_certificates", bench_check_unused_certificates, ( "insert_connection", )),
+		("check_verify", bench_check_verify, ( "insert_connection", )),
+		("build_index", bench_build_index, ( "insert_connection", )),
+		("find_cert_index", bench_find_cert_index, ( "build_index", )),
+		("find_cert_scan", bench_find_cert_scan, ( "insert_connection", )),
+		("scrape_parse", bench_scrape_parse, ( "generate", )),
+		("scrape_dedupe", bench_scrape_dedupe, ( "insert_connection", )),
+		("export_packed", bench_export_packed, ( "insert_connection", )),
+		("packed_get_certificate", bench_packed_get_certificate, ( "export_packed", )),
+		("packed_get_connection", bench_packed_get_connection, ( "export_packed", )),
+	)
+
+	def _selected(self, names):
+		dependencies = { name: requires for (name, function, requires) in self.BENCHMARKS }
+		selected = set()
+		pending = list(names)
+		while len(pending) > 0:
+			name = pending.pop()
+			if name not in dependencies:
+				raise KeyError("No such benchmark: %s" % (name))
+			if name not in selected:
+				selected.add(name)
+				pending += dependencies[name]
+		return selected
+
+	def run(self, names = None):
+		selected = self._selected(names) if (names is not None) else None
+		if self._args.keep_corpus is not None:
+			corpus_dir = self._args.keep_corpus
+			os.makedirs(corpus_dir, exist_ok = True)
+		else:
+			corpus_dir = tempfile.mkdtemp(prefix = "benchmark_suite_")
+		self._packed_filename = corpus_dir + "/corpus.x509pack"
+		try:
+			self._certdb = CertDatabase(corpus_dir)
+			for (name, function, requires) in self.BENCHMARKS:
+				if (selected is None) or (name in selected):
+					self._measure(name, functools.partial(function, self))
+			self._certdb.close()
+		finally:
+			if self._args.keep_corpus is None:
+				shutil.rmtree(corpus_dir)
+
+def environment():
+	return {
+		"python":		platform.python_version(),
+		"sqlite":		sqlite3.sqlite_version,
+		"platform":		platform.platform(),
+		"cpu_count":	os.cpu_count(),
+	}
+
+def compare(results, baseline, tolerance):
+	# Returns the names of all benchmarks that regressed
+	regressions = [ ]
+	print()
+	print("%-32s %14s %14s %8s" % ("Benchmark", "Baseline ops/s", "Current ops/s", "Change"))
+	for (name, result) in results["benchmarks"].items():
+		baseline_result = baseline["benchmarks"].get(name)
+		if (baseline_result is None) or (baseline_result["ops_per_sec"] == 0):
+			print("%-32s %14s %14.1f" % (name, "-", result["ops_per_sec"]))
+			continue
+		ratio = result["ops_per_sec"] / baseline_result["ops_per_sec"]
+		regressed = ratio < (1 - tolerance)
+		print("%-32s %14.1f %14.1f %+7.1f%%%s" % (name, baseline_result["ops_per_sec"], result["ops_per_sec"], (ratio - 1) * 100, "  REGRESSION" if regressed else ""))
+		if regressed:
+			regressions.append(name)
+	return regressions
+
+if args.list:
+	for (name, function, requires) in BenchmarkSuite.BENCHMARKS:
+		print(name)
+	sys.exit(0)
+
+parameters = { "servernames": args.servernames, "intermediates": args.intermediates, "roots": args.roots, "seed": args.seed, "samples": args.samples, "parallel": args.parallel }
+suite = BenchmarkSuite(args)
+try:
+	suite.run(args.benchmark)
+except KeyError as e:
+	parser.error(e.args[0])
+results = { "parameters": parameters, "environment": environment(), "timestamp": round(time.time()), "benchmarks": suite.results }
+
+if args.output is not None:
+	with open(args.output, "w") as f:
+		json.dump(results, f, indent = 4, sort_keys = True)
+		f.write("\n")
+
+if args.baseline is not None:
+	with open(args.baseline) as f:
+		baseline = json.load(f)
+	if baseline["parameters"] != parameters:
+		print("Warning: baseline was recorded with different parameters: %s" % (baseline["parameters"]))
+	regressions = compare(results, baseline, args.tolerance)
+	if len(regressions) > 0:
+		print("%d benchmarks regressed by more than %.0f%%: %s" % (len(regressions), args.tolerance * 100, ", ".join(regressions)))
+		sys.exit(1)
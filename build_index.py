@@ -0,0 +1,25 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import time
+from CertDatabase import CertDatabase
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Build or complete the certificate field index (index.sqlite3) from all certificates in storage.")
+parser.add_argument("-p", "--parallel", metavar = "processes", type = int, help = "Number of concurrent processes that decode certificates. Defaults to the number of CPUs.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+args = parser.parse_args(sys.argv[1:])
+
+def show_progress(dbid, indexed_count):
+	t = time.time() - t0
+	print("Shard %s done: %d certificates indexed in %.0f secs (%.0f certs/sec)" % (certdb.layout.shard_name(dbid), indexed_count, t, indexed_count / t if (t > 0) else 0))
+
+certdb = CertDatabase(args.certdb, create_index = True)
+print("Indexing %d certificates, %d already present in index." % (certdb.certificate_count, certdb.index.certificate_count))
+t0 = time.time()
+indexed_count = certdb.build_index(processes = args.parallel, progress_callback = show_progress)
+print("Indexed %d new certificates." % (indexed_count))
+certdb.close()
@@ -4,67 +4,50 @@
 #   License: CC-0
 
 import sys
+import os
 import sqlite3
 import contextlib
-import subprocess
+import asyncio
+import concurrent.futures
 import multiprocessing
 import hashlib
 import time
 import collections
 import random
-import re
+import queue
 from CertDatabase import CertDatabase
+from CertRetriever import CertRetriever, AsyncCertRetriever
+from ScrapeScheduler import ScrapeScheduler
+from CertDeduplicator import CertDeduplicator
+from GroupCommitter import GroupCommitter
+from ScrapeMetrics import ScrapeMetrics
 from FriendlyArgumentParser import FriendlyArgumentParser
 
 parser = FriendlyArgumentParser(description = "Scrape certificates from websites.")
 parser.add_argument("-d", "--domainname-dbfile", metavar = "filename", type = str, default = "certs/domainnames.sqlite3", help = "Specifies database file that contains the domain names to scrape. Defaults to %(default)s.")
-parser.add_argument("-g", "--gracetime", metavar = "secs", type = float, default = 1, help = "Gracetime between scrapings of different domains, in seconds. Defaults to %(default).1f seconds.")
+parser.add_argument("-g", "--gracetime", metavar = "secs", type = float, default = 1, help = "Minimum time between two connections to domains that share the same scheduling key, in seconds. Defaults to %(default).1f seconds.")
+parser.add_argument("-k", "--schedule-key", choices = [ "domain", "address", "none" ], default = "domain", help = "Key by which domain names are grouped for the gracetime. 'domain' uses the registrable domain name, 'address' resolves all domain names before scraping and uses the IPv4 address, 'none' puts every domain name in its own group. Defaults to %(default)s.")
+parser.add_argument("--max-failure-ratio", metavar = "ratio", type = float, default = 0.25, help = "Ratio of timeouts and errors above which the number of concurrent connections is reduced. Defaults to %(default).2f.")
+parser.add_argument("--max-latency", metavar = "secs", type = float, help = "Median handshake latency above which the number of concurrent connections is reduced. Defaults to a third of the timeout.")
 parser.add_argument("-p", "--parallel", metavar = "processes", type = int, default = 20, help = "Numer of concurrent processes that scrape. Defaults to %(default)d.")
+parser.add_argument("-r", "--retriever", choices = [ "asyncio", "openssl" ], default = "asyncio", help = "Method used to retrieve certificates. 'asyncio' performs the TLS handshakes in-process with many connections in flight per process, 'openssl' runs one s_client subprocess per connection. Defaults to %(default)s.")
+parser.add_argument("--concurrency", metavar = "connections", type = int, default = 250, help = "Number of concurrent connections per process when using the asyncio retriever. Defaults to %(default)d.")
 parser.add_argument("-t", "--timeout", metavar = "secs", type = int, default = 15, help = "Timeout after which connection is discarded, in seconds. Defaults to %(default)d.")
 parser.add_argument("-a", "--maxage", metavar = "days", type = int, default = 365, help = "Age after which another attempt is retried, in days. Defaults to %(default)d.")
 parser.add_argument("-l", "--limit", metavar = "count", type = int, help = "Quit after this amount of calls.")
 parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("--commit-interval", metavar = "secs", type = float, default = 5, help = "Maximum time that scraped results are held before they are committed to the databases, in seconds. Defaults to %(default).1f seconds.")
+parser.add_argument("--commit-batch-size", metavar = "count", type = int, default = 1000, help = "Maximum number of scraped results that are committed to the databases in one transaction. Defaults to %(default)d.")
+parser.add_argument("--resume", action = "store_true", help = "Continue an interrupted scraping run with exactly the domain names that it did not finish yet, instead of selecting domain names anew.")
+parser.add_argument("--metrics-prometheus", metavar = "filename", type = str, help = "Periodically write pipeline metrics (per-stage latency histograms, result counters, queue depths and commit timings) to this file in Prometheus text format.")
+parser.add_argument("--metrics-json", metavar = "filename", type = str, help = "Periodically write pipeline metrics to this file in JSON format.")
+parser.add_argument("--metrics-interval", metavar = "secs", type = float, default = 10, help = "Interval in which the metrics files are rewritten, in seconds. Defaults to %(default).1f seconds.")
+parser.add_argument("--no-dedupe", action = "store_true", help = "Do not filter out already stored certificates within the scraping processes, but always pass all of them to the database writer.")
 parser.add_argument("--skip-local-db-update", action = "store_true", help = "Do not try to update the domainname database file from the actual certificate content database.")
+parser.add_argument("--full-local-db-update", action = "store_true", help = "Update the domainname database file from all connections in the certificate database, not only from those added since the last update.")
 parser.add_argument("domainname", nargs = "*", help = "When explicit domain names are supplied on the command line, only those are scraped and the max age is disregarded.")
 args = parser.parse_args(sys.argv[1:])
 
-class CertRetriever():
-	_CERT_RE = re.compile("-----BEGIN CERTIFICATE-----[A-Za-z0-9+/=\s]+-----END CERTIFICATE-----", flags = re.MULTILINE)
-
-	def __init__(self, timeout):
-		self._timeout = timeout
-
-	def _parse_certs(self, openssl_output):
-		output_text = openssl_output.decode("utf-8", errors = "replace")
-		certs = [ ]
-		for match in self._CERT_RE.finditer(output_text):
-			cert_text = match.group(0).encode("ascii")
-			der_cert = subprocess.check_output([ "openssl", "x509", "-outform", "der" ], input = cert_text)
-			certs.append(der_cert)
-		return certs
-
-	def retrieve(self, servername, port = 443):
-		cmd = [ "openssl", "s_client", "-showcerts", "-connect", "%s:%d" % (servername, port), "-servername", servername ]
-		proc = subprocess.Popen(cmd, stdin = subprocess.DEVNULL, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
-		try:
-			proc.wait(timeout = self._timeout)
-			if proc.returncode == 0:
-				stdout = proc.stdout.read()
-				try:
-					der_certs = self._parse_certs(stdout)
-					return ("ok", der_certs)
-				except subprocess.CalledProcessError:
-					# Did not contain certificate?
-					return ("nocert", None)
-			else:
-				# Failed with error
-				return ("error", None)
-		except subprocess.TimeoutExpired:
-			# Process unresponsive
-			proc.kill()
-			return ("timeout", None)
-
-
 class Scraper():
 	def __init__(self, args):
 		self._args = args
@@ -79,72 +62,243 @@ class Scraper():
 				last_result NULL
 			);
 			""")
+		with contextlib.suppress(sqlite3.OperationalError):
+			# Domain names of the current run that have not been written yet.
+			# Entries are removed in the same transaction that records their
+			# result, so an interrupted run can be resumed exactly.
+			self._cursor.execute("""
+			CREATE TABLE scrape_journal (
+				domainname varchar PRIMARY KEY,
+				run_timet integer NOT NULL
+			);
+			""")
 		self._domainnames = [ ]
 		self._total_domain_count = 0
-		self._cert_retriever = CertRetriever(self._args.timeout)
+		self._leaf_only = False
+		if self._args.retriever == "asyncio":
+			self._cert_retriever = AsyncCertRetriever(self._args.timeout)
+			self._leaf_only = self._cert_retriever.leaf_only
+		else:
+			self._cert_retriever = CertRetriever(self._args.timeout)
 		self._certdb = CertDatabase(self._args.certdb)
 		if not self._args.skip_local_db_update:
 			self._update_local_database()
 
 	def _update_local_database(self):
-		most_recent_connections = self._certdb.get_most_recent_connections()
-		connection_count = len(most_recent_connections)
-		print("Updating local index from %d recent connections within certificate database..." % (connection_count))
-		for (entry_no, (servername, fetch_timestamp)) in enumerate(most_recent_connections):
-			if (entry_no % 20000) == 0:
-				print("Updating %d/%d (%.1f%%)" % (entry_no, connection_count, entry_no / connection_count * 100))
-
-			row = self._db.execute("SELECT last_attempted_timet FROM domainnames WHERE domainname = ?;", (servername, )).fetchone()
-			if row is None:
-				# Servername not yet known in domainnames.sqlite3, insert it.
-				self._db.execute("INSERT INTO domainnames (domainname, last_successful_timet, last_attempted_timet, last_result) VALUES (?, ?, ?, 'ok');", (servername, fetch_timestamp, fetch_timestamp))
-			else:
-				last_timestamp_domainnames = row[0]
-				if last_timestamp_domainnames < fetch_timestamp:
-					# We have a newer one in the actual dataset, update metadata database
-					self._db.execute("UPDATE domainnames SET last_successful_timet = ?, last_attempted_timet = ?, last_result = 'ok' WHERE domainname = ?;", (fetch_timestamp, fetch_timestamp, servername))
+		# Upserts the most recent connection of every servername that was
+		# added to the TOC since the last synchronization in one statement.
+		# Connection IDs are reused after the highest one was removed, so the
+		# watermark also records how many connections were at or below it and
+		# which connection it was; if either changed, all connections are
+		# synchronized again.
+		with contextlib.suppress(sqlite3.OperationalError):
+			self._cursor.execute("""
+			CREATE TABLE toc_sync (
+				toc_filename varchar PRIMARY KEY,
+				max_conn_id integer NOT NULL
+			);
+			""")
+		for column in [ "connection_count integer", "last_fetch_timestamp integer", "last_servername varchar" ]:
+			with contextlib.suppress(sqlite3.OperationalError):
+				self._cursor.execute("ALTER TABLE toc_sync ADD COLUMN %s;" % (column))
+		toc_filename = os.path.realpath(self._certdb.toc_filename)
+		row = self._cursor.execute("SELECT max_conn_id, connection_count, last_fetch_timestamp, last_servername FROM toc_sync WHERE toc_filename = ?;", (toc_filename, )).fetchone()
+
 		self._db.commit()
+		self._cursor.execute("ATTACH DATABASE ? AS toc;", (toc_filename, ))
+		try:
+			(watermark, synced_count) = (0, 0)
+			if (row is not None) and (not self._args.full_local_db_update):
+				current = self._cursor.execute("SELECT COUNT(*), (SELECT fetch_timestamp FROM toc.connections WHERE conn_id = ?1), (SELECT servername FROM toc.connections WHERE conn_id = ?1) FROM toc.connections WHERE conn_id <= ?1;", (row[0], )).fetchone()
+				if tuple(current) == tuple(row[1:]):
+					(watermark, synced_count) = (row[0], row[1])
+				else:
+					print("Connections were removed from the certificate database since the last synchronization, updating local index from all connections.")
+
+			(max_conn_id, connection_count) = self._cursor.execute("SELECT MAX(conn_id), COUNT(*) FROM toc.connections WHERE conn_id > ?;", (watermark, )).fetchone()
+			if connection_count == 0:
+				print("Local index is up to date with certificate database.")
+			else:
+				print("Updating local index from %d new connections within certificate database..." % (connection_count))
+				self._cursor.execute("""
+				INSERT INTO domainnames (domainname, last_successful_timet, last_attempted_timet, last_result)
+					SELECT servername, MAX(fetch_timestamp), MAX(fetch_timestamp), 'ok' FROM toc.connections WHERE conn_id > ? GROUP BY servername
+				ON CONFLICT (domainname) DO UPDATE SET last_successful_timet = excluded.last_successful_timet, last_attempted_timet = excluded.last_attempted_timet, last_result = 'ok'
+					WHERE domainnames.last_attempted_timet < excluded.last_attempted_timet;
+				""", (watermark, ))
+				(watermark, synced_count) = (max_conn_id, synced_count + connection_count)
+			(last_fetch_timestamp, last_servername) = self._cursor.execute("SELECT fetch_timestamp, servername FROM toc.connections WHERE conn_id = ?;", (watermark, )).fetchone() or (None, None)
+			self._cursor.execute("INSERT OR REPLACE INTO toc_sync (toc_filename, max_conn_id, connection_count, last_fetch_timestamp, last_servername) VALUES (?, ?, ?, ?, ?);", (toc_filename, watermark, synced_count, last_fetch_timestamp, last_servername))
+			self._db.commit()
+		finally:
+			self._cursor.execute("DETACH DATABASE toc;")
+
+	def _dedupe_result(self, scraped_cert):
+		(resultcode, der_certs) = scraped_cert
+		if der_certs is None:
+			return (resultcode, None)
+		return (resultcode, self._deduplicator.dedupe(der_certs))
+
+	def _make_result(self, domainname, scraped_cert, latency, timings):
+		# The current time is sent along so that the writer can determine how
+		# long the result has been queued.
+		t0 = time.perf_counter()
+		deduped_cert = self._dedupe_result(scraped_cert)
+		timings["dedupe"] = time.perf_counter() - t0
+		timings["retrieve"] = latency
+		return (domainname, deduped_cert, latency, timings, time.time())
+
+	async def _async_scrape(self, next_job, result_queue, semaphore):
+		try:
+			(domainname, queued_timet) = next_job
+			timings = { "work_queue": time.time() - queued_timet }
+			t0 = time.perf_counter()
+			scraped_cert = await self._cert_retriever.retrieve(domainname, timings = timings)
+			result = self._make_result(domainname, scraped_cert, time.perf_counter() - t0, timings)
+			await asyncio.get_running_loop().run_in_executor(None, result_queue.put, result)
+			if result[1][1] is not None:
+				self._deduplicator.mark_shipped(result[1][1])
+		finally:
+			semaphore.release()
+
+	async def _async_work(self, work_queue, result_queue):
+		loop = asyncio.get_running_loop()
+		# Name resolution runs in the default executor, size it for the
+		# number of concurrent connections.
+		loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers = min(self._args.concurrency, 256)))
+		semaphore = asyncio.Semaphore(self._args.concurrency)
+		pending = set()
+		while True:
+			await semaphore.acquire()
+			next_job = await loop.run_in_executor(None, work_queue.get)
+			if next_job is None:
+				break
+			task = asyncio.create_task(self._async_scrape(next_job, result_queue, semaphore))
+			pending.add(task)
+			task.add_done_callback(pending.discard)
+		if len(pending) > 0:
+			await asyncio.wait(pending)
 
 	def _worker(self, work_queue, result_queue):
+		if isinstance(self._cert_retriever, AsyncCertRetriever):
+			asyncio.run(self._async_work(work_queue, result_queue))
+			return
+
 		while True:
 			next_job = work_queue.get()
 			if next_job is None:
 				break
 
-			domainname = next_job
-			scraped_cert = self._cert_retriever.retrieve(domainname)
-			result = (next_job, scraped_cert)
+			(domainname, queued_timet) = next_job
+			timings = { "work_queue": time.time() - queued_timet }
+			t0 = time.perf_counter()
+			scraped_cert = self._cert_retriever.retrieve(domainname, timings = timings)
+			result = self._make_result(domainname, scraped_cert, time.perf_counter() - t0, timings)
 			result_queue.put(result)
+			if result[1][1] is not None:
+				self._deduplicator.mark_shipped(result[1][1])
+
+	def _create_scheduler(self, domainnames):
+		if self._args.retriever == "asyncio":
+			max_concurrency = self._args.parallel * self._args.concurrency
+		else:
+			max_concurrency = self._args.parallel
+		if self._args.schedule_key == "address":
+			print("Resolving %d domainnames for scheduling..." % (len(domainnames)))
+			key_function = ScrapeScheduler.resolve_keys(domainnames)
+		elif self._args.schedule_key == "none":
+			key_function = lambda domainname: domainname
+		else:
+			key_function = None
+		max_latency = self._args.max_latency if (self._args.max_latency is not None) else (self._args.timeout / 3)
+		# Results normally arrive within the timeout; one that is missing far
+		# longer than that (e.g., because a worker died) is not waited for
+		# forever. The domain name stays in the journal.
+		lost_timeout = 10 * self._args.timeout
+		return ScrapeScheduler(domainnames, min_spacing = self._args.gracetime, initial_concurrency = self._args.parallel, max_concurrency = max_concurrency,
+				key_function = key_function, max_failure_ratio = self._args.max_failure_ratio, max_latency = max_latency, lost_timeout = lost_timeout)
 
-	def _feeder(self, work_queue, result_queue):
-		class BreakFreeException(Exception): pass
+	def _feeder(self, work_queue, result_queue, feedback_queue):
+		scheduler = self._create_scheduler(self._domainnames)
+		last_status = time.time()
+		while not scheduler.done:
+			domainname = scheduler.next_ready()
+			if domainname is not None:
+				work_queue.put((domainname, time.time()))
+				continue
 
-		fed_items = 0
-		try:
-			random.shuffle(self._domainnames)
-			for domainname in self._domainnames:
-				fed_items += 1
-				work_queue.put(domainname)
-				if (self._args.limit is not None) and (fed_items >= self._args.limit):
-					raise BreakFreeException()
-		except BreakFreeException:
-			pass
+			# Nothing can be started right now, wait for results to come in or
+			# for the next group's gracetime to pass.
+			wait_time = scheduler.time_until_ready()
+			try:
+				feedback = feedback_queue.get(timeout = 1 if (wait_time is None) else min(wait_time, 1))
+				scheduler.report(*feedback)
+				while True:
+					scheduler.report(*feedback_queue.get_nowait())
+			except queue.Empty:
+				pass
+			for lost_domainname in scheduler.expire_lost():
+				print("No result for %s in time, giving up on it; it stays in the journal for --resume." % (lost_domainname))
+
+			if time.time() - last_status >= 10:
+				last_status = time.time()
+				depths = scheduler.queue_depths
+				print("Scheduler: %d pending in %d groups (%d ready), %d in flight, concurrency %d, work queue %d, result queue %d" % (depths.pending, depths.keys, depths.ready_keys, depths.in_flight, depths.concurrency, work_queue.qsize(), result_queue.qsize()))
 
 		# Finally kill all workers
 		for i in range(self._args.parallel):
 			work_queue.put(None)
 
-	def _eater(self, work_queue, result_queue):
+	def _commit(self):
+		# Certificates are committed first, then connections, domain names and
+		# the journal together in one transaction (the domain name database is
+		# attached to the TOC), so the journal never disagrees with the TOC.
+		t0 = time.perf_counter()
+		self._certdb.commit()
+		self._metrics.observe("commit", time.perf_counter() - t0)
+		self._metrics.observe_batch_size(self._committer.pending)
+
+	def _write_metrics(self, work_queue, result_queue):
+		for (name, queue_object) in (("work", work_queue), ("result", result_queue)):
+			with contextlib.suppress(NotImplementedError):
+				self._metrics.set_gauge(name, queue_object.qsize())
+		self._metrics.write(prometheus_filename = self._args.metrics_prometheus, json_filename = self._args.metrics_json)
+
+	def _print_commit_statistics(self, committer):
+		stats = committer.statistics
+		print("Committed %d results in %d transactions, %.1f results per transaction on average (max %d), commit latency %.0f ms on average, %.0f ms p95, %.0f ms max." % (stats.write_count, stats.batch_count, stats.mean_batch_size, stats.max_batch_size, stats.mean_latency * 1000, stats.p95_latency * 1000, stats.max_latency * 1000))
+
+	def _eater(self, work_queue, result_queue, feedback_queue):
 		processed_count = 0
-		new_cert_count = 0
 		count_by_return = collections.Counter()
+		self._metrics = ScrapeMetrics()
+		self._result_cursor = self._certdb.attach_database(os.path.realpath(self._args.domainname_dbfile), "domains")
+		self._committer = committer = GroupCommitter(self._commit, max_batch_size = self._args.commit_batch_size, max_delay = self._args.commit_interval)
+		last_status = time.time()
+		last_metrics = time.time()
 
 		while True:
-			next_result = result_queue.get()
+			timeout = self._args.metrics_interval - (time.time() - last_metrics)
+			if committer.time_until_flush() is not None:
+				timeout = min(timeout, committer.time_until_flush())
+			try:
+				next_result = result_queue.get(timeout = max(0, timeout))
+			except queue.Empty:
+				next_result = False
 			if next_result is None:
 				break
 
-			(domainname, (resultcode, der_certs)) = next_result
+			if time.time() - last_metrics >= self._args.metrics_interval:
+				last_metrics = time.time()
+				self._write_metrics(work_queue, result_queue)
+			if next_result is False:
+				if committer.time_until_flush() == 0:
+					committer.flush()
+				continue
+
+			(domainname, (resultcode, hashed_certs), latency, timings, put_timet) = next_result
+			timings["result_queue"] = time.time() - put_timet
+			feedback_queue.put((domainname, resultcode, latency))
 			processed_count += 1
 			count_by_return[resultcode] += 1
 
@@ -155,31 +309,49 @@ class Scraper():
 					status_str.append("%s %d/%.1f%%" % (text, count, count / processed_count * 100))
 			status_str = "   ".join(status_str)
 			if resultcode == "ok":
-				result_comment = " [%d certs]" % (len(der_certs))
+				result_comment = " [%d certs]" % (len(hashed_certs))
 			else:
 				result_comment = ""
 			line_left = "%d/%d (%.1f%%): %s: %s%s" % (processed_count, self._total_domain_count, processed_count / self._total_domain_count * 100, domainname, resultcode, result_comment)
 			print("%-90s %s" % (line_left, status_str))
 
+			t0 = time.perf_counter()
 			now = round(time.time())
 			if resultcode == "ok":
-				self._cursor.execute("UPDATE domainnames SET last_successful_timet = ?, last_attempted_timet = ?, last_result = ? WHERE domainname = ?;", (now, now, resultcode, domainname))
-				self._certdb.insert_connection(servername = domainname, fetch_timestamp = now, certs = der_certs)
-				new_cert_count += 1
-				if (new_cert_count % 1000) == 0:
-					self._certdb.commit()
+				self._result_cursor.execute("UPDATE domains.domainnames SET last_successful_timet = ?, last_attempted_timet = ?, last_result = ? WHERE domainname = ?;", (now, now, resultcode, domainname))
+				self._certdb.insert_hashed_connection(servername = domainname, fetch_timestamp = now, hashed_certs = hashed_certs, leaf_only = self._leaf_only)
 			else:
-				self._cursor.execute("UPDATE domainnames SET last_attempted_timet = ?, last_result = ? WHERE domainname = ?;", (now, resultcode, domainname))
+				self._result_cursor.execute("UPDATE domains.domainnames SET last_attempted_timet = ?, last_result = ? WHERE domainname = ?;", (now, resultcode, domainname))
+			self._result_cursor.execute("DELETE FROM domains.scrape_journal WHERE domainname = ?;", (domainname, ))
+			timings["db_write"] = time.perf_counter() - t0
+			self._metrics.count_result(resultcode)
+			self._metrics.observe_timings(timings)
+			committer.add()
 
-			if (processed_count % 2500) == 0:
-				self._certdb.commit()
-				self._db.commit()
-		self._certdb.commit()
+			if time.time() - last_status >= 60:
+				last_status = time.time()
+				self._print_commit_statistics(committer)
+		committer.flush()
+		self._write_metrics(work_queue, result_queue)
+		for line in self._metrics.summary():
+			print(line)
+
+	def _resume_domainnames(self):
+		return [ row[0] for row in self._cursor.execute("SELECT domainname FROM scrape_journal;").fetchall() ]
+
+	def _start_journal(self, domainnames):
+		self._cursor.execute("DELETE FROM scrape_journal;")
+		now = round(time.time())
+		self._cursor.executemany("INSERT OR IGNORE INTO scrape_journal (domainname, run_timet) VALUES (?, ?);", ((domainname, now) for domainname in domainnames))
 		self._db.commit()
 
 	def run(self):
 		candidate_count = self._cursor.execute("SELECT COUNT(DISTINCT domainname) FROM domainnames;").fetchone()[0]
-		if len(self._args.domainname) == 0:
+		unfinished_count = self._cursor.execute("SELECT COUNT(*) FROM scrape_journal;").fetchone()[0]
+		if self._args.resume:
+			self._domainnames = self._resume_domainnames()
+			candidate_count = unfinished_count
+		elif len(self._args.domainname) == 0:
 			before_timet = round(time.time() - (86400 * self._args.maxage))
 			self._domainnames = [ row[0] for row in self._cursor.execute("SELECT domainname FROM domainnames WHERE COALESCE(last_attempted_timet, 0) < ?;", (before_timet, )).fetchall() ]
 		else:
@@ -202,9 +374,24 @@ class Scraper():
 				limit_str = " (limited from %d)" % (limited_from)
 			print("Found %d domainnames%s to scrape out of %d candidates." % (self._total_domain_count, limit_str, candidate_count))
 
+		if (not self._args.resume) and (unfinished_count > 0):
+			print("Discarding journal of an interrupted run with %d unfinished domainnames; use --resume to continue it instead." % (unfinished_count))
+		random.shuffle(self._domainnames)
+		self._domainnames = self._domainnames[:self._total_domain_count]
+		if not self._args.resume:
+			self._start_journal(self._domainnames)
+
+		# Workers inherit the known certificate hashes when they are forked
+		if self._args.no_dedupe:
+			self._deduplicator = CertDeduplicator()
+		else:
+			print("Loading hashes of %d known certificates..." % (self._certdb.certificate_count))
+			self._deduplicator = CertDeduplicator(self._certdb.get_known_hashes())
+
 		# Initialize subprocess queues
 		work_queue = multiprocessing.Queue(maxsize = 100)
 		result_queue = multiprocessing.Queue(maxsize = 100)
+		feedback_queue = multiprocessing.Queue()
 
 		# Start worker processes
 		processes = [ multiprocessing.Process(target = self._worker, args = (work_queue, result_queue)) for i in range(self._args.parallel) ]
@@ -212,8 +399,8 @@ class Scraper():
 			process.start()
 
 		# Start feeder and eater process
-		feeder = multiprocessing.Process(target = self._feeder, args = (work_queue, result_queue))
-		eater = multiprocessing.Process(target = self._eater, args = (work_queue, result_queue))
+		feeder = multiprocessing.Process(target = self._feeder, args = (work_queue, result_queue, feedback_queue))
+		eater = multiprocessing.Process(target = self._eater, args = (work_queue, result_queue, feedback_queue))
 		feeder.start()
 		eater.start()
 
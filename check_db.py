@@ -12,6 +12,10 @@ parser.add_argument("-s", "--stats-only", action = "store_true", help = "Only pr
 parser.add_argument("--skip-connection-check", action = "store_true", help = "Do not check if all connections have associated certificate data.")
 parser.add_argument("--skip-unused-certificate-check", action = "store_true", help = "Do not check if there are dangling certificates that are not referenced in the TOC.")
 parser.add_argument("--skip-optimization", action = "store_true", help = "Do not optimize databases as the last step.")
+parser.add_argument("--verify", action = "store_true", help = "Verify that every stored certificate matches its hash and is stored in the correct shard and run SQLite consistency checks on all database files. Does not modify the database.")
+parser.add_argument("--integrity-check", choices = [ "quick", "full", "none" ], default = "quick", help = "SQLite consistency check to run during verification, 'quick' uses PRAGMA quick_check and 'full' PRAGMA integrity_check. Defaults to %(default)s.")
+parser.add_argument("--verify-report", metavar = "filename", type = str, help = "Write the verification report to this JSON file. If the file exists already, databases recorded in it are skipped, i.e., an interrupted verification is resumed.")
+parser.add_argument("-p", "--parallel", metavar = "processes", type = int, help = "Number of concurrent processes that check certificate shards. Defaults to the number of CPUs.")
 parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
 args = parser.parse_args(sys.argv[1:])
 
@@ -21,9 +25,24 @@ print("Analyzing database with %d connections and %d certificates." % (conn_coun
 if args.stats_only:
 	sys.exit(0)
 
+def show_verify_progress(name, result):
+	print("Verified %s: %d certificates in %.1f secs (%.0f certs/sec)" % (name, result["cert_count"], result["time"], result["certs_per_sec"]))
+
+if args.verify:
+	print("Verifying certificate content and database consistency...")
+	verifier = certdb.verifier(report_filename = args.verify_report, integrity_check = args.integrity_check, processes = args.parallel)
+	verifier.run(progress_callback = show_verify_progress)
+	problems = list(verifier.problems)
+	if len(problems) == 0:
+		print("Verification found no problems.")
+	else:
+		for (name, problem, detail) in problems:
+			print("%s: %s: %s" % (name, problem, detail))
+		print("Verification found %d problems." % (len(problems)))
+
 if not args.skip_connection_check:
 	print("Checking for connections with missing certificates...")
-	for (conn_number, connection) in enumerate(certdb.get_all_connections()):
+	for (conn_number, connection) in enumerate(certdb.get_all_connections(hashes_only = True)):
 		if (conn_number % 10000) == 0:
 			print("Connection: %d / %d (%.1f%%)" % (conn_number, conn_count, conn_number / conn_count * 100))
 		if any(cert is None for cert in connection.certs):
@@ -32,11 +51,13 @@ if not args.skip_connection_check:
 
 if not args.skip_unused_certificate_check:
 	print("Checking for unused certificates in database...")
-	referenced_certs = certdb.get_all_referenced_hashes()
-	print("%d certificates are referenced within the TOC." % (len(referenced_certs)))
-	stored_certs = certdb.get_all_stored_hashes()
-	print("%d certificates are in storage." % (len(stored_certs)))
-	unused_hashes = stored_certs - referenced_certs
+	referenced_partitions = certdb.get_referenced_hash_partitions()
+	print("%d certificates are referenced within the TOC." % (sum(len(partition) for partition in referenced_partitions)))
+	(stored_count, unused_hashes) = (0, [ ])
+	for (dbid, shard_stored_count, shard_unused_hashes) in certdb.find_unused_hashes(referenced_partitions = referenced_partitions, processes = args.parallel):
+		stored_count += shard_stored_count
+		unused_hashes += shard_unused_hashes
+	print("%d certificates are in storage." % (stored_count))
 	if len(unused_hashes) == 0:
 		print("All certificates are properly referenced in the TOC.")
 	else:
@@ -45,5 +66,7 @@ if not args.skip_unused_certificate_check:
 			certdb.remove_cert_from_storage(unused_hash)
 
 if not args.skip_optimization:
-	print("Optimizing database...")
-	certdb.optimize()
+	print("Optimizing databases that need it...")
+	for (name, action, size_before, size_after, duration) in certdb.maintenance(processes = args.parallel).run():
+		if action != "skip":
+			print("Optimized %s (%s): %d -> %d bytes in %.1f secs" % (name, action, size_before, size_after, duration))
@@ -0,0 +1,34 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import time
+from CertDatabase import CertDatabase
+from CertCompressor import CertCompressor
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Convert the certificate shards of a certificate database to compressed storage or back to raw DER. Reading is transparent in both cases; certificates inserted later are stored in the shard's current format.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("-d", "--decompress", action = "store_true", help = "Convert all shards back to raw DER storage.")
+parser.add_argument("--sample-size", metavar = "count", type = int, default = 2000, help = "Number of certificates per shard that the compression dictionary is trained on. Defaults to %(default)d.")
+parser.add_argument("--dictionary-size", metavar = "bytes", type = int, default = CertCompressor.MAX_DICTIONARY_SIZE, help = "Maximum size of the compression dictionary per shard, 0 compresses without dictionary. Defaults to %(default)d, which is also the maximum that deflate can use.")
+parser.add_argument("--no-vacuum", action = "store_true", help = "Do not VACUUM the shards afterwards, i.e., do not return the freed space to the file system.")
+parser.add_argument("-p", "--parallel", metavar = "processes", type = int, help = "Number of shards that are converted concurrently. Defaults to the number of CPUs.")
+args = parser.parse_args(sys.argv[1:])
+
+if not (0 <= args.dictionary_size <= CertCompressor.MAX_DICTIONARY_SIZE):
+	parser.error("Dictionary size must be between 0 and %d bytes." % (CertCompressor.MAX_DICTIONARY_SIZE))
+
+certdb = CertDatabase(args.certdb)
+t0 = time.time()
+(total_before, total_after, shard_count) = (0, 0, 0)
+for (dbid, size_before, size_after) in certdb.recode_storage(compress = not args.decompress, sample_size = args.sample_size, dictionary_size = args.dictionary_size, vacuum = not args.no_vacuum, processes = args.parallel):
+	shard_count += 1
+	total_before += size_before
+	total_after += size_after
+	if size_before > 0:
+		print("%d/%d: shard %s from %d to %d bytes (%.1f%%)" % (shard_count, certdb.layout.shard_count, certdb.layout.shard_name(dbid), size_before, size_after, size_after / size_before * 100))
+if total_before > 0:
+	print("Certificate data went from %d to %d bytes (%.1f%%) in %.1f secs." % (total_before, total_after, total_after / total_before * 100, time.time() - t0))
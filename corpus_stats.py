@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import csv
+import json
+import time
+import contextlib
+from CertDatabase import CertDatabase
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Compute distribution statistics of the certificate corpus: key types and sizes, signature algorithms, issuers, validity periods, chain lengths, the leaf-only ratio and the connections per fetch batch. Partial results are kept, so a rerun only processes shards and connections that changed.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("-p", "--parallel", metavar = "processes", type = int, help = "Number of shards that are processed concurrently. Defaults to the number of CPUs.")
+parser.add_argument("-f", "--format", choices = [ "json", "csv" ], default = "json", help = "Report format. Can be one of %(choices)s, defaults to %(default)s.")
+parser.add_argument("-t", "--top", metavar = "count", type = int, help = "Only report the most common values of distributions that are ordered by count, like issuers.")
+parser.add_argument("--force", action = "store_true", help = "Discard all partial results and process everything.")
+parser.add_argument("--state", metavar = "filename", type = str, help = "JSON file that keeps the partial results. Defaults to statistics.json inside the certificate database directory.")
+parser.add_argument("-v", "--verbose", action = "store_true", help = "Show every shard and range of connections that is processed.")
+parser.add_argument("outfile", nargs = "?", help = "Write the report to this file instead of stdout.")
+args = parser.parse_args(sys.argv[1:])
+
+def progress(name, mapped, duration):
+	if args.verbose:
+		print("%s %s in %.1f secs" % (name, "processed" if mapped else "unchanged", duration), file = sys.stderr)
+
+certdb = CertDatabase(args.certdb)
+statistics = certdb.statistics(state_filename = args.state, force = args.force, processes = args.parallel)
+t0 = time.time()
+mapped_count = statistics.update(progress_callback = progress)
+print("Processed %d partitions in %.1f secs." % (mapped_count, time.time() - t0), file = sys.stderr)
+report = statistics.report(top = args.top)
+
+with contextlib.ExitStack() as stack:
+	f = sys.stdout if (args.outfile is None) else stack.enter_context(open(args.outfile, "w", newline = ""))
+	if args.format == "json":
+		json.dump(report, f, indent = 4)
+		print(file = f)
+	else:
+		writer = csv.writer(f)
+		writer.writerow([ "statistic", "value", "count" ])
+		for (name, value) in report["summary"].items():
+			writer.writerow([ "summary", name, value ])
+		for (name, values) in report["distributions"].items():
+			for (value, count) in values:
+				writer.writerow([ name, value, count ])
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import os
+from CertDatabase import CertDatabase
+from CertDecoder import CertDecoder
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Write (a deterministic part of) the certificates of a certificate database to individual files, e.g., as input for parser tests or fuzzers.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("--partition", metavar = "i/n", type = str, help = "Only export partition i of n (counting from 0). All n partitions together contain every certificate exactly once.")
+parser.add_argument("--sample", metavar = "ratio", type = float, help = "Only export this ratio of certificates. Which certificates are chosen only depends on the seed and is stable across runs.")
+parser.add_argument("--seed", metavar = "seed", type = int, default = 0, help = "Seed for sampling. Defaults to %(default)d.")
+parser.add_argument("--role", choices = [ "leaf", "ca" ], help = "Only export certificates that have been presented as leaf certificate or as CA certificate further up in a chain.")
+parser.add_argument("-f", "--format", choices = [ "der", "pem" ], default = "der", help = "Output file format. Defaults to %(default)s.")
+parser.add_argument("-l", "--list", action = "store_true", help = "Only print the hashes of the selected certificates instead of writing files.")
+parser.add_argument("outdir", nargs = "?", help = "Directory to write the certificates to, one file per certificate named by its SHA256 hash.")
+args = parser.parse_args(sys.argv[1:])
+
+if (args.outdir is None) and (not args.list):
+	parser.error("An output directory is required unless only listing.")
+
+certdb = CertDatabase(args.certdb)
+try:
+	corpus = certdb.corpus_iterator(partition = args.partition, sample_rate = args.sample, seed = args.seed, role = args.role)
+except ValueError as e:
+	parser.error(str(e))
+
+if not args.list:
+	os.makedirs(args.outdir, exist_ok = True)
+count = 0
+for (cert_sha256, der_cert) in corpus:
+	count += 1
+	if args.list:
+		print(cert_sha256.hex())
+	elif args.format == "der":
+		with open("%s/%s.der" % (args.outdir, cert_sha256.hex()), "wb") as f:
+			f.write(der_cert)
+	else:
+		with open("%s/%s.pem" % (args.outdir, cert_sha256.hex()), "w") as f:
+			f.write(CertDecoder.render_pem(der_cert) + "\n")
+if not args.list:
+	print("Exported %d certificates." % (count))
@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import json
+import time
+from CertDatabase import CertDatabase
+from DeltaSnapshot import DeltaSnapshotWriter, DeltaSnapshotException
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Export everything that was added to a certificate database after a previous snapshot, so that mirrors can update without downloading the whole database again. The manifest is written next to the output file with a .json suffix.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+group = parser.add_mutually_exclusive_group()
+group.add_argument("-m", "--since-manifest", metavar = "filename", type = str, help = "Export everything after the snapshot this manifest (of a full or a delta snapshot) describes.")
+group.add_argument("-i", "--since-conn-id", metavar = "conn_id", type = int, help = "Export all connections with a higher conn_id.")
+group.add_argument("-t", "--since-timestamp", metavar = "timet", type = int, help = "Export all connections starting with the first one that was fetched after this UNIX timestamp.")
+parser.add_argument("outfile", help = "Delta file to write.")
+args = parser.parse_args(sys.argv[1:])
+
+def show_progress(what, count):
+	print("Exported %d %s..." % (count, what))
+
+certdb = CertDatabase(args.certdb)
+(base_conn_id, base_manifest) = (0, None)
+if args.since_manifest is not None:
+	base_manifest = DeltaSnapshotWriter.read_manifest(args.since_manifest)
+	base_conn_id = base_manifest["conn_id"]
+elif args.since_conn_id is not None:
+	base_conn_id = args.since_conn_id
+elif args.since_timestamp is not None:
+	base_conn_id = certdb.conn_id_before(args.since_timestamp)
+
+t0 = time.time()
+try:
+	manifest = DeltaSnapshotWriter(certdb).write(args.outfile, base_conn_id = base_conn_id, base_manifest = base_manifest, progress_callback = show_progress)
+except DeltaSnapshotException as e:
+	print(str(e), file = sys.stderr)
+	sys.exit(1)
+with open(args.outfile + ".json", "w") as f:
+	json.dump(manifest, f, indent = 4, sort_keys = True)
+print("Exported %d connections (conn_id %d to %d) and %d new certificates in %.1f secs." % (manifest["connection_count"], base_conn_id + 1, manifest["conn_id"], manifest["certificate_count"], time.time() - t0))
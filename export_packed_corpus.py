@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import time
+from CertDatabase import CertDatabase
+from PackedCorpus import PackedCorpusWriter, PackedCorpusReader
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Export a certificate database into a single packed, memory-mappable file for read-only consumers.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("--verify", action = "store_true", help = "After exporting, read back every certificate and connection from the packed file and compare it against the certificate database.")
+parser.add_argument("outfile", help = "Packed corpus file to write.")
+args = parser.parse_args(sys.argv[1:])
+
+def show_progress(what, count):
+	print("Exported %d %s..." % (count, what))
+
+def verify(certdb, reader):
+	problems = 0
+	cert_count = 0
+	for (cert_hash, der_cert) in certdb.get_all_sorted_certificates():
+		cert_count += 1
+		packed_cert = reader.get_certificate(cert_hash)
+		if (packed_cert is None) or (packed_cert != der_cert):
+			print("Certificate %s differs." % (cert_hash.hex()))
+			problems += 1
+	if cert_count != reader.certificate_count:
+		print("Certificate count differs: %d in database, %d in packed corpus." % (cert_count, reader.certificate_count))
+		problems += 1
+
+	connection_count = 0
+	for connection in certdb.get_all_connections():
+		connection_count += 1
+		if reader.get_connection(connection.conn_id) != connection:
+			print("Connection %d differs." % (connection.conn_id))
+			problems += 1
+	if connection_count != reader.connection_count:
+		print("Connection count differs: %d in database, %d in packed corpus." % (connection_count, reader.connection_count))
+		problems += 1
+	for (servername, max_fetch_timestamp) in certdb.get_most_recent_connections():
+		if list(reader.get_connections_by_servername(servername)) != list(certdb.get_connections_by_servername(servername)):
+			print("Connections of %s differ." % (servername))
+			problems += 1
+	return problems
+
+certdb = CertDatabase(args.certdb)
+t0 = time.time()
+(cert_count, connection_count) = PackedCorpusWriter(certdb).write(args.outfile, progress_callback = show_progress)
+print("Exported %d certificates and %d connections in %.1f secs." % (cert_count, connection_count, time.time() - t0))
+
+if args.verify:
+	with PackedCorpusReader(args.outfile) as reader:
+		problems = verify(certdb, reader)
+	if problems > 0:
+		print("Verification found %d problems." % (problems))
+		sys.exit(1)
+	print("Packed corpus matches the certificate database.")
@@ -4,32 +4,104 @@
 #   License: CC-0
 
 import sys
-import subprocess
 import glob
 import re
-import hashlib
+import functools
 from CertDatabase import CertDatabase
+from CertDecoder import CertDecoder
+from CertRenderer import CertRenderer
+from CertQuery import CertQueryClient, CertQueryException, default_socket_filename
 from FriendlyArgumentParser import FriendlyArgumentParser
 
 parser = FriendlyArgumentParser(description = "Search certificate database for a certificate which contains the proper data.")
 parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
 parser.add_argument("-n", "--nth-match", metavar = "no", type = int, default = 1, help = "Show the n-th match. Defaults to the first match.")
-parser.add_argument("searchstring", help = "Search for this pattern within the OpenSSL text representation of the certificate.")
+parser.add_argument("-l", "--list", action = "store_true", help = "List the hashes and subjects of all matching certificates instead of showing a single one. Requires the index.")
+parser.add_argument("--subject", metavar = "text", type = str, help = "Only match certificates whose subject contains this text. Requires the index.")
+parser.add_argument("--issuer", metavar = "text", type = str, help = "Only match certificates whose issuer contains this text. Requires the index.")
+parser.add_argument("--san", metavar = "text", type = str, help = "Only match certificates whose subject alternative name contains this text. Requires the index.")
+parser.add_argument("--serial", metavar = "hex", type = str, help = "Only match certificates with this serial number. Requires the index.")
+parser.add_argument("--key-algorithm", metavar = "text", type = str, help = "Only match certificates whose public key algorithm contains this text. Requires the index.")
+parser.add_argument("--key-size", metavar = "bits", type = int, help = "Only match certificates with this public key size. Requires the index.")
+parser.add_argument("--signature-algorithm", metavar = "text", type = str, help = "Only match certificates whose signature algorithm contains this text. Requires the index.")
+parser.add_argument("--extension", metavar = "oid", type = str, help = "Only match certificates that contain an extension with this OID. Requires the index.")
+parser.add_argument("--fulltext", metavar = "query", type = str, help = "Only match certificates that satisfy this SQLite FTS5 full-text query. Requires the index.")
+parser.add_argument("--no-index", action = "store_true", help = "Do not use the index even if it is present, but render every certificate with OpenSSL.")
+parser.add_argument("--daemon", action = "store_true", help = "Answer index queries through a running query_daemon.py for the database. Falls back to opening the database if no daemon is running.")
+parser.add_argument("--render-cache", metavar = "filename", type = str, help = "Keep rendered certificates in this Sqlite3 file and reuse them in later runs.")
+parser.add_argument("-p", "--parallel", metavar = "processes", type = int, help = "Number of concurrent processes that search when not using the index. Defaults to the number of CPUs.")
+parser.add_argument("searchstring", nargs = "?", help = "Search for this pattern within the OpenSSL text representation of the certificate.")
 args = parser.parse_args(sys.argv[1:])
 
+def match_cert(regex, cert_sha256, der_cert):
+	if regex.search(CertDecoder.render_text(der_cert)):
+		return (cert_sha256, der_cert)
+
+def show_progress(scanner):
+	print("Searching %d of %d (%.1f%%), %.0f certs/sec..." % (scanner.scanned_count, cert_count, scanner.scanned_count / cert_count * 100, scanner.throughput))
+
+def show_match(cert_sha256, der_cert):
+	with CertRenderer(cache_filename = args.render_cache) as renderer:
+		print(renderer.pem(cert_sha256, der_cert) + "\n")
+		print(renderer.text(cert_sha256, der_cert))
+	print("SHA256: %s" % (cert_sha256.hex()))
+
+field_criteria = {
+	"subject":				args.subject,
+	"issuer":				args.issuer,
+	"san":					args.san,
+	"serial":				args.serial,
+	"key_algorithm":		args.key_algorithm,
+	"key_size":				args.key_size,
+	"signature_algorithm":	args.signature_algorithm,
+	"extension_oid":		args.extension,
+	"fulltext":				args.fulltext,
+}
+have_field_criteria = any(value is not None for value in field_criteria.values())
+
+client = CertQueryClient.connect(default_socket_filename(args.certdb)) if (args.daemon and (not args.no_index)) else None
+if (client is not None) and client.has_index:
+	try:
+		matches = client.search(limit = None if args.list else args.nth_match, regex = args.searchstring, **field_criteria)
+	except CertQueryException as e:
+		print("Query failed: %s" % (str(e)))
+		sys.exit(1)
+	if args.list:
+		for (cert_sha256, subject) in matches:
+			print("%s %s" % (cert_sha256.hex(), subject))
+		sys.exit(0)
+	if len(matches) == args.nth_match:
+		cert_sha256 = matches[-1][0]
+		show_match(cert_sha256, client.get_certificate(cert_sha256))
+		sys.exit(0)
+	sys.exit(1)
+
 certdb = CertDatabase(args.certdb)
-cert_count = certdb.certificate_count
-regex = re.compile(args.searchstring, flags = re.MULTILINE | re.IGNORECASE)
-matchno = 0
-for (certno, der_cert) in enumerate(certdb.get_all_certificates()):
-	if (certno % 100) == 0:
-		print("Searching %d of %d (%.1f%%)..." % (certno, cert_count, certno / cert_count * 100))
-	cert_text = subprocess.check_output([ "openssl", "x509", "-inform", "der", "-text", "-noout" ], input = der_cert).decode()
-	if regex.search(cert_text):
-		matchno += 1
+if (certdb.index is not None) and (not args.no_index):
+	matches = certdb.index.search(regex = args.searchstring, **field_criteria)
+	if args.list:
+		for cert_sha256 in matches:
+			print("%s %s" % (cert_sha256.hex(), certdb.index.get(cert_sha256).subject))
+		sys.exit(0)
+	for (matchno, cert_sha256) in enumerate(matches, 1):
 		if matchno == args.nth_match:
-			cert_pem = subprocess.check_output([ "openssl", "x509", "-inform", "der" ], input = der_cert).decode()
-			print(cert_pem)
-			print(cert_text)
-			print("SHA256: %s" % (hashlib.sha256(der_cert).hexdigest()))
+			# Finish the index query before the database is closed on exit
+			matches.close()
+			show_match(cert_sha256, certdb.get_certificate(cert_sha256))
 			sys.exit(0)
+	sys.exit(1)
+
+if have_field_criteria or args.list:
+	parser.error("Field queries and listing require the certificate index, create it using build_index.py.")
+if args.searchstring is None:
+	parser.error("Without the certificate index, a search string is required.")
+
+cert_count = certdb.certificate_count
+regex = re.compile(args.searchstring, flags = re.MULTILINE | re.IGNORECASE)
+scanner = certdb.scanner(processes = args.parallel, rowids_per_unit = 1000)
+matches = list(scanner.scan(functools.partial(match_cert, regex), ordered = True, limit = args.nth_match, progress_callback = show_progress))
+print("Searched %d certificates in %.0f secs (%.0f certs/sec)." % (scanner.scanned_count, scanner.elapsed, scanner.throughput))
+if len(matches) == args.nth_match:
+	show_match(*matches[-1])
+	sys.exit(0)
+sys.exit(1)
@@ -5,13 +5,20 @@
 
 import sys
 from CertDatabase import CertDatabase
+from CertRenderer import CertRenderer
+from CertQuery import CertQueryClient, default_socket_filename
 from FriendlyArgumentParser import FriendlyArgumentParser
 
 parser = FriendlyArgumentParser(description = "Search certificate database for a certificate which contains the proper data.")
 parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("--daemon", action = "store_true", help = "Ask a running query_daemon.py for the database instead of opening it. Falls back to opening the database if no daemon is running.")
+parser.add_argument("-t", "--text", action = "store_true", help = "Also print the OpenSSL text representation of every certificate.")
+parser.add_argument("--render-cache", metavar = "filename", type = str, help = "Keep rendered certificates in this Sqlite3 file and reuse them in later runs.")
 parser.add_argument("conn_id", type = int, help = "Connection ID to dump certificates of")
 args = parser.parse_args(sys.argv[1:])
 
-certdb = CertDatabase(args.certdb)
+client = CertQueryClient.connect(default_socket_filename(args.certdb)) if args.daemon else None
+certdb = client if (client is not None) else CertDatabase(args.certdb)
 connection = certdb.get_connection(args.conn_id)
-CertDatabase.dump_connection(connection)
+with CertRenderer(cache_filename = args.render_cache) as renderer:
+	CertDatabase.dump_connection(connection, renderer = renderer, text = args.text)
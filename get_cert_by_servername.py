@@ -5,14 +5,21 @@
 
 import sys
 from CertDatabase import CertDatabase
+from CertRenderer import CertRenderer
+from CertQuery import CertQueryClient, default_socket_filename
 from FriendlyArgumentParser import FriendlyArgumentParser
 
 parser = FriendlyArgumentParser(description = "Search certificate database for a certificate which contains the proper data.")
 parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("--daemon", action = "store_true", help = "Ask a running query_daemon.py for the database instead of opening it. Falls back to opening the database if no daemon is running.")
+parser.add_argument("-t", "--text", action = "store_true", help = "Also print the OpenSSL text representation of every certificate.")
+parser.add_argument("--render-cache", metavar = "filename", type = str, help = "Keep rendered certificates in this Sqlite3 file and reuse them in later runs.")
 parser.add_argument("domainname", type = str, help = "Domain name to dump certificates of")
 args = parser.parse_args(sys.argv[1:])
 
-certdb = CertDatabase(args.certdb)
+client = CertQueryClient.connect(default_socket_filename(args.certdb)) if args.daemon else None
+certdb = client if (client is not None) else CertDatabase(args.certdb)
 connections = certdb.get_connections_by_servername(args.domainname)
-for connection in connections:
-	CertDatabase.dump_connection(connection)
+with CertRenderer(cache_filename = args.render_cache) as renderer:
+	for connection in connections:
+		CertDatabase.dump_connection(connection, renderer = renderer, text = args.text)
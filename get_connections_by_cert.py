@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import datetime
+from CertDatabase import CertDatabase
+from CertRenderer import CertRenderer
+from CertQuery import CertQueryClient, default_socket_filename
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Show all connections in which a certificate was presented.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("--daemon", action = "store_true", help = "Ask a running query_daemon.py for the database instead of opening it. Falls back to opening the database if no daemon is running.")
+parser.add_argument("-t", "--text", action = "store_true", help = "Also print the OpenSSL text representation of every certificate.")
+parser.add_argument("--render-cache", metavar = "filename", type = str, help = "Keep rendered certificates in this Sqlite3 file and reuse them in later runs.")
+parser.add_argument("-d", "--dump", action = "store_true", help = "Dump the whole connections including all certificates instead of listing them.")
+parser.add_argument("cert_hash", type = str, help = "SHA256 hash of the certificate in hex, or a prefix of it of at least 8 characters.")
+args = parser.parse_args(sys.argv[1:])
+
+try:
+	cert_hash = bytes.fromhex(args.cert_hash)
+except ValueError:
+	parser.error("Not a hexadecimal hash: %s" % (args.cert_hash))
+if not (4 <= len(cert_hash) <= 32):
+	parser.error("The hash prefix must be between 8 and 64 hex characters long.")
+
+client = CertQueryClient.connect(default_socket_filename(args.certdb)) if args.daemon else None
+certdb = client if (client is not None) else CertDatabase(args.certdb)
+renderer = CertRenderer(cache_filename = args.render_cache)
+found = False
+for connection in certdb.get_connections_by_cert(cert_hash, hashes_only = not args.dump):
+	found = True
+	if args.dump:
+		CertDatabase.dump_connection(connection, renderer = renderer, text = args.text)
+	else:
+		positions = [ str(position) for (position, hashval) in enumerate(connection.certs) if (hashval is not None) and hashval.startswith(cert_hash) ]
+		fetch_ts = datetime.datetime.utcfromtimestamp(connection.fetch_timestamp).strftime("%Y-%m-%d %H:%M:%S")
+		print("%8d %s %s position %s" % (connection.conn_id, fetch_ts, connection.servername, ", ".join(positions)))
+renderer.close()
+if not found:
+	print("No connection presented this certificate.")
+	sys.exit(1)
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import sys
+import time
+from CertDatabase import CertDatabase
+from DeltaSnapshot import DeltaSnapshotReader, DeltaSnapshotException
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Apply a delta written by export_delta.py to a copy of the snapshot it was based on and verify the result.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("-m", "--manifest", metavar = "filename", type = str, help = "Published manifest to check the delta against before applying it. Defaults to the delta filename with a .json suffix, if that file exists.")
+parser.add_argument("--skip-verify", action = "store_true", help = "Do not verify the database against the delta after applying it.")
+parser.add_argument("infile", help = "Delta file to apply.")
+args = parser.parse_args(sys.argv[1:])
+
+manifest_filename = args.manifest
+if (manifest_filename is None) and os.path.exists(args.infile + ".json"):
+	manifest_filename = args.infile + ".json"
+
+try:
+	reader = DeltaSnapshotReader(args.infile)
+except DeltaSnapshotException as e:
+	print(str(e))
+	sys.exit(1)
+
+with reader:
+	if manifest_filename is not None:
+		problems = reader.check_manifest(reader.read_manifest(manifest_filename))
+		if len(problems) > 0:
+			for problem in problems:
+				print("%s: %s" % (manifest_filename, problem))
+			sys.exit(1)
+
+	certdb = CertDatabase(args.certdb)
+	t0 = time.time()
+	try:
+		(connection_count, new_cert_count) = reader.apply(certdb)
+	except DeltaSnapshotException as e:
+		print(str(e))
+		sys.exit(1)
+	print("Applied %d connections and %d new certificates in %.1f secs." % (connection_count, new_cert_count, time.time() - t0))
+
+	if not args.skip_verify:
+		problems = reader.verify(certdb)
+		if len(problems) > 0:
+			for problem in problems:
+				print(problem)
+			sys.exit(1)
+		print("Database matches the delta, now at conn_id %d." % (reader.manifest["conn_id"]))
@@ -4,7 +4,10 @@
 #   License: CC-0
 
 import sys
+import io
+import time
 import sqlite3
+import zipfile
 import contextlib
 import csv
 from FriendlyArgumentParser import FriendlyArgumentParser
@@ -12,7 +15,8 @@ from FriendlyArgumentParser import FriendlyArgumentParser
 parser = FriendlyArgumentParser(description = "Import domain names from CSV lists and already scraped certificates.")
 parser.add_argument("-d", "--domainname-dbfile", metavar = "filename", type = str, default = "certs/domainnames.sqlite3", help = "Specifies database file that contains the domain names to scrape. Defaults to %(default)s.")
 parser.add_argument("--reset", action = "store_true", help = "Clear the domain name information and rely solely on the information found in the database.")
-parser.add_argument("csvfiles", nargs = "*", help = "Import content of these CSV file(s).")
+parser.add_argument("--chunk-size", metavar = "rows", type = int, default = 100000, help = "Number of CSV rows that are deduplicated and written in one batch. Defaults to %(default)d.")
+parser.add_argument("csvfiles", nargs = "*", help = "Import content of these CSV file(s). ZIP files are read directly and all CSV files within them imported.")
 args = parser.parse_args(sys.argv[1:])
 
 def show_stats(cursor):
@@ -36,19 +40,51 @@ if args.reset:
 	print("Resetting local database content...")
 	cursor.execute("UPDATE domainnames SET last_successful_timet = 0, last_attempted_timet = 0, last_result = NULL;")
 
+def open_csv_files(filename):
+	if zipfile.is_zipfile(filename):
+		with zipfile.ZipFile(filename) as zf:
+			for member in zf.namelist():
+				if member.lower().endswith(".csv"):
+					with zf.open(member) as f:
+						yield ("%s:%s" % (filename, member), io.TextIOWrapper(f, encoding = "utf-8", errors = "replace", newline = ""))
+	else:
+		with open(filename, encoding = "utf-8", errors = "replace", newline = "") as f:
+			yield (filename, f)
+
+def normalize_domainname(domainname):
+	return domainname.strip().rstrip(".").lower()
+
+def read_chunks(f, chunk_size):
+	# Yields (number of rows read, set of normalized domain names) per chunk
+	(row_count, chunk) = (0, set())
+	for row in csv.reader(f):
+		row_count += 1
+		if len(row) != 2:
+			continue
+		(pos, domainname) = row
+		domainname = normalize_domainname(domainname)
+		if domainname != "":
+			chunk.add(domainname)
+		if row_count >= chunk_size:
+			yield (row_count, chunk)
+			(row_count, chunk) = (0, set())
+	if row_count > 0:
+		yield (row_count, chunk)
+
 # Import the CSV file(s) that was/were given on the command line
 for filename in args.csvfiles:
-	print("Processing CSV %s..." % (filename))
-	with open(filename) as f:
-		for row in csv.reader(f):
-			if len(row) != 2:
-				continue
-			(pos, domainname) = row
-
-			(count, ) = cursor.execute("SELECT COUNT(*) FROM domainnames WHERE domainname = ?;", (domainname, )).fetchone()
-			if count == 0:
-				# We do not have this entry yet, create it.
-				cursor.execute("INSERT INTO domainnames (domainname, last_successful_timet, last_attempted_timet) VALUES (?, 0, 0);", (domainname, ))
-	db.commit()
+	for (csv_name, f) in open_csv_files(filename):
+		print("Processing CSV %s..." % (csv_name))
+		t0 = time.time()
+		(row_count, new_count, existing_count) = (0, 0, 0)
+		for (chunk_row_count, domainnames) in read_chunks(f, args.chunk_size):
+			changes_before = db.total_changes
+			cursor.executemany("INSERT OR IGNORE INTO domainnames (domainname, last_successful_timet, last_attempted_timet) VALUES (?, 0, 0);", ((domainname, ) for domainname in domainnames))
+			inserted = db.total_changes - changes_before
+			row_count += chunk_row_count
+			new_count += inserted
+			existing_count += len(domainnames) - inserted
+			db.commit()
+		t = time.time() - t0
+		print("Read %d rows in %.1f secs (%.0f rows/sec): %d new domain names, %d already known." % (row_count, t, row_count / t if (t > 0) else 0, new_count, existing_count))
 	show_stats(cursor)
-
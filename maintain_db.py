@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import time
+from CertDatabase import CertDatabase
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Maintain the databases of a certificate database: rebuild those that have many free pages or changed a lot since their last rebuild and refresh the query planner statistics of all others that changed. Unchanged databases are skipped.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("-p", "--parallel", metavar = "processes", type = int, help = "Number of databases that are maintained concurrently. Defaults to the number of CPUs.")
+parser.add_argument("--free-threshold", metavar = "ratio", type = float, default = 0.1, help = "Rebuild databases in which at least this fraction of pages is free. Defaults to %(default).2f.")
+parser.add_argument("--change-threshold", metavar = "ratio", type = float, default = 0.25, help = "Rebuild databases whose row count changed by at least this fraction since their last rebuild. Defaults to %(default).2f.")
+parser.add_argument("--online", action = "store_true", help = "Do not rebuild anything, so that readers are not blocked. Free pages are released by incremental vacuum, which requires databases that were created or rebuilt by this version.")
+parser.add_argument("-f", "--force", action = "store_true", help = "Rebuild all databases regardless of thresholds.")
+parser.add_argument("-n", "--dry-run", action = "store_true", help = "Only show what would be done.")
+parser.add_argument("--state", metavar = "filename", type = str, help = "JSON file that keeps the statistics of the last run. Defaults to maintenance.json inside the certificate database directory.")
+args = parser.parse_args(sys.argv[1:])
+
+certdb = CertDatabase(args.certdb)
+maintenance = certdb.maintenance(state_filename = args.state, free_threshold = args.free_threshold, change_threshold = args.change_threshold, online = args.online, force = args.force, processes = args.parallel)
+
+if args.dry_run:
+	for (unit, stats) in maintenance.plan():
+		free_ratio = stats.freelist_count / stats.page_count if (stats.page_count > 0) else 0
+		print("%-6s %-18s %10d bytes, %5.1f%% free, %d rows" % (unit.name, unit.action, stats.file_size, free_ratio * 100, stats.row_count))
+	sys.exit(0)
+
+t0 = time.time()
+(reclaimed, maintained_count) = (0, 0)
+for (name, action, size_before, size_after, duration) in maintenance.run():
+	if action == "skip":
+		continue
+	maintained_count += 1
+	reclaimed += size_before - size_after
+	print("%-6s %-18s %10d -> %10d bytes in %.1f secs" % (name, action, size_before, size_after, duration))
+print("Maintained %d databases in %.1f secs, reclaimed %.1f MiB." % (maintained_count, time.time() - t0, reclaimed / 1024 / 1024))
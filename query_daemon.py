@@ -0,0 +1,24 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+from CertQuery import CertQueryServer, CertQueryException
+from FriendlyArgumentParser import FriendlyArgumentParser
+
+parser = FriendlyArgumentParser(description = "Keep a certificate database open and answer lookups of get_cert_by_id.py, get_cert_by_servername.py, get_connections_by_cert.py and find_cert.py (when run with --daemon) over a Unix socket.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("-s", "--socket", metavar = "filename", type = str, help = "Unix socket to listen on. Defaults to query.sock inside the certificate database directory, which is where the tools look for it.")
+parser.add_argument("-t", "--threads", metavar = "count", type = int, default = 4, help = "Number of worker threads, each with its own set of database connections. Defaults to %(default)d.")
+parser.add_argument("--cache-size", metavar = "certs", type = int, default = 16384, help = "Number of certificates kept in memory. Defaults to %(default)d.")
+parser.add_argument("--page-cache", metavar = "MiB", type = int, default = 64, help = "Sqlite3 page cache per open database file. Defaults to %(default)d MiB.")
+args = parser.parse_args(sys.argv[1:])
+
+server = CertQueryServer(args.certdb, socket_filename = args.socket, threads = args.threads, cache_size = args.cache_size, pragmas = { "cache_size": -args.page_cache * 1024 })
+print("Listening on %s" % (server.socket_filename))
+try:
+	server.run()
+except CertQueryException as e:
+	print(str(e))
+	sys.exit(1)
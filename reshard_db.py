@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import sys
+import time
+from CertDatabase import CertDatabase
+from CertResharder import CertResharderException
+from FriendlyArgumentParser import FriendlyArgumentParser
+from ShardLayout import ShardLayout
+
+parser = FriendlyArgumentParser(description = "Change the number of shards that the certificates of a database are distributed over. Must be run while nothing else accesses the database. When interrupted, rerunning it with the same shard count resumes where it stopped.")
+parser.add_argument("-c", "--certdb", metavar = "path", type = str, default = "certs", help = "Specifies the path of the certificate database. Defaults to %(default)s.")
+parser.add_argument("-p", "--parallel", metavar = "processes", type = int, help = "Number of shards that are built concurrently. Defaults to the number of CPUs.")
+parser.add_argument("-b", "--batch-size", metavar = "count", type = int, default = 5000, help = "Number of certificates that are written per transaction. Defaults to %(default)d.")
+parser.add_argument("-s", "--shards", metavar = "count", type = int, choices = ShardLayout.SHARD_COUNTS, required = True, help = "New number of shards. Can be one of %s." % (", ".join(str(count) for count in ShardLayout.SHARD_COUNTS)))
+args = parser.parse_args(sys.argv[1:])
+
+certdb = CertDatabase(args.certdb)
+(source_shard_count, certificate_count) = (certdb.layout.shard_count, certdb.certificate_count)
+try:
+	resharder = certdb.resharder(args.shards, processes = args.parallel, batch_size = args.batch_size)
+except CertResharderException as e:
+	print(e, file = sys.stderr)
+	sys.exit(1)
+certdb.close()
+
+def progress(name, cert_count, duration):
+	print("%s: %d certificates in %.1f secs" % (name, cert_count, duration))
+
+t0 = time.time()
+try:
+	resharder.run(progress_callback = progress)
+except CertResharderException as e:
+	print(e, file = sys.stderr)
+	sys.exit(1)
+
+certdb = CertDatabase(args.certdb)
+if certdb.certificate_count != certificate_count:
+	print("Database holds %d certificates after resharding, %d before." % (certdb.certificate_count, certificate_count), file = sys.stderr)
+	sys.exit(1)
+print("Resharded %d certificates from %d to %d shards in %.1f secs." % (certificate_count, source_shard_count, certdb.layout.shard_count, time.time() - t0))
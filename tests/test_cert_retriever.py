@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import ssl
+import shutil
+import socket
+import asyncio
+import tempfile
+import unittest
+import threading
+import subprocess
+from CertRetriever import CertRetriever, AsyncCertRetriever
+
+class LocalTLSServer():
+	# Accepts connections on localhost in a background thread and completes
+	# the TLS handshake with the given chain. Without a chain, connections
+	# are accepted but the handshake is never answered.
+	def __init__(self, chain_filename = None, key_filename = None):
+		self._ssl_context = None
+		if chain_filename is not None:
+			self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+			self._ssl_context.load_cert_chain(chain_filename, key_filename)
+		self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self._socket.bind(("127.0.0.1", 0))
+		self._socket.listen(16)
+		self._socket.settimeout(0.1)
+		self._stalled = [ ]
+		self._running = True
+		self._thread = threading.Thread(target = self._serve, daemon = True)
+		self._thread.start()
+
+	@property
+	def port(self):
+		return self._socket.getsockname()[1]
+
+	def _serve(self):
+		while self._running:
+			try:
+				(conn, addr) = self._socket.accept()
+			except socket.timeout:
+				continue
+			if self._ssl_context is None:
+				self._stalled.append(conn)
+				continue
+			try:
+				conn.settimeout(5)
+				with self._ssl_context.wrap_socket(conn, server_side = True) as tls_conn:
+					tls_conn.recv(1)
+			except (OSError, ssl.SSLError):
+				conn.close()
+
+	def close(self):
+		self._running = False
+		self._thread.join()
+		self._socket.close()
+		for conn in self._stalled:
+			conn.close()
+
+@unittest.skipIf(shutil.which("openssl") is None, "openssl binary required")
+class CertRetrieverTests(unittest.TestCase):
+	@classmethod
+	def _openssl(cls, *args):
+		subprocess.check_call([ "openssl" ] + list(args), cwd = cls._tmpdir.name, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+	@classmethod
+	def _read_der(cls, name):
+		with open(os.path.join(cls._tmpdir.name, name)) as f:
+			return ssl.PEM_cert_to_DER_cert(f.read())
+
+	@classmethod
+	def setUpClass(cls):
+		# Root, intermediate and server certificate
+		cls._tmpdir = tempfile.TemporaryDirectory()
+		ec_key = [ "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes" ]
+		cls._openssl("req", "-x509", *ec_key, "-keyout", "root.key", "-out", "root.pem", "-subj", "/CN=Test Root", "-days", "2")
+		cls._openssl("req", *ec_key, "-keyout", "intermediate.key", "-out", "intermediate.csr", "-subj", "/CN=Test Intermediate")
+		cls._openssl("x509", "-req", "-in", "intermediate.csr", "-CA", "root.pem", "-CAkey", "root.key", "-CAcreateserial", "-out", "intermediate.pem", "-days", "2")
+		cls._openssl("req", *ec_key, "-keyout", "server.key", "-out", "server.csr", "-subj", "/CN=localhost")
+		cls._openssl("x509", "-req", "-in", "server.csr", "-CA", "intermediate.pem", "-CAkey", "intermediate.key", "-CAcreateserial", "-out", "server.pem", "-days", "2")
+		chain_filename = os.path.join(cls._tmpdir.name, "chain.pem")
+		with open(chain_filename, "w") as f:
+			for name in [ "server.pem", "intermediate.pem" ]:
+				with open(os.path.join(cls._tmpdir.name, name)) as cert_file:
+					f.write(cert_file.read())
+		cls._chain = [ cls._read_der("server.pem"), cls._read_der("intermediate.pem") ]
+		cls._server = LocalTLSServer(chain_filename, os.path.join(cls._tmpdir.name, "server.key"))
+
+	@classmethod
+	def tearDownClass(cls):
+		cls._server.close()
+		cls._tmpdir.cleanup()
+
+	def _retrieve_async(self, port, timeout = 5):
+		retriever = AsyncCertRetriever(timeout = timeout)
+		return asyncio.run(retriever.retrieve("127.0.0.1", port = port))
+
+	def _unused_port(self):
+		with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+			sock.bind(("127.0.0.1", 0))
+			return sock.getsockname()[1]
+
+	def test_async_chain(self):
+		(result, der_certs) = self._retrieve_async(self._server.port)
+		self.assertEqual(result, "ok")
+		if AsyncCertRetriever(timeout = 5).leaf_only:
+			self.assertEqual(der_certs, self._chain[:1])
+		else:
+			self.assertEqual(der_certs, self._chain)
+
+	def test_async_timings(self):
+		timings = { }
+		retriever = AsyncCertRetriever(timeout = 5)
+		(result, der_certs) = asyncio.run(retriever.retrieve("127.0.0.1", port = self._server.port, timings = timings))
+		self.assertEqual(result, "ok")
+		self.assertEqual(set(timings), { "dns", "connect", "handshake", "parse" })
+
+	def test_async_connection_refused(self):
+		self.assertEqual(self._retrieve_async(self._unused_port()), ("error", None))
+
+	def test_async_handshake_timeout(self):
+		server = LocalTLSServer()
+		try:
+			self.assertEqual(self._retrieve_async(server.port, timeout = 0.5), ("timeout", None))
+		finally:
+			server.close()
+
+	def test_async_many_concurrent(self):
+		async def retrieve_all():
+			retriever = AsyncCertRetriever(timeout = 5)
+			return await asyncio.gather(*(retriever.retrieve("127.0.0.1", port = self._server.port) for i in range(20)))
+		results = asyncio.run(retrieve_all())
+		self.assertTrue(all((result == "ok") and (der_certs[0] == self._chain[0]) for (result, der_certs) in results))
+
+	def test_openssl_retriever_matches(self):
+		(result, der_certs) = CertRetriever(timeout = 5).retrieve("127.0.0.1", port = self._server.port)
+		self.assertEqual(result, "ok")
+		self.assertEqual(der_certs, self._chain)
+
+	def test_openssl_connection_refused(self):
+		self.assertEqual(CertRetriever(timeout = 5).retrieve("127.0.0.1", port = self._unused_port()), ("error", None))
+
+if __name__ == "__main__":
+	unittest.main()
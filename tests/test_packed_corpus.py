@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import os
+import random
+import hashlib
+import tempfile
+import unittest
+from CertDatabase import CertDatabase
+from PackedCorpus import PackedCorpusWriter, PackedCorpusReader, PackedCorpusException
+
+class PackedCorpusTests(unittest.TestCase):
+	def setUp(self):
+		self._tmpdir = tempfile.TemporaryDirectory()
+		self._certdb = CertDatabase(self._tmpdir.name, shard_count = 16)
+		self._packed_filename = self._tmpdir.name + "/corpus.pck"
+
+	def tearDown(self):
+		self._certdb.close()
+		self._tmpdir.cleanup()
+
+	def _populate(self, connection_count = 300, seed = 0):
+		# Certificates are random blobs behind a DER sequence tag, storage
+		# does not parse them any further. Server names repeat and include
+		# non-ASCII ones, some connections reference certificates that were
+		# never stored.
+		rng = random.Random(seed)
+		certs = [ b"\x30\x82" + rng.randbytes(rng.randint(200, 1200)) for i in range(150) ]
+		servernames = [ "host%d.example.com" % (i) for i in range(40) ] + [ "bücher.example.de", "例え.jp", "a", "B" ]
+		for i in range(connection_count):
+			chain = rng.sample(certs, rng.randint(1, 4))
+			hashed_certs = [ (hashlib.sha256(cert).digest(), cert) for cert in chain ]
+			if rng.random() < 0.1:
+				hashed_certs.append((hashlib.sha256(rng.randbytes(16)).digest(), None))
+			self._certdb.insert_hashed_connection(servername = rng.choice(servernames), fetch_timestamp = 1500000000 + rng.randint(0, 1000), hashed_certs = hashed_certs, leaf_only = rng.random() < 0.3)
+		# Gaps in the conn_ids
+		for conn_id in [ 1, 17, 18, 150 ]:
+			self._certdb.remove_connection(conn_id)
+		self._certdb.commit()
+
+	def _export(self):
+		return PackedCorpusWriter(self._certdb).write(self._packed_filename)
+
+	def _assert_connection_equal(self, packed_connection, connection):
+		self.assertEqual(packed_connection.conn_id, connection.conn_id)
+		self.assertEqual(packed_connection.leaf_only, bool(connection.leaf_only))
+		self.assertEqual(packed_connection.fetch_timestamp, connection.fetch_timestamp)
+		self.assertEqual(packed_connection.servername, connection.servername)
+		self.assertEqual([ None if (cert is None) else bytes(cert) for cert in packed_connection.certs ], connection.certs)
+
+	def test_round_trip(self):
+		self._populate()
+		(cert_count, connection_count) = self._export()
+		self.assertEqual(cert_count, self._certdb.certificate_count)
+		self.assertEqual(connection_count, self._certdb.connection_count)
+		connections = sorted(self._certdb.get_all_connections(), key = lambda connection: connection.conn_id)
+		with PackedCorpusReader(self._packed_filename) as reader:
+			self.assertEqual(reader.certificate_count, cert_count)
+			self.assertEqual(reader.connection_count, connection_count)
+			self.assertEqual([ (cert_hash, bytes(der_cert)) for (cert_hash, der_cert) in reader.get_all_certificates() ], list(self._certdb.get_all_sorted_certificates()))
+			packed_connections = list(reader.get_all_connections())
+			self.assertEqual(len(packed_connections), len(connections))
+			for (packed_connection, connection) in zip(packed_connections, connections):
+				self._assert_connection_equal(packed_connection, connection)
+				self._assert_connection_equal(reader.get_connection(connection.conn_id), connection)
+			self.assertTrue(any(cert is None for connection in packed_connections for cert in connection.certs))
+
+	def test_lookups(self):
+		self._populate()
+		self._export()
+		with PackedCorpusReader(self._packed_filename) as reader:
+			for servername in set(connection.servername for connection in self._certdb.get_all_connections(hashes_only = True)) | { "unknown.example.com", "" }:
+				expected = list(self._certdb.get_connections_by_servername(servername))
+				packed = list(reader.get_connections_by_servername(servername))
+				self.assertEqual([ connection.fetch_timestamp for connection in packed ], [ connection.fetch_timestamp for connection in expected ])
+				self.assertEqual(sorted(connection.conn_id for connection in packed), sorted(connection.conn_id for connection in expected))
+			for (cert_hash, der_cert) in self._certdb.get_all_sorted_certificates():
+				self.assertIn(cert_hash, reader)
+				self.assertEqual(bytes(reader.get_certificate(cert_hash)), der_cert)
+			self.assertNotIn(b"\x00" * 32, reader)
+			self.assertIsNone(reader.get_certificate(b"\x00" * 32))
+			for conn_id in [ 1, 17, 18, 150, 0, 100000 ]:
+				self.assertIsNone(reader.get_connection(conn_id))
+
+	def test_empty(self):
+		self.assertEqual(self._export(), (0, 0))
+		# Exporting does not create shards
+		self.assertEqual(sorted(os.listdir(self._tmpdir.name)), [ "corpus.pck", "toc.sqlite3" ])
+		with PackedCorpusReader(self._packed_filename) as reader:
+			self.assertEqual(list(reader.get_all_certificates()), [ ])
+			self.assertEqual(list(reader.get_all_connections()), [ ])
+			self.assertIsNone(reader.get_connection(1))
+
+	def test_not_a_corpus(self):
+		with open(self._packed_filename, "wb") as f:
+			f.write(bytes(256))
+		with self.assertRaises(PackedCorpusException):
+			PackedCorpusReader(self._packed_filename)
+		open(self._packed_filename, "wb").close()
+		with self.assertRaises(PackedCorpusException):
+			PackedCorpusReader(self._packed_filename)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import random
+import hashlib
+import unittest
+from PackedHashSet import PackedHashSet
+
+class PackedHashSetTests(unittest.TestCase):
+	@staticmethod
+	def _hashes(count, seed):
+		return [ hashlib.sha256(("%d-%d" % (seed, i)).encode()).digest() for i in range(count) ]
+
+	def test_union_packed(self):
+		existing = self._hashes(500, seed = 1)
+		added = self._hashes(300, seed = 2) + existing[:100]
+		random.Random(0).shuffle(added)
+		hash_set = PackedHashSet(existing)
+		hash_set.add(b"\xff" * 32)
+		union = hash_set.union_packed(b"".join(added + added[:50]))
+		expected = sorted(set(existing) | set(added) | { b"\xff" * 32 })
+		self.assertEqual(len(union), len(expected))
+		self.assertEqual(union.packed, b"".join(expected))
+		self.assertTrue(all(cert_hash in union for cert_hash in expected))
+		self.assertNotIn(b"\x00" * 32, union)
+
+	def test_union_packed_empty(self):
+		self.assertEqual(len(PackedHashSet().union_packed(b"")), 0)
+		hashes = self._hashes(10, seed = 3)
+		self.assertEqual(PackedHashSet(hashes).union_packed(b"").packed, b"".join(sorted(hashes)))
+
+	def test_add_compacts_overflow(self):
+		existing = self._hashes(100, seed = 4)
+		added = self._hashes(1000, seed = 5)
+		hash_set = PackedHashSet(existing)
+		hash_set.MIN_COMPACT_OVERFLOW = 16
+		for cert_hash in added + existing[:10]:
+			hash_set.add(cert_hash)
+			self.assertLessEqual(len(hash_set._overflow), max(16, len(hash_set) // 8))
+		self.assertEqual(len(hash_set), 1100)
+		self.assertTrue(all(cert_hash in hash_set for cert_hash in existing + added))
+		self.assertEqual(hash_set.packed, b"".join(sorted(existing + added)))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+#	x509-cert-testcorpus - X.509 certificate test corpus
+#	Copyright (C) 2019-2020 Johannes Bauer
+#   License: CC-0
+
+import heapq
+import random
+import unittest
+import collections
+from ScrapeScheduler import ScrapeScheduler
+
+class FakeClock():
+	def __init__(self):
+		self.now = 0
+
+	def __call__(self):
+		return self.now
+
+class SimulatedFleet():
+	# Drives a scheduler against simulated hosts in virtual time. Every host
+	# answers with a fixed result after a fixed latency, "lost" hosts never
+	# answer at all.
+	def __init__(self, scheduler, clock, hosts):
+		self._scheduler = scheduler
+		self._clock = clock
+		self._hosts = hosts
+		self._answers = [ ]
+		self.started = collections.defaultdict(list)
+		self.max_in_flight = 0
+		self.concurrencies = [ ]
+		self.lost = [ ]
+
+	def run(self, max_time = 100000):
+		while not self._scheduler.done:
+			self.assert_progress(max_time)
+			while True:
+				domainname = self._scheduler.next_ready()
+				if domainname is None:
+					break
+				self.started[domainname].append(self._clock.now)
+				(resultcode, latency) = self._hosts[domainname]
+				if resultcode != "lost":
+					heapq.heappush(self._answers, (self._clock.now + latency, domainname, resultcode, latency))
+			self.max_in_flight = max(self.max_in_flight, self._scheduler.in_flight)
+
+			# Advance to whatever happens next
+			next_times = [ self._clock.now + 1 ]
+			if len(self._answers) > 0:
+				next_times.append(self._answers[0][0])
+			if self._scheduler.time_until_ready() is not None:
+				next_times.append(self._clock.now + self._scheduler.time_until_ready())
+			self._clock.now = max(self._clock.now, min(next_times))
+			while (len(self._answers) > 0) and (self._answers[0][0] <= self._clock.now):
+				(answer_time, domainname, resultcode, latency) = heapq.heappop(self._answers)
+				self._scheduler.report(domainname, resultcode, latency)
+				self.concurrencies.append(self._scheduler.concurrency)
+			self.lost += self._scheduler.expire_lost()
+
+	def assert_progress(self, max_time):
+		if self._clock.now > max_time:
+			raise AssertionError("Simulation did not finish within %d seconds" % (max_time))
+
+class ScrapeSchedulerTests(unittest.TestCase):
+	@staticmethod
+	def _fleet(domain_count, hosts_per_domain, results):
+		# results is a list of (resultcode, latency) that hosts are assigned
+		# to round robin
+		hosts = { }
+		for domain in range(domain_count):
+			for host in range(hosts_per_domain):
+				hosts["host%d.example%d.com" % (host, domain)] = results[len(hosts) % len(results)]
+		return hosts
+
+	def _simulate(self, hosts, **kwargs):
+		clock = FakeClock()
+		domainnames = list(hosts)
+		random.Random(0).shuffle(domainnames)
+		scheduler = ScrapeScheduler(domainnames, clock = clock, **kwargs)
+		fleet = SimulatedFleet(scheduler, clock, hosts)
+		fleet.run()
+		return (scheduler, fleet)
+
+	def test_registrable_domain(self):
+		self.assertEqual(ScrapeScheduler.registrable_domain("www.example.com"), "example.com")
+		self.assertEqual(ScrapeScheduler.registrable_domain("a.b.example.co.uk."), "example.co.uk")
+		self.assertEqual(ScrapeScheduler.registrable_domain("Example.DE"), "example.de")
+		self.assertEqual(ScrapeScheduler.registrable_domain("192.0.2.1"), "192.0.2.1")
+
+	def test_gracetime_per_group(self):
+		hosts = self._fleet(20, 10, [ ("ok", 0.5), ("ok", 2), ("error", 0.25) ])
+		(scheduler, fleet) = self._simulate(hosts, min_spacing = 3, initial_concurrency = 10, max_concurrency = 50)
+		self.assertEqual(sorted(fleet.started), sorted(hosts))
+		self.assertTrue(all(len(start_times) == 1 for start_times in fleet.started.values()))
+		starts_by_key = collections.defaultdict(list)
+		for (domainname, start_times) in fleet.started.items():
+			starts_by_key[ScrapeScheduler.registrable_domain(domainname)] += start_times
+		for start_times in starts_by_key.values():
+			start_times.sort()
+			self.assertTrue(all(later - earlier >= 3 for (earlier, later) in zip(start_times, start_times[1:])))
+		self.assertEqual(scheduler.in_flight, 0)
+		self.assertEqual(sum(scheduler.result_counts.values()), len(hosts))
+
+	def test_concurrency_limit_and_increase(self):
+		hosts = self._fleet(500, 2, [ ("ok", 1) ])
+		(scheduler, fleet) = self._simulate(hosts, min_spacing = 1, initial_concurrency = 5, max_concurrency = 40, adjust_interval = 20)
+		self.assertLessEqual(fleet.max_in_flight, 40)
+		self.assertEqual(scheduler.concurrency, 40)
+		self.assertEqual(scheduler.result_counts["ok"], len(hosts))
+
+	def test_concurrency_decrease_on_failures(self):
+		hosts = self._fleet(1000, 1, [ ("timeout", 5), ("timeout", 5), ("ok", 1) ])
+		(scheduler, fleet) = self._simulate(hosts, initial_concurrency = 100, max_concurrency = 100, max_failure_ratio = 0.25, adjust_interval = 50)
+		self.assertLess(min(fleet.concurrencies), 100)
+		self.assertLessEqual(fleet.max_in_flight, 100)
+
+	def test_concurrency_decrease_on_latency(self):
+		hosts = self._fleet(1000, 1, [ ("ok", 10) ])
+		(scheduler, fleet) = self._simulate(hosts, initial_concurrency = 100, max_concurrency = 100, max_latency = 5, min_concurrency = 10, adjust_interval = 50)
+		self.assertEqual(scheduler.concurrency, 10)
+
+	def test_lost_results(self):
+		# Without lost_timeout, the scheduler would never be done
+		hosts = self._fleet(50, 4, [ ("ok", 1), ("lost", None), ("ok", 3), ("error", 1) ])
+		(scheduler, fleet) = self._simulate(hosts, min_spacing = 1, initial_concurrency = 20, max_concurrency = 20, lost_timeout = 60)
+		lost_hosts = sorted(domainname for (domainname, (resultcode, latency)) in hosts.items() if resultcode == "lost")
+		self.assertEqual(sorted(fleet.lost), lost_hosts)
+		self.assertEqual(scheduler.result_counts["lost"], len(lost_hosts))
+		self.assertEqual(scheduler.in_flight, 0)
+		self.assertTrue(scheduler.done)
+
+	def test_late_result_is_ignored(self):
+		clock = FakeClock()
+		scheduler = ScrapeScheduler([ "a.example.com", "b.example.org" ], initial_concurrency = 1, max_concurrency = 1, lost_timeout = 10, clock = clock)
+		self.assertEqual(scheduler.next_ready(), "a.example.com")
+		self.assertIsNone(scheduler.next_ready())
+		clock.now = 5
+		self.assertEqual(scheduler.expire_lost(), [ ])
+		clock.now = 10
+		self.assertEqual(scheduler.expire_lost(), [ "a.example.com" ])
+		self.assertEqual(scheduler.next_ready(), "b.example.org")
+		scheduler.report("a.example.com", "ok", 12)
+		self.assertEqual(scheduler.in_flight, 1)
+		scheduler.report("b.example.org", "ok", 1)
+		self.assertTrue(scheduler.done)
+		self.assertEqual(scheduler.result_counts, collections.Counter({ "lost": 1, "ok": 1 }))
+
+if __name__ == "__main__":
+	unittest.main()